@@ -0,0 +1,247 @@
+import fnmatch
+import hashlib
+import math
+import os
+import re
+import threading
+from collections import namedtuple
+
+from .config_values import as_number, as_object
+from .plugin_log import logger
+
+# 外部名单文件超过threshold条时改用Bloom过滤器保存，误判率为error_rate
+BloomConfig = namedtuple("BloomConfig", ["threshold", "error_rate"])
+
+# 名单规则中的正则表达式前缀，其他包含*?[的规则按glob处理
+_REGEX_PREFIX = "re:"
+_GLOB_CHARS = frozenset("*?[")
+
+# 可以从外部文件加载的名单
+ACCESS_LIST_NAMES = ("blacklist_groups", "blacklist_users", "whitelist_groups", "whitelist_users")
+
+
+def parse_bloom_filter(value):
+    """解析配置中的bloom_filter"""
+    value = as_object(value, "bloom_filter")
+    # threshold为0表示不使用布隆过滤器
+    threshold = as_number(value.get("threshold", 100000), "bloom_filter.threshold", 0, integer=True)
+    error_rate = as_number(value.get("error_rate", 0.0001), "bloom_filter.error_rate", high=1, positive=True)
+    if error_rate == 1:
+        raise ValueError(f"配置项bloom_filter.error_rate必须小于1: {error_rate!r}")
+    return BloomConfig(threshold, float(error_rate))
+
+
+def is_pattern(rule):
+    return rule.startswith(_REGEX_PREFIX) or not _GLOB_CHARS.isdisjoint(rule)
+
+
+def compile_patterns(rules):
+    """把glob和正则规则合并编译为一个正则，没有规则时返回None"""
+    parts = []
+    for rule in rules:
+        if rule.startswith(_REGEX_PREFIX):
+            source = rule[len(_REGEX_PREFIX):]
+        else:
+            source = fnmatch.translate(rule)
+        try:
+            re.compile(source)
+        except re.error as e:
+            raise ValueError(f"名单规则不是合法的表达式: {rule!r}: {e}") from None
+        parts.append(f"(?:{source})")
+    if not parts:
+        return None
+    return re.compile("|".join(parts))
+
+
+class BloomFilter:
+    """固定大小的Bloom过滤器，用于在内存中保存非常大的名单
+
+    只会误判存在（概率约为error_rate），不会漏判。名单只用于跳过随机回复，
+    少量误判的代价很小，换来的是内存占用只有集合的几十分之一。
+    """
+
+    __slots__ = ("capacity", "_bits", "_size", "_hashes", "count")
+
+    def __init__(self, capacity, error_rate):
+        capacity = max(capacity, 1)
+        size = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.capacity = capacity
+        self._size = size
+        self._hashes = max(int(round(size / capacity * math.log(2))), 1)
+        self._bits = bytearray((size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        size = self._size
+        return [(h1 + i * h2) % size for i in range(self._hashes)]
+
+    def add(self, item):
+        bits = self._bits
+        for pos in self._positions(item):
+            bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        bits = self._bits
+        for pos in self._positions(item):
+            if not bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def __len__(self):
+        return self.count
+
+
+class SideFile:
+    """从外部文件加载的名单，每行一个ID或规则，#开头为注释
+
+    文件只有追加内容时增量读取新增的行，文件被替换或截断时重新完整加载。
+    条目数超过Bloom过滤器阈值时改用Bloom过滤器保存ID。
+    """
+
+    def __init__(self, path, bloom):
+        self.path = path
+        self.bloom = bloom
+        self.ids = set()
+        self.rules = ()
+        self.pattern = None
+        self._lock = threading.Lock()
+        self._inode = None
+        self._offset = 0
+        self._partial = b""
+
+    def refresh(self):
+        """读取文件的变化，文件不存在时名单为空，规则不合法时抛出ValueError"""
+        with self._lock:
+            try:
+                st = os.stat(self.path)
+            except OSError:
+                if self._inode is not None:
+                    logger.warning("[RandomReply] 名单文件不存在: %s", self.path)
+                self._inode, self._offset, self._partial = None, 0, b""
+                self.ids, self.rules, self.pattern = set(), (), None
+                return
+            full = st.st_ino != self._inode or st.st_size < self._offset
+            if not full and st.st_size == self._offset:
+                return
+            if full:
+                ids, rules, offset, partial = set(), [], 0, b""
+            else:
+                # 只有追加时直接往现有集合中添加，读取方始终看到完整的旧名单或更多的条目
+                ids, rules, offset, partial = self.ids, list(self.rules), self._offset, self._partial
+            lines, offset, partial = self._read(offset, partial)
+            ids = self._add_lines(ids, rules, lines)
+            if isinstance(ids, BloomFilter) and len(ids) > ids.capacity:
+                # 超过容量后误判率会上升，按新的条目数重新完整加载
+                logger.info("[RandomReply] 名单文件条目数超过Bloom过滤器容量，重新加载: %s", self.path)
+                rules = []
+                lines, offset, partial = self._read(0, b"")
+                ids = self._add_lines(set(), rules, lines)
+            pattern = compile_patterns(rules) if tuple(rules) != self.rules else self.pattern
+            self._inode, self._offset, self._partial = st.st_ino, offset, partial
+            self.rules, self.pattern, self.ids = tuple(rules), pattern, ids
+
+    def _read(self, offset, partial):
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        offset += len(data)
+        # 最后一行可能还没写完，留到下次读取
+        data, _, partial = (partial + data).rpartition(b"\n")
+        return data.decode("utf-8", errors="ignore").splitlines(), offset, partial
+
+    def _add_lines(self, ids, rules, lines):
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if is_pattern(line):
+                rules.append(line)
+            else:
+                ids.add(line)
+        threshold = self.bloom.threshold
+        if threshold and isinstance(ids, set) and len(ids) > threshold:
+            ids = self._to_bloom(ids)
+        return ids
+
+    def _to_bloom(self, ids):
+        bloom = BloomFilter(len(ids) * 2, self.bloom.error_rate)
+        for item in ids:
+            bloom.add(item)
+        logger.info("[RandomReply] 名单文件%s有%d条，改用Bloom过滤器保存", self.path, len(ids))
+        return bloom
+
+    def __contains__(self, item):
+        if item in self.ids:
+            return True
+        pattern = self.pattern
+        return pattern is not None and pattern.fullmatch(item) is not None
+
+    def __len__(self):
+        return len(self.ids) + len(self.rules)
+
+
+class SideFileCache:
+    """按路径缓存已加载的名单文件，配置重新加载时只读取文件新增的部分"""
+
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self._files = {}
+
+    def resolve(self, path):
+        return os.path.join(self.base_dir, os.path.expanduser(path))
+
+    def get(self, path, bloom):
+        path = self.resolve(path)
+        side_file = self._files.get(path)
+        if side_file is None or side_file.bloom != bloom:
+            side_file = SideFile(path, bloom)
+            self._files[path] = side_file
+        side_file.refresh()
+        return side_file
+
+    def paths(self):
+        return list(self._files)
+
+    def retain(self, paths):
+        """丢弃配置中已不再使用的名单文件"""
+        paths = {self.resolve(p) for p in paths}
+        for path in list(self._files):
+            if path not in paths:
+                del self._files[path]
+
+
+class AccessList:
+    """黑白名单，精确ID使用frozenset，glob和正则规则预先编译为一个正则
+
+    外部名单文件（可能由Bloom过滤器保存）作为附加来源，所有查找都是常数时间，
+    与名单大小无关（规则的匹配时间只与规则数量有关）。
+    """
+
+    __slots__ = ("ids", "pattern", "side_file")
+
+    def __init__(self, rules, side_file=None):
+        ids = []
+        patterns = []
+        for rule in rules:
+            (patterns if is_pattern(rule) else ids).append(rule)
+        self.ids = frozenset(ids)
+        self.pattern = compile_patterns(patterns)
+        self.side_file = side_file
+
+    def __contains__(self, item):
+        if item in self.ids:
+            return True
+        if self.pattern is not None and self.pattern.fullmatch(item) is not None:
+            return True
+        return self.side_file is not None and item in self.side_file
+
+    def __bool__(self):
+        # 名单文件不存在或为空时不算配置了名单，白名单文件路径写错时不会拒绝所有消息
+        return bool(self.ids) or self.pattern is not None or (self.side_file is not None and len(self.side_file) > 0)
+
+    def __len__(self):
+        return len(self.ids) + (len(self.side_file) if self.side_file is not None else 0)
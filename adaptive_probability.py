@@ -0,0 +1,79 @@
+import math
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from .config_values import as_number
+
+# 自适应概率配置：概率单位与probability相同（0-1000），允许小数
+AdaptiveConfig = namedtuple(
+    "AdaptiveConfig",
+    ["target_per_hour", "min_probability", "max_probability", "half_life", "max_groups"],
+)
+
+
+def parse_adaptive_probability(value):
+    """解析配置中的adaptive_probability，未启用时返回None"""
+    if not isinstance(value, dict) or not value.get("enabled", False):
+        return None
+
+    def number(key, default, low, high=None):
+        return float(as_number(value.get(key, default), f"adaptive_probability.{key}", low, high))
+
+    target = number("target_replies_per_hour", 2, 0)
+    min_probability = number("min_probability", 1, 0, 1000)
+    max_probability = number("max_probability", 200, 0, 1000)
+    if min_probability > max_probability:
+        raise ValueError(f"配置项adaptive_probability.min_probability不能大于max_probability: {min_probability!r}")
+    half_life = number("half_life_seconds", 1800, 1)
+    max_groups = as_number(value.get("max_groups", 10000), "adaptive_probability.max_groups", 1, integer=True)
+    return AdaptiveConfig(target, min_probability, max_probability, half_life, max_groups)
+
+
+class _Rate:
+    __slots__ = ("count", "updated")
+
+    def __init__(self, updated):
+        self.count = 0.0
+        self.updated = updated
+
+
+class AdaptiveProbability:
+    """按群组自适应调整随机回复概率
+
+    每个群维护一个指数衰减的消息计数器，count / tau 即为近期的消息到达速率（条/秒），
+    有效概率 = 目标回复速率 / 消息到达速率，并限制在[min_probability, max_probability]之间。
+    这样每个群的回复数大致稳定在target_replies_per_hour，总负载只与群数量有关，与消息量无关。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._groups = OrderedDict()
+
+    def probability(self, config, group_id, now=None):
+        """记录一条参与随机判断的消息，返回该群当前的有效概率（0-1000）"""
+        if now is None:
+            now = time.monotonic()
+        tau = config.half_life / math.log(2)
+        with self._lock:
+            rate = self._groups.get(group_id)
+            if rate is None:
+                rate = _Rate(now)
+                self._groups[group_id] = rate
+                while len(self._groups) > config.max_groups:
+                    self._groups.popitem(last=False)
+            else:
+                self._groups.move_to_end(group_id)
+                if now > rate.updated:
+                    rate.count *= math.exp((rate.updated - now) / tau)
+                    rate.updated = now
+            # 用本条消息之前的计数估计速率，避免本条消息让消息很少的群的速率被高估
+            arrivals_per_hour = rate.count / tau * 3600.0
+            rate.count += 1.0
+        if arrivals_per_hour <= 0:
+            return config.max_probability
+        probability = 1000.0 * config.target_per_hour / arrivals_per_hour
+        return min(max(probability, config.min_probability), config.max_probability)
+
+    def __len__(self):
+        return len(self._groups)
@@ -0,0 +1,237 @@
+"""RandomReply消息处理链路的离线回放基准测试
+
+不需要微信网关：dow框架模块由fakes.py中的替身代替。
+回放JSONL语料或合成的群聊流量，依次经过on_receive_message、
+on_decorate_reply和on_send_reply，输出吞吐量、各处理器的p50/p99延迟
+以及每条消息的内存分配量（tracemalloc峰值增量）。
+
+用法（在插件目录下执行）：
+    python benchmarks/bench_pipeline.py
+    python benchmarks/bench_pipeline.py --corpus requests.jsonl --keywords 0,5000 --probabilities 10
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakes  # noqa: E402
+
+fakes.install()
+fakes.load_plugin_package()
+
+from random_reply.config_loader import build_snapshot  # noqa: E402
+from random_reply.random_reply import RandomReply  # noqa: E402
+
+# 合成文本使用的常用汉字
+_CHARS = "的一是了我不人在他有这个上们来到时大地为子中你说生国年着就那和要她出也得里后自以会家可下而过天去能对小多然于心学么之都好看起发当没成只如事把还用第样道想作种开美总从无情己面最女但现前些所同日手又行意动方期它头经长儿回位分爱老因很给名法间斯知世什两次使身者被高已亲其进此话常与活正感"
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * q))
+    return sorted_values[index]
+
+
+def synthetic_messages(count, keywords, groups=50, users=500, seed=1):
+    """生成合成群聊流量：(content, group_id, user_id, is_at)"""
+    rnd = random.Random(seed)
+    keywords = list(keywords)
+    messages = []
+    for _ in range(count):
+        roll = rnd.random()
+        if keywords and roll < 0.05:
+            content = rnd.choice(keywords)
+        elif roll < 0.10:
+            content = "@bot " + "".join(rnd.choices(_CHARS, k=rnd.randint(2, 30)))
+        else:
+            content = "".join(rnd.choices(_CHARS, k=rnd.randint(1, 60)))
+        messages.append((
+            content,
+            f"group{rnd.randrange(groups)}@chatroom",
+            f"wxid_user{rnd.randrange(users)}",
+            rnd.random() < 0.05,
+        ))
+    return messages
+
+
+def corpus_messages(path, count, groups=50, users=500, seed=1):
+    """从JSONL语料读取消息，记录中没有content时拼接所有字符串字段"""
+    rnd = random.Random(seed)
+    messages = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            content = record.get("content")
+            if not isinstance(content, str):
+                content = " ".join(v for v in record.values() if isinstance(v, str))
+            messages.append((
+                content,
+                record.get("group_id") or f"group{rnd.randrange(groups)}@chatroom",
+                record.get("user_id") or f"wxid_user{rnd.randrange(users)}",
+                bool(record.get("is_at", False)),
+            ))
+    if not messages:
+        raise SystemExit(f"语料为空: {path}")
+    # 语料不足时循环回放
+    return [messages[i % len(messages)] for i in range(max(count, len(messages)))][:count]
+
+
+def make_context(message, channel):
+    content, group_id, user_id, is_at = message
+    msg = fakes.ChatMessage(content, group_id, "测试群", user_id, "测试用户", is_at)
+    return fakes.Context(fakes.ContextType.TEXT, content, {
+        "isgroup": True,
+        "msg": msg,
+        "channel": channel,
+        "session_id": group_id,
+        "receiver": group_id,
+    })
+
+
+def build_case_config(keyword_count, blacklist_size, probability, users=500):
+    config = {
+        "enabled": True,
+        "protect_private_msgs": False,
+        "probability": probability,
+        "min_msg_length": 7,
+        "max_msg_length": 200,
+        "trigger_keywords": [f"关键词{i}" for i in range(keyword_count)],
+        # 黑名单中包含约十分之一的真实用户
+        "blacklist_users": [f"wxid_user{i}" for i in range(0, users, 10)][:blacklist_size]
+                           + [f"wxid_banned{i}" for i in range(blacklist_size)],
+        "blacklist_groups": [],
+        "dispatch_queue": {"enabled": False},
+    }
+    return config
+
+
+def new_plugin(config, channel):
+    plugin = RandomReply()
+    # 停止配置监视，避免基准测试期间被磁盘上的配置覆盖
+    plugin._config_watcher.stop()
+    plugin._publish(build_snapshot(config))
+    return plugin
+
+
+def run_handlers(plugin, channel, context, timings=None):
+    """让一条消息走完整个处理链路，返回是否触发"""
+    clock = time.perf_counter_ns
+    e_context = fakes.EventContext(fakes.Event.ON_RECEIVE_MESSAGE, {"context": context})
+    t0 = clock()
+    plugin.on_receive_message(e_context)
+    t1 = clock()
+    if timings is not None:
+        timings["receive"].append(t1 - t0)
+    if e_context.action != fakes.EventAction.BREAK or not channel.produced:
+        return False
+
+    new_context = channel.produced.popleft()
+    reply = fakes.Reply(fakes.ReplyType.TEXT, '"这是一条模拟的AI回复内容。"' * 3)
+    e_context = fakes.EventContext(fakes.Event.ON_DECORATE_REPLY,
+                                   {"channel": channel, "context": new_context, "reply": reply})
+    t0 = clock()
+    plugin.on_decorate_reply(e_context)
+    t1 = clock()
+    e_context = fakes.EventContext(fakes.Event.ON_SEND_REPLY,
+                                   {"channel": channel, "context": new_context, "reply": e_context["reply"]})
+    plugin.on_send_reply(e_context)
+    t2 = clock()
+    if timings is not None:
+        timings["decorate"].append(t1 - t0)
+        timings["send"].append(t2 - t1)
+    return True
+
+
+def run_case(messages, keyword_count, blacklist_size, probability, alloc_samples):
+    channel = fakes.GeWeChatChannel()
+    config = build_case_config(keyword_count, blacklist_size, probability)
+
+    # 计时回放
+    plugin = new_plugin(config, channel)
+    contexts = [make_context(m, channel) for m in messages]
+    timings = {"receive": [], "decorate": [], "send": []}
+    triggers = 0
+    start = time.perf_counter()
+    for context in contexts:
+        if run_handlers(plugin, channel, context, timings):
+            triggers += 1
+    elapsed = time.perf_counter() - start
+
+    # 内存分配回放，tracemalloc开销较大，只抽取部分消息
+    plugin = new_plugin(config, channel)
+    contexts = [make_context(m, channel) for m in messages[:alloc_samples]]
+    tracemalloc.start()
+    allocated = 0
+    for context in contexts:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        run_handlers(plugin, channel, context)
+        allocated += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+
+    result = {
+        "keywords": keyword_count,
+        "blacklist": blacklist_size,
+        "probability": probability,
+        "messages": len(messages),
+        "triggers": triggers,
+        "msgs_per_sec": len(messages) / elapsed if elapsed else 0.0,
+        "alloc_bytes_per_msg": allocated / len(contexts) if contexts else 0.0,
+    }
+    for name, values in timings.items():
+        values.sort()
+        result[f"{name}_p50_us"] = percentile(values, 0.50) / 1000
+        result[f"{name}_p99_us"] = percentile(values, 0.99) / 1000
+    return result
+
+
+def parse_int_list(value):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="RandomReply消息处理链路离线基准测试")
+    parser.add_argument("--corpus", help="JSONL语料文件，不指定时使用合成流量")
+    parser.add_argument("--messages", type=int, default=20000, help="每个用例回放的消息数")
+    parser.add_argument("--keywords", type=parse_int_list, default=[0, 1000, 20000], help="关键词数量，逗号分隔")
+    parser.add_argument("--blacklist", type=parse_int_list, default=[0, 10000], help="黑名单大小，逗号分隔")
+    parser.add_argument("--probabilities", type=parse_int_list, default=[10, 1000], help="随机回复概率(0-1000)，逗号分隔")
+    parser.add_argument("--alloc-samples", type=int, default=2000, help="统计内存分配时抽取的消息数")
+    parser.add_argument("--json", action="store_true", help="以JSON行输出结果")
+    args = parser.parse_args(argv)
+
+    header = f"{'keywords':>8} {'blacklist':>9} {'prob':>5} {'msgs/s':>10} {'triggers':>8} " \
+             f"{'recv p50/p99 us':>17} {'decor p50/p99 us':>17} {'send p50/p99 us':>17} {'alloc B/msg':>11}"
+    if not args.json:
+        print(header)
+    for keyword_count in args.keywords:
+        keywords = [f"关键词{i}" for i in range(keyword_count)]
+        if args.corpus:
+            messages = corpus_messages(args.corpus, args.messages)
+        else:
+            messages = synthetic_messages(args.messages, keywords)
+        for blacklist_size in args.blacklist:
+            for probability in args.probabilities:
+                r = run_case(messages, keyword_count, blacklist_size, probability, args.alloc_samples)
+                if args.json:
+                    print(json.dumps(r, ensure_ascii=False))
+                    continue
+                print(f"{r['keywords']:>8} {r['blacklist']:>9} {r['probability']:>5} {r['msgs_per_sec']:>10.0f} "
+                      f"{r['triggers']:>8} "
+                      f"{r['receive_p50_us']:>8.1f}/{r['receive_p99_us']:<8.1f}"
+                      f"{r['decorate_p50_us']:>8.1f}/{r['decorate_p99_us']:<8.1f}"
+                      f"{r['send_p50_us']:>8.1f}/{r['send_p99_us']:<8.1f}"
+                      f"{r['alloc_bytes_per_msg']:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""dow框架模块的最小替身，用于脱离微信网关离线加载RandomReply插件
+
+只实现插件实际用到的接口：bridge.context、bridge.reply、channel.*、
+common.log、config以及plugins。行为与dify-on-wechat中的同名对象保持一致。
+"""
+import importlib.util
+import logging
+import os
+import sys
+import types
+from collections import deque
+from enum import Enum
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_NAME = "random_reply"
+
+
+class ContextType(Enum):
+    TEXT = 1
+    VOICE = 2
+    IMAGE = 3
+
+
+class Context:
+    def __init__(self, type: ContextType = None, content=None, kwargs=dict()):
+        self.type = type
+        self.content = content
+        self.kwargs = kwargs
+
+    def __contains__(self, key):
+        if key == "type":
+            return self.type is not None
+        elif key == "content":
+            return self.content is not None
+        else:
+            return key in self.kwargs
+
+    def __getitem__(self, key):
+        if key == "type":
+            return self.type
+        elif key == "content":
+            return self.content
+        else:
+            return self.kwargs[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        if key == "type":
+            self.type = value
+        elif key == "content":
+            self.content = value
+        else:
+            self.kwargs[key] = value
+
+    def __delitem__(self, key):
+        if key == "type":
+            self.type = None
+        elif key == "content":
+            self.content = None
+        else:
+            del self.kwargs[key]
+
+
+class ReplyType(Enum):
+    TEXT = 1
+    VOICE = 2
+    IMAGE = 3
+    INFO = 9
+    ERROR = 10
+
+
+class Reply:
+    def __init__(self, type: ReplyType = None, content=None):
+        self.type = type
+        self.content = content
+
+
+class ChatMessage:
+    def __init__(self, content="", other_user_id="", other_user_nickname="",
+                 actual_user_id="", actual_user_nickname="", is_at=False, is_group=True):
+        self.content = content
+        self.other_user_id = other_user_id
+        self.other_user_nickname = other_user_nickname
+        self.actual_user_id = actual_user_id
+        self.actual_user_nickname = actual_user_nickname
+        self.is_at = is_at
+        self.is_group = is_group
+
+
+class ChatChannel:
+    def produce(self, context):
+        raise NotImplementedError
+
+    def send(self, reply, context):
+        raise NotImplementedError
+
+    def _decorate_reply(self, context, reply):
+        """与dow的ChatChannel._decorate_reply一致：触发ON_DECORATE_REPLY，文本回复加上@发送者和回复前后缀"""
+        if reply and reply.type:
+            e_context = PluginManager().emit_event(EventContext(
+                Event.ON_DECORATE_REPLY, {"channel": self, "context": context, "reply": reply}))
+            reply = e_context["reply"]
+            if not e_context.is_pass() and reply and reply.type == ReplyType.TEXT:
+                reply_text = reply.content
+                if context.get("isgroup", False):
+                    if not context.get("no_need_at", False):
+                        reply_text = "@" + context["msg"].actual_user_nickname + "\n" + reply_text.strip()
+                    reply_text = conf().get("group_chat_reply_prefix", "") + reply_text + \
+                        conf().get("group_chat_reply_suffix", "")
+                else:
+                    reply_text = conf().get("single_chat_reply_prefix", "") + reply_text + \
+                        conf().get("single_chat_reply_suffix", "")
+                reply.content = reply_text
+        return reply
+
+    def _send_reply(self, context, reply):
+        """与dow的ChatChannel._send_reply一致：触发ON_SEND_REPLY后调用send"""
+        if reply and reply.type:
+            e_context = PluginManager().emit_event(EventContext(
+                Event.ON_SEND_REPLY, {"channel": self, "context": context, "reply": reply}))
+            reply = e_context["reply"]
+            if not e_context.is_pass() and reply and reply.type:
+                self.send(reply, context)
+
+
+class GeWeChatChannel(ChatChannel):
+    """记录produce和send调用而不做任何网络请求"""
+
+    def __init__(self):
+        self.produced = deque(maxlen=1024)
+        self.sent = 0
+        self.replies = deque(maxlen=1024)
+
+    def produce(self, context):
+        self.produced.append(context)
+
+    def send(self, reply, context):
+        self.sent += 1
+        self.replies.append((reply.type, reply.content))
+
+
+class Event(Enum):
+    ON_RECEIVE_MESSAGE = 1
+    ON_HANDLE_CONTEXT = 2
+    ON_DECORATE_REPLY = 3
+    ON_SEND_REPLY = 4
+
+
+class EventAction(Enum):
+    CONTINUE = 1
+    BREAK = 2
+    BREAK_PASS = 3
+
+
+class EventContext:
+    def __init__(self, event, econtext=dict()):
+        self.event = event
+        self.econtext = econtext
+        self.action = EventAction.CONTINUE
+
+    def __getitem__(self, key):
+        return self.econtext[key]
+
+    def __setitem__(self, key, value):
+        self.econtext[key] = value
+
+    def __delitem__(self, key):
+        del self.econtext[key]
+
+    def is_pass(self):
+        return self.action == EventAction.BREAK_PASS
+
+    def is_break(self):
+        return self.action == EventAction.BREAK or self.action == EventAction.BREAK_PASS
+
+
+class Plugin:
+    def __init__(self):
+        self.handlers = {}
+
+
+class PluginManager:
+    """只保留事件分发：按instances中的顺序调用各插件的处理器，直到某个插件中断事件"""
+
+    _instance = None
+
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.instances = []
+        return cls._instance
+
+    def emit_event(self, e_context, *args, **kwargs):
+        for instance in list(self.instances):
+            handler = instance.handlers.get(e_context.event)
+            if handler is not None:
+                handler(e_context, *args, **kwargs)
+                if e_context.is_break():
+                    break
+        return e_context
+
+
+def register(name, desc, version, author, **kwargs):
+    def wrapper(plugincls):
+        plugincls.name = name
+        plugincls.desc = desc
+        plugincls.version = version
+        plugincls.author = author
+        return plugincls
+
+    return wrapper
+
+
+# 全局配置替身，可在基准测试中直接修改
+global_config = {"group_chat_prefix": ["@bot"]}
+
+
+def conf():
+    return global_config
+
+
+def _module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    if "." not in name:
+        module.__path__ = []
+    sys.modules[name] = module
+    return module
+
+
+def install(log_level=logging.ERROR):
+    """把替身模块注册到sys.modules，已存在的真实模块不会被覆盖"""
+    if "bridge.context" in sys.modules:
+        return
+    logger = logging.getLogger("randomreply.fake")
+    logger.setLevel(log_level)
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
+        logger.addHandler(handler)
+    logger.propagate = False
+
+    _module("bridge")
+    _module("bridge.context", ContextType=ContextType, Context=Context)
+    _module("bridge.reply", ReplyType=ReplyType, Reply=Reply)
+    _module("channel")
+    _module("channel.chat_message", ChatMessage=ChatMessage)
+    _module("channel.chat_channel", ChatChannel=ChatChannel)
+    _module("channel.gewechat")
+    _module("channel.gewechat.gewechat_channel", GeWeChatChannel=GeWeChatChannel)
+    _module("common")
+    _module("common.log", logger=logger)
+    _module("config", conf=conf)
+    _module("plugins", Plugin=Plugin, PluginManager=PluginManager, Event=Event, EventContext=EventContext,
+            EventAction=EventAction, register=register)
+
+
+def load_plugin_package():
+    """以包的形式加载插件目录，返回插件包模块"""
+    if PACKAGE_NAME in sys.modules:
+        return sys.modules[PACKAGE_NAME]
+    spec = importlib.util.spec_from_file_location(
+        PACKAGE_NAME, os.path.join(PLUGIN_DIR, "__init__.py"),
+        submodule_search_locations=[PLUGIN_DIR],
+    )
+    package = importlib.util.module_from_spec(spec)
+    sys.modules[PACKAGE_NAME] = package
+    spec.loader.exec_module(package)
+    return package
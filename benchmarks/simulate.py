@@ -0,0 +1,328 @@
+"""RandomReply配置的离线what-if模拟
+
+流式读取导出的聊天记录（JSONL，每行一条消息，可以是.gz压缩文件），让每条消息经过与on_receive_message
+相同的过滤阶段（filter_pipeline）和触发判断（TriggerDecider），一次读取同时评估多个候选配置，
+按群组和小时统计预计的触发次数（按触发原因区分）和未触发的原因。文件逐行处理，不会整体载入内存。
+
+每行JSON的字段：
+    content         消息内容（必需）
+    group_id        群组ID，私聊时为对方的ID
+    user_id         发送者ID
+    time            消息时间，Unix时间戳（秒或毫秒）或ISO 8601字符串，缺失时沿用上一条消息的时间
+    is_at           是否@了机器人（可选）
+    isgroup         是否为群聊（可选，默认为true）
+    group_name、user_nickname   群名和昵称（可选）
+
+模拟以消息时间作为当前时间，去重、限流、自适应概率、消息合并和回复缓存都按消息时间计算，
+聊天记录应按时间排序。随机判断使用固定种子：random为抽样得到的触发次数，
+expected为进行随机判断的消息的概率之和（随机触发次数的期望值）。
+关键词触发命中回复缓存时记为keyword_cached，不产生后端请求。
+熔断取决于后端的实际状况，模拟时视为始终关闭；state_backend总是使用内存后端。
+
+用法（在插件目录下执行）：
+    python benchmarks/simulate.py --chat-log export.jsonl config.json candidate.json
+    python benchmarks/simulate.py --chat-log export.jsonl.gz --csv report.csv --group-chat-prefix bot config.json
+"""
+import argparse
+import csv
+import gzip
+import heapq
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter, defaultdict, namedtuple
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fakes  # noqa: E402
+
+fakes.install()
+fakes.load_plugin_package()
+
+from random_reply.access_list import SideFileCache  # noqa: E402
+from random_reply.coalescer import MessageCoalescer  # noqa: E402
+from random_reply.config_loader import build_snapshot, read_json  # noqa: E402
+from random_reply.filter_pipeline import MessageView, check_length, default_stages  # noqa: E402
+from random_reply.reply_cache import ReplyCache  # noqa: E402
+from random_reply.state_backend import create_state_backend  # noqa: E402
+from random_reply.trigger_decision import TriggerDecider  # noqa: E402
+
+# 过滤阶段需要的消息属性，与ChatMessage的同名属性对应
+SimMessage = namedtuple("SimMessage", ["other_user_id", "other_user_nickname", "actual_user_id",
+                                       "actual_user_nickname", "is_at"])
+
+# 会产生后端请求的触发原因
+BACKEND_REASONS = ("keyword", "random")
+TRIGGER_REASONS = ("keyword", "keyword_cached", "random")
+
+
+class _VirtualTimeout:
+    __slots__ = ("cancelled",)
+
+    def __init__(self):
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class VirtualTimerWheel:
+    """按消息时间推进的时间轮，供消息合并在模拟中使用"""
+
+    def __init__(self):
+        self.now = 0.0
+        self._heap = []
+        self._seq = itertools.count()
+
+    def schedule(self, delay, callback, *args):
+        timeout = _VirtualTimeout()
+        heapq.heappush(self._heap, (self.now + delay, next(self._seq), timeout, callback, args))
+        return timeout
+
+    def advance(self, now):
+        """执行到期时间不晚于now的任务，任务执行时的当前时间为其到期时间"""
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            due, _, timeout, callback, args = heapq.heappop(heap)
+            if timeout.cancelled:
+                continue
+            self.now = max(self.now, due)
+            callback(*args)
+        self.now = max(self.now, now)
+
+
+class Variant:
+    """一个候选配置及其独立的模拟状态和统计"""
+
+    def __init__(self, name, snapshot, prefixes, seed):
+        self.name = name
+        self.snapshot = snapshot
+        self.prefixes = prefixes
+        self.stages = default_stages()
+        self.decider = TriggerDecider(random.Random(seed).random)
+        self.decider.use_backend(create_state_backend(snapshot.state_backend._replace(type="memory")))
+        self.reply_cache = ReplyCache()
+        self.wheel = VirtualTimerWheel()
+        self.coalescer = MessageCoalescer(self.wheel, self._on_coalesced)
+        # (群组, 小时) -> 各原因的次数；(群组, 小时) -> 随机触发的期望次数；群组 -> 消息数
+        # 开启消息合并时，进入缓冲区的消息记为coalesced，合并后的文本再按判断结果计数一次
+        self.counts = defaultdict(Counter)
+        self.expected = defaultdict(float)
+        self.messages = Counter()
+
+    def process(self, msg, content, is_group, now):
+        self.wheel.advance(now)
+        snapshot = self.snapshot
+        group_id = msg.other_user_id
+        self.messages[group_id] += 1
+        policy = snapshot.policies.get(group_id, snapshot.policy)
+        view = MessageView(content, is_group, msg, group_id, msg.actual_user_id, msg.is_at, policy, self.prefixes)
+        # 固定按默认顺序执行，各阶段互不影响结果，固定顺序使拒绝原因的统计可以比较
+        for stage in self.stages:
+            reason = stage.check(view, snapshot)
+            if reason is not None:
+                self.counts[(group_id, int(now // 3600))][reason] += 1
+                return
+        keyword = view.keyword
+        if not keyword and snapshot.coalesce is not None:
+            self.coalescer.add(snapshot.coalesce, (group_id, msg.actual_user_id), view.cleaned_content, msg, now)
+            self.counts[(group_id, int(now // 3600))]["coalesced"] += 1
+            return
+        self._decide(policy, msg, view.cleaned_content, keyword, now)
+
+    def _on_coalesced(self, parts, msg):
+        # 与插件的_on_coalesced一致：合并后的文本重新检查开关和长度
+        now = self.wheel.now
+        snapshot = self.snapshot
+        policy = snapshot.policies.get(msg.other_user_id, snapshot.policy)
+        if not policy.enabled:
+            return
+        content = "\n".join(parts)
+        if not check_length(policy, content):
+            self.counts[(msg.other_user_id, int(now // 3600))]["length"] += 1
+            return
+        self._decide(policy, msg, content, None, now)
+
+    def _decide(self, policy, msg, cleaned_content, keyword, now):
+        snapshot = self.snapshot
+        group_id = msg.other_user_id
+        key = (group_id, int(now // 3600))
+        reason, probability = self.decider.decide(snapshot, policy, group_id, msg.actual_user_id,
+                                                  cleaned_content, keyword, None, now)
+        if reason == "random" or reason == "probability":
+            self.expected[key] += min(probability, 1000) / 1000
+        if reason == "keyword" and snapshot.reply_cache is not None:
+            if self.reply_cache.get(snapshot.reply_cache, group_id, cleaned_content, now):
+                reason = "keyword_cached"
+            else:
+                self.reply_cache.put(snapshot.reply_cache, group_id, cleaned_content, keyword[1], "TEXT", "", now)
+        self.counts[key][reason] += 1
+
+    def finish(self):
+        """处理聊天记录结束时仍在合并缓冲区中的消息"""
+        self.wheel.advance(float("inf"))
+
+
+def parse_time(value, previous):
+    if value is None or isinstance(value, bool):
+        return previous
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            try:
+                return datetime.fromisoformat(value.strip().replace("Z", "+00:00")).timestamp()
+            except ValueError:
+                return previous
+    if not isinstance(value, (int, float)):
+        return previous
+    # 毫秒时间戳
+    return value / 1000.0 if value > 1e11 else float(value)
+
+
+def read_chat_log(path):
+    """逐行读取聊天记录，产生(消息, 内容, 是否群聊, 时间)"""
+    if path == "-":
+        f = sys.stdin
+    elif path.endswith(".gz"):
+        f = gzip.open(path, "rt", encoding="utf-8")
+    else:
+        f = open(path, "r", encoding="utf-8")
+    now = 0.0
+    try:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                print(f"第{line_no}行不是合法的JSON，已跳过", file=sys.stderr)
+                continue
+            content = record.get("content") if isinstance(record, dict) else None
+            if not isinstance(content, str) or not content:
+                continue
+            now = parse_time(record.get("time", record.get("timestamp")), now)
+            user_id = record.get("user_id")
+            is_group = bool(record.get("isgroup", True))
+            msg = SimMessage(
+                other_user_id=record.get("group_id") if is_group else record.get("group_id", user_id),
+                other_user_nickname=record.get("group_name", ""),
+                actual_user_id=user_id,
+                actual_user_nickname=record.get("user_nickname", ""),
+                is_at=bool(record.get("is_at", False)),
+            )
+            yield msg, content, is_group, now
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def load_variant(path, keyword_config_path, prefixes, seed):
+    raw_config = read_json(path)
+    if raw_config is None:
+        raise SystemExit(f"配置文件不存在: {path}")
+    keyword_config = None
+    if isinstance(raw_config, dict) and raw_config.get("use_keyword_plugin", False) and keyword_config_path:
+        keyword_config = read_json(keyword_config_path)
+    try:
+        snapshot = build_snapshot(raw_config, keyword_config, SideFileCache(os.path.dirname(os.path.abspath(path))))
+    except ValueError as e:
+        raise SystemExit(f"配置文件{path}校验失败: {e}")
+    return Variant(path, snapshot, prefixes, seed)
+
+
+def format_hour(hour):
+    return time.strftime("%Y-%m-%d %H:00", time.localtime(hour * 3600))
+
+
+def report(variant, top):
+    counts = variant.counts
+    if not counts:
+        print(f"== {variant.name}: 没有消息")
+        return
+    hours = [hour for _, hour in counts]
+    span = max(hours) - min(hours) + 1
+    totals = Counter()
+    per_hour = Counter()
+    per_group = defaultdict(Counter)
+    expected_total = 0.0
+    for (group_id, hour), counter in counts.items():
+        totals.update(counter)
+        requests = sum(counter[r] for r in BACKEND_REASONS)
+        per_hour[hour] += requests
+        per_group[group_id].update(counter)
+    for value in variant.expected.values():
+        expected_total += value
+
+    requests = sum(totals[r] for r in BACKEND_REASONS)
+    peak_hour, peak = max(per_hour.items(), key=lambda item: item[1])
+    print(f"== {variant.name}")
+    print(f"消息数: {sum(variant.messages.values())}，时间范围: {format_hour(min(hours))} ~ {format_hour(max(hours))}（{span}小时）")
+    print("触发: " + "，".join(f"{r} {totals[r]}" for r in TRIGGER_REASONS) + f"，随机触发期望 {expected_total:.1f}")
+    print(f"后端请求: 共{requests}次，平均每小时{requests / span:.2f}次，峰值{peak}次（{format_hour(peak_hour)}）")
+    rejected = [(r, n) for r, n in totals.most_common() if r not in TRIGGER_REASONS]
+    if rejected:
+        print("未触发: " + "，".join(f"{r} {n}" for r, n in rejected))
+
+    groups = sorted(per_group.items(), key=lambda item: -sum(item[1][r] for r in BACKEND_REASONS))[:top]
+    print(f"{'群组':<32} {'请求/小时':>9} {'keyword':>8} {'cached':>7} {'random':>7} {'消息数':>8}")
+    for group_id, counter in groups:
+        group_requests = sum(counter[r] for r in BACKEND_REASONS)
+        print(f"{str(group_id):<32} {group_requests / span:>9.2f} {counter['keyword']:>8} "
+              f"{counter['keyword_cached']:>7} {counter['random']:>7} {variant.messages[group_id]:>8}")
+    print()
+
+
+def write_csv(path, variants):
+    """按(配置, 群组, 小时, 原因)输出明细，expected_random为随机触发的期望次数"""
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["variant", "group_id", "hour", "reason", "count"])
+        for variant in variants:
+            for (group_id, hour), counter in sorted(variant.counts.items(), key=lambda item: (str(item[0][0]), item[0][1])):
+                for reason, count in sorted(counter.items()):
+                    writer.writerow([variant.name, group_id, format_hour(hour), reason, count])
+                expected = variant.expected.get((group_id, hour))
+                if expected:
+                    writer.writerow([variant.name, group_id, format_hour(hour), "expected_random", f"{expected:.4f}"])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="用导出的聊天记录离线评估多个RandomReply配置")
+    parser.add_argument("configs", nargs="+", help="候选的config.json，可以指定多个")
+    parser.add_argument("--chat-log", required=True, help="JSONL聊天记录（支持.gz，-表示标准输入）")
+    parser.add_argument("--keyword-config", help="keyword插件的config.json，配置启用use_keyword_plugin时使用")
+    parser.add_argument("--group-chat-prefix", action="append", default=[],
+                        help="dow的group_chat_prefix，可以指定多次")
+    parser.add_argument("--seed", type=int, default=1, help="随机判断使用的种子")
+    parser.add_argument("--top", type=int, default=20, help="每个配置列出后端请求最多的群组数")
+    parser.add_argument("--csv", help="按配置、群组、小时和原因输出明细到CSV文件")
+    args = parser.parse_args(argv)
+
+    prefixes = tuple(p for p in args.group_chat_prefix if p.strip())
+    variants = [load_variant(path, args.keyword_config, prefixes, args.seed) for path in args.configs]
+
+    start = time.perf_counter()
+    messages = 0
+    for msg, content, is_group, now in read_chat_log(args.chat_log):
+        messages += 1
+        for variant in variants:
+            variant.process(msg, content, is_group, now)
+    for variant in variants:
+        variant.finish()
+    elapsed = time.perf_counter() - start
+    print(f"处理了{messages}条消息，{len(variants)}个配置，耗时{elapsed:.1f}秒\n")
+
+    for variant in variants:
+        report(variant, args.top)
+    if args.csv:
+        write_csv(args.csv, variants)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+import threading
+
+from .plugin_log import logger
+
+
+class ChannelRegistry:
+    """进程内共享的channel实例登记表
+
+    优先记住消息上下文中出现过的真实GeWeChatChannel实例，
+    只有从未见过真实实例时才自行创建一次，之后一直复用。
+    类型判断结果按类型缓存，后续只需一次字典查找。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._channel = None
+        # 当前缓存的实例是否由登记表自行创建
+        self._owned = False
+        self._type_cache = {}
+        self._channel_class = None
+
+    def preload(self):
+        """插件初始化时解析一次GeWeChatChannel类，之后创建实例时不再需要导入"""
+        if self._channel_class is None:
+            try:
+                from channel.gewechat.gewechat_channel import GeWeChatChannel
+            except Exception as e:
+                logger.warning("[RandomReply] 导入GeWeChatChannel失败，将在首次使用时重试: %s", e)
+                return
+            self._channel_class = GeWeChatChannel
+
+    def is_gewechat(self, channel):
+        """判断channel是否为GeWeChatChannel（含子类命名约定）"""
+        channel_type = type(channel)
+        result = self._type_cache.get(channel_type)
+        if result is None:
+            result = channel_type.__name__.lower().endswith("gewechatchannel")
+            self._type_cache[channel_type] = result
+        return result
+
+    def remember(self, channel):
+        """登记真实的channel实例，会替换之前自行创建的实例"""
+        if self._channel is channel:
+            return
+        if self._channel is None or self._owned:
+            with self._lock:
+                if self._channel is None or self._owned:
+                    self._channel = channel
+                    self._owned = False
+
+    def get(self):
+        """返回缓存的GeWeChatChannel实例，必要时创建一次"""
+        channel = self._channel
+        if channel is not None:
+            return channel
+        with self._lock:
+            if self._channel is None:
+                if self._channel_class is None:
+                    from channel.gewechat.gewechat_channel import GeWeChatChannel
+                    self._channel_class = GeWeChatChannel
+                logger.info("[RandomReply] 未登记GeWeChatChannel实例，创建新实例")
+                self._channel = self._channel_class()
+                self._owned = True
+            return self._channel
+
+    def resolve(self, channel):
+        """返回可用的GeWeChatChannel：传入的实例类型正确时直接使用并登记，否则返回缓存实例"""
+        if channel is not None and self.is_gewechat(channel):
+            self.remember(channel)
+            return channel
+        return self.get()
+
+
+channel_registry = ChannelRegistry()
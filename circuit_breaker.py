@@ -0,0 +1,249 @@
+import itertools
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from .config_values import as_number
+from .plugin_log import logger
+
+# 熔断配置：窗口期内请求数达到min_requests且错误率或慢请求比例超过阈值时熔断
+BreakerConfig = namedtuple(
+    "BreakerConfig",
+    ["window", "min_requests", "error_rate", "slow_seconds", "slow_rate", "timeout", "open_seconds", "half_open_probes"],
+)
+
+# 未启用熔断时只跟踪请求，超时时间与原来的超时提示一致
+DEFAULT_TIMEOUT = 30.0
+
+CLOSED = 0
+OPEN = 1
+HALF_OPEN = 2
+
+STATE_NAMES = {CLOSED: "closed", OPEN: "open", HALF_OPEN: "half_open"}
+
+
+def parse_circuit_breaker(value):
+    """解析配置中的circuit_breaker，未启用时返回None"""
+    if not isinstance(value, dict) or not value.get("enabled", False):
+        return None
+
+    def number(key, default, low, high=None):
+        return as_number(value.get(key, default), f"circuit_breaker.{key}", low, high)
+
+    return BreakerConfig(
+        window=float(number("window_seconds", 60, 1)),
+        min_requests=int(number("min_requests", 5, 1)),
+        error_rate=float(number("error_rate", 0.5, 0, 1)),
+        slow_seconds=float(number("slow_seconds", 20, 0)),
+        slow_rate=float(number("slow_rate", 0.5, 0, 1)),
+        timeout=float(number("timeout_seconds", 60, 1)),
+        open_seconds=float(number("open_seconds", 30, 1)),
+        half_open_probes=int(number("half_open_probes", 2, 1)),
+    )
+
+
+class _RollingWindow:
+    """按时间分桶的滚动窗口，统计请求数、错误数和慢请求数"""
+
+    __slots__ = ("window", "_width", "_buckets")
+
+    def __init__(self, window, buckets=10):
+        self.window = window
+        self._width = window / buckets
+        # 每个桶为[桶编号, 请求数, 错误数, 慢请求数]
+        self._buckets = [[-1, 0, 0, 0] for _ in range(buckets)]
+
+    def add(self, now, error, slow):
+        index = int(now // self._width)
+        bucket = self._buckets[index % len(self._buckets)]
+        if bucket[0] != index:
+            bucket[:] = [index, 0, 0, 0]
+        bucket[1] += 1
+        bucket[2] += error
+        bucket[3] += slow
+
+    def totals(self, now):
+        oldest = int(now // self._width) - len(self._buckets) + 1
+        total = errors = slow = 0
+        for index, count, error_count, slow_count in self._buckets:
+            if index >= oldest:
+                total += count
+                errors += error_count
+                slow += slow_count
+        return total, errors, slow
+
+    def clear(self):
+        for bucket in self._buckets:
+            bucket[:] = [-1, 0, 0, 0]
+
+
+class _Request:
+    __slots__ = ("started", "timeout", "probe")
+
+    def __init__(self, started, probe):
+        self.started = started
+        self.timeout = None
+        self.probe = probe
+
+
+class CircuitBreaker:
+    """跟踪已提交给后端的请求，后端变慢或出错时暂停随机触发
+
+    请求提交时登记，在on_decorate_reply中按上下文中的请求编号匹配回复，
+    得到耗时和结果（回复为空或ERROR类型记为错误，超时未回复也记为错误），计入滚动窗口。
+    窗口期内错误率或慢请求比例超过阈值时进入熔断（open），暂停随机触发，关键词触发不受影响；
+    open_seconds后进入半开（half_open），只放行half_open_probes个随机触发作为探测，
+    探测全部成功则恢复（closed），有一个失败则重新熔断。未启用时只跟踪请求，不会熔断。
+
+    探测名额在allow_random()中加锁预留，调用方随后在同一线程中用take_probe()取得探测标记，
+    随请求传给start()；未能提交时用release_probe()归还名额。半开状态下只有带当前标记的请求
+    决定恢复或重新熔断，其他请求（关键词触发、熔断前提交的请求）的结果不计入。
+    """
+
+    def __init__(self, timer_wheel, on_complete=None):
+        self._timer_wheel = timer_wheel
+        self._on_complete = on_complete
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._inflight = {}
+        self._config = None
+        self._window = None
+        self.state = CLOSED
+        self._opened_at = 0.0
+        # 每次状态切换加一，作为半开期间探测请求的标记，旧的探测标记随之失效
+        self._epoch = 0
+        self._probes_reserved = 0
+        self._probes_succeeded = 0
+        self._local = threading.local()
+
+    def configure(self, config):
+        with self._lock:
+            if config != self._config:
+                self._config = config
+                self._window = _RollingWindow(config.window) if config else None
+                if self.state != CLOSED:
+                    self._transition(CLOSED)
+
+    def allow_random(self, now=None):
+        """返回当前是否允许随机触发，半开状态下放行时预留一个探测名额"""
+        if self.state == CLOSED:
+            return True
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            config = self._config
+            if self.state == OPEN:
+                if config is None or now - self._opened_at < config.open_seconds:
+                    return False
+                self._transition(HALF_OPEN)
+            if self.state == CLOSED:
+                return True
+            if self._probes_reserved >= config.half_open_probes:
+                return False
+            self._probes_reserved += 1
+            self._local.probe = self._epoch
+            return True
+
+    def take_probe(self):
+        """取出本线程最近一次allow_random()预留的探测标记，没有时返回None"""
+        probe = getattr(self._local, "probe", None)
+        if probe is not None:
+            self._local.probe = None
+        return probe
+
+    def release_probe(self, probe):
+        """预留了探测名额的触发最终没有提交（限流、队列已满等），归还名额"""
+        with self._lock:
+            if probe == self._epoch and self.state == HALF_OPEN:
+                self._probes_reserved -= 1
+
+    def start(self, reason, probe=None, now=None):
+        """登记一个提交给后端的请求，返回请求编号，probe为take_probe()取得的探测标记"""
+        if now is None:
+            now = time.monotonic()
+        request_id = next(self._ids)
+        request = _Request(now, probe)
+        with self._lock:
+            self._inflight[request_id] = request
+            config = self._config
+        request.timeout = self._timer_wheel.schedule(config.timeout if config else DEFAULT_TIMEOUT,
+                                                     self._expire, request_id)
+        return request_id
+
+    def finish(self, request_id, error=False, now=None):
+        """请求得到回复，返回耗时（秒），请求未登记或已超时返回None"""
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            request = self._inflight.pop(request_id, None)
+            if request is None:
+                return None
+            latency = now - request.started
+            self._record(now, error, latency, request.probe)
+        if request.timeout is not None:
+            request.timeout.cancel()
+        if self._on_complete is not None:
+            self._on_complete(latency, "error" if error else "ok")
+        return latency
+
+    def _expire(self, request_id):
+        now = time.monotonic()
+        with self._lock:
+            request = self._inflight.pop(request_id, None)
+            if request is None:
+                return
+            self._record(now, True, now - request.started, request.probe)
+        logger.limited(logging.WARNING, "request_timeout", "[RandomReply] 请求处理超时，可能需要检查服务状态")
+        if self._on_complete is not None:
+            self._on_complete(now - request.started, "timeout")
+
+    def _record(self, now, error, latency, probe=None):
+        config = self._config
+        if config is None:
+            return
+        slow = config.slow_seconds > 0 and latency >= config.slow_seconds
+        if self.state == HALF_OPEN:
+            # 只有本次半开期间的探测请求决定恢复或重新熔断
+            if probe != self._epoch:
+                return
+            if error or slow:
+                self._transition(OPEN, now)
+            else:
+                self._probes_succeeded += 1
+                if self._probes_succeeded >= config.half_open_probes:
+                    self._transition(CLOSED)
+            return
+        if self.state == OPEN:
+            return
+        self._window.add(now, error, slow)
+        total, errors, slow_count = self._window.totals(now)
+        if total >= config.min_requests and ((errors and errors >= total * config.error_rate) or
+                                             (slow_count and slow_count >= total * config.slow_rate)):
+            logger.warning("[RandomReply] 后端异常（%d个请求中%d个出错，%d个超过%s秒），暂停随机触发",
+                           total, errors, slow_count, config.slow_seconds)
+            self._transition(OPEN, now)
+
+    def _transition(self, state, now=None):
+        if state == OPEN:
+            self._opened_at = time.monotonic() if now is None else now
+        elif state == CLOSED:
+            if self._window is not None:
+                self._window.clear()
+            if self.state != CLOSED:
+                logger.info("[RandomReply] 后端已恢复，随机触发恢复正常")
+        self._epoch += 1
+        self._probes_reserved = 0
+        self._probes_succeeded = 0
+        self.state = state
+
+    def close(self):
+        """取消所有请求的超时定时器，不再跟踪已提交的请求"""
+        with self._lock:
+            inflight, self._inflight = self._inflight, {}
+        for request in inflight.values():
+            if request.timeout is not None:
+                request.timeout.cancel()
+
+    def inflight(self):
+        return len(self._inflight)
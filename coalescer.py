@@ -0,0 +1,94 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from .config_values import as_number
+from .plugin_log import logger
+
+# 消息合并配置：window为防抖窗口，max_wait为从第一条消息起的最长等待时间
+CoalesceConfig = namedtuple("CoalesceConfig", ["window", "max_wait", "max_messages"])
+
+
+def parse_coalesce(value):
+    """解析配置中的coalesce，未启用时返回None"""
+    if not isinstance(value, dict) or not value.get("enabled", False):
+        return None
+    window = as_number(value.get("window_seconds", 3), "coalesce.window_seconds", positive=True)
+    max_wait = as_number(value.get("max_wait_seconds", 10), "coalesce.max_wait_seconds", positive=True)
+    max_messages = as_number(value.get("max_messages", 6), "coalesce.max_messages", 1, integer=True)
+    return CoalesceConfig(float(window), max(float(max_wait), float(window)), max_messages)
+
+
+class _Buffer:
+    __slots__ = ("parts", "payload", "first_at", "timeout")
+
+    def __init__(self, first_at):
+        self.parts = []
+        self.payload = None
+        self.first_at = first_at
+        self.timeout = None
+
+
+class MessageCoalescer:
+    """按(群组, 用户)合并短时间内连续发送的消息
+
+    每来一条消息重置防抖定时器，窗口内没有新消息、累计等待超过max_wait
+    或条数达到max_messages时，把缓冲的文本交给on_flush(parts, payload)统一处理，
+    payload为最后一条消息附带的数据。定时器由时间轮提供，on_flush在时间轮线程中执行，
+    耗时的处理（触发判断、提交请求）应交给其他线程。
+    """
+
+    def __init__(self, timer_wheel, on_flush):
+        self._timer_wheel = timer_wheel
+        self._on_flush = on_flush
+        self._lock = threading.Lock()
+        self._buffers = {}
+
+    def add(self, config, key, content, payload, now=None):
+        if now is None:
+            now = time.monotonic()
+        flush = None
+        with self._lock:
+            buffer = self._buffers.get(key)
+            if buffer is None:
+                buffer = _Buffer(now)
+                self._buffers[key] = buffer
+            elif buffer.timeout is not None:
+                buffer.timeout.cancel()
+            buffer.parts.append(content)
+            buffer.payload = payload
+
+            if len(buffer.parts) >= config.max_messages or now - buffer.first_at >= config.max_wait:
+                del self._buffers[key]
+                flush = buffer
+            else:
+                delay = min(config.window, config.max_wait - (now - buffer.first_at))
+                buffer.timeout = self._timer_wheel.schedule(delay, self._expire, key, buffer)
+
+        if flush is not None:
+            self._flush(flush)
+
+    def _expire(self, key, buffer):
+        with self._lock:
+            if self._buffers.get(key) is not buffer:
+                return
+            del self._buffers[key]
+        self._flush(buffer)
+
+    def _flush(self, buffer):
+        try:
+            self._on_flush(buffer.parts, buffer.payload)
+        except Exception as e:
+            logger.limited(logging.ERROR, "coalesce_flush", "[RandomReply] 处理合并消息时出错: %s", e, exc_info=True)
+
+    def close(self):
+        """取消所有定时器并丢弃缓冲中的消息"""
+        with self._lock:
+            buffers, self._buffers = self._buffers, {}
+        for buffer in buffers.values():
+            if buffer.timeout is not None:
+                buffer.timeout.cancel()
+
+    def __len__(self):
+        return len(self._buffers)
@@ -0,0 +1,132 @@
+import hashlib
+import mmap
+import os
+import pickle
+import sys
+import threading
+
+from .plugin_log import logger
+from .trigger_index import MATCH_CONTAINS, TriggerIndex
+
+# 缓存文件格式版本，缓存对象的结构变化时需要修改
+CACHE_VERSION = 2
+
+# 编译结果依赖的源码，源码变化后缓存失效
+_CODE_FILES = ("trigger_index.py", "compiled_cache.py")
+
+_PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def source_key(paths):
+    """按配置文件和相关源码的内容计算缓存键，文件不存在时记为空"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{CACHE_VERSION}:{sys.version}".encode("utf-8"))
+    for path in list(paths) + [os.path.join(_PLUGIN_DIR, name) for name in _CODE_FILES]:
+        digest.update(b"\0")
+        try:
+            with open(path, "rb") as f:
+                digest.update(f.read())
+        except OSError:
+            digest.update(b"-")
+    return digest.hexdigest().encode("ascii")
+
+
+class CompiledCache:
+    """含Aho-Corasick自动机的关键词索引的缓存
+
+    只有包含匹配的自动机反序列化明显快于重新构建（两万个关键词约快5倍）；
+    完全匹配、首词匹配的集合和前缀树反序列化与构建的耗时相当，黑白名单规则通常很少，都不缓存。
+    构建配置快照时按内容查找已编译的TriggerIndex，命中时直接复用，未命中时编译后记录下来。
+    finish()之后在单独的线程中把本次构建用到的索引写入缓存文件，
+    文件以配置文件、keyword插件配置文件和相关源码的内容哈希为键；
+    下次启动时键一致则用mmap映射文件直接反序列化，跳过自动机的构建。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self._used_indexes = {}
+        self._misses = 0
+        self._save_thread = None
+
+    def load(self, key):
+        """读取缓存文件，键不一致或文件损坏时忽略，返回是否已加载"""
+        try:
+            with open(self.path, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    header_end = mm.find(b"\n")
+                    if header_end < 0 or mm[:header_end] != key:
+                        return False
+                    with memoryview(mm) as view, view[header_end + 1:] as payload:
+                        indexes = pickle.loads(payload)
+        except (OSError, ValueError):
+            return False
+        except Exception as e:
+            logger.warning("[RandomReply] 读取预编译缓存失败，重新编译: %s", e)
+            return False
+        with self._lock:
+            self._indexes = indexes
+        logger.info("[RandomReply] 已加载预编译缓存: %d个关键词索引", len(indexes))
+        return True
+
+    def begin(self):
+        """开始一次快照构建，清除上次未完成（校验失败）的构建记录"""
+        with self._lock:
+            self._used_indexes = {}
+            self._misses = 0
+
+    def trigger_index(self, keywords, modes):
+        """返回关键词索引，不含包含匹配时直接构建"""
+        if MATCH_CONTAINS not in modes:
+            return TriggerIndex(keywords, modes)
+        key = (frozenset(keywords), tuple(modes))
+        with self._lock:
+            index = self._used_indexes.get(key)
+            if index is None:
+                index = self._indexes.get(key)
+        if index is None:
+            index = TriggerIndex(keywords, modes)
+        with self._lock:
+            if key not in self._indexes:
+                self._misses += 1
+            self._used_indexes[key] = index
+        return index
+
+    def finish(self, key):
+        """一次快照构建结束：只保留本次用到的索引，有新编译的索引时在后台线程中写入缓存文件"""
+        with self._lock:
+            self._indexes = self._used_indexes
+            self._used_indexes = {}
+            misses = self._misses
+            self._misses = 0
+            if not misses:
+                return
+            # 序列化大的自动机可能要几百毫秒，不能占用定时器或配置监听线程；
+            # 上一次写入尚未结束时，新线程等它完成后再写，保证文件最终是最新的
+            previous = self._save_thread
+            self._save_thread = threading.Thread(target=self._save, args=(previous, key, self._indexes),
+                                                 name="RandomReplyCompiledCache", daemon=True)
+            self._save_thread.start()
+
+    def close(self, timeout=5.0):
+        """等待正在进行的缓存写入完成"""
+        thread = self._save_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def _save(self, previous, key, indexes):
+        if previous is not None:
+            previous.join()
+        tmp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(key + b"\n")
+                pickle.dump(indexes, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.warning("[RandomReply] 写入预编译缓存失败 %s: %s", self.path, e)
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
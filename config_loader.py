@@ -0,0 +1,400 @@
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import sys
+import threading
+import weakref
+from types import MappingProxyType
+
+from .access_list import ACCESS_LIST_NAMES, AccessList, SideFileCache, parse_bloom_filter
+from .adaptive_probability import parse_adaptive_probability
+from .circuit_breaker import parse_circuit_breaker
+from .coalescer import parse_coalesce
+from .config_values import as_number, as_object
+from .dedup import parse_dedup
+from .dispatch_queue import parse_dispatch
+from .metrics import parse_metrics
+from .plugin_log import logger, parse_log
+from .profiler import parse_profiling
+from .rate_limiter import parse_rate_limit
+from .reply_cache import parse_reply_cache
+from .reply_stream import parse_streaming
+from .state_backend import parse_state_backend
+from .trigger_index import TriggerIndex, parse_match_modes
+
+# 插件默认配置，配置文件缺失或缺少字段时使用
+DEFAULT_CONFIG = {
+    "enabled": True,
+    "probability": 5,
+    "blacklist_groups": [],
+    "blacklist_users": [],
+    "whitelist_groups": [],  # 非空时只在这些群中随机回复
+    "whitelist_users": [],  # 非空时只对这些用户随机回复
+    "protect_private_msgs": True,  # 保护私聊消息
+    "min_msg_length": 5,  # 最小消息长度
+    "max_msg_length": 100,  # 最大消息长度
+    "trigger_keywords": [],  # 触发关键词列表
+    "use_keyword_plugin": False,  # 是否使用keyword插件的关键词
+    "excluded_keywords": [],  # 排除的关键词
+}
+
+
+class ConfigSnapshot:
+    """发布给消息处理线程的只读配置快照
+
+    所有字段在构建时完成校验、默认值填充和归一化，
+    消息处理时直接读取属性，无需加锁也无需再做类型转换。
+    """
+
+    __slots__ = (
+        "raw",
+        "policy",
+        "policies",
+        "blacklist_groups",
+        "blacklist_users",
+        "whitelist_groups",
+        "whitelist_users",
+        "rate_limit",
+        "dispatch",
+        "metrics",
+        "dedup",
+        "coalesce",
+        "reply_cache",
+        "state_backend",
+        "circuit_breaker",
+        "streaming",
+        "log",
+        "profiling",
+    )
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            object.__setattr__(self, name, fields[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ConfigSnapshot is read-only")
+
+
+class Policy:
+    """群组或私聊对象生效的只读策略
+
+    默认策略由全局配置生成，group_overrides/user_overrides中的每一项在加载时
+    与全局配置合并后编译为独立的策略对象（包括各自的关键词索引），
+    消息处理时按other_user_id查一次字典即可得到。
+    """
+
+    __slots__ = (
+        "enabled",
+        "protect_private_msgs",
+        "probability",
+        "min_msg_length",
+        "max_msg_length",
+        "trigger_index",
+        "adaptive",
+    )
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            object.__setattr__(self, name, fields[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Policy is read-only")
+
+
+# 可以按群组或用户覆盖的配置项
+POLICY_KEYS = frozenset((
+    "enabled",
+    "protect_private_msgs",
+    "probability",
+    "min_msg_length",
+    "max_msg_length",
+    "trigger_keywords",
+    "keyword_match_modes",
+    "adaptive_probability",
+))
+
+
+def read_json(path):
+    """读取JSON文件，文件不存在时返回None"""
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _as_int(config, key, low=None, high=None):
+    # 超出范围的值截断到边界，而不是报错
+    value = int(as_number(config[key], key))
+    if low is not None and value < low:
+        value = low
+    if high is not None and value > high:
+        value = high
+    return value
+
+
+def _as_str_list(config, key):
+    value = config[key]
+    if value is None:
+        return []
+    if not isinstance(value, list):
+        raise ValueError(f"配置项{key}必须是列表: {value!r}")
+    return [str(v) for v in value]
+
+
+def extract_keyword_plugin_keywords(keyword_config, excluded_keywords):
+    """从keyword插件配置中提取关键词，过滤空字符串和排除的关键词"""
+    if not isinstance(keyword_config, dict) or not isinstance(keyword_config.get("keyword"), dict):
+        logger.warning("[RandomReply] keyword配置文件格式不正确")
+        return []
+    excluded = set(excluded_keywords)
+    return [k for k in keyword_config["keyword"].keys() if k.strip() and k not in excluded]
+
+
+def _build_policy(config, plugin_keywords, base=None, override=None, compiled=None):
+    """由合并后的配置编译策略，关键词相关配置未被覆盖时复用默认策略的关键词索引"""
+    if base is not None and "trigger_keywords" not in override and "keyword_match_modes" not in override:
+        trigger_index = base.trigger_index
+    else:
+        keywords = set(_as_str_list(config, "trigger_keywords"))
+        keywords.update(plugin_keywords)
+        modes = parse_match_modes(config.get("keyword_match_modes"))
+        if compiled is not None:
+            trigger_index = compiled.trigger_index(keywords, modes)
+        else:
+            trigger_index = TriggerIndex(keywords, modes)
+    return Policy(
+        enabled=bool(config["enabled"]),
+        protect_private_msgs=bool(config["protect_private_msgs"]),
+        probability=_as_int(config, "probability", 0, 1000),
+        min_msg_length=_as_int(config, "min_msg_length", 0),
+        # 截断时会追加"..."，长度至少为4
+        max_msg_length=_as_int(config, "max_msg_length", 4),
+        trigger_index=trigger_index,
+        adaptive=parse_adaptive_probability(config.get("adaptive_probability")),
+    )
+
+
+def _build_access_lists(config, side_files):
+    """编译黑白名单，access_list_files中配置的外部名单文件经side_files增量加载"""
+    files = as_object(config.get("access_list_files"), "access_list_files")
+    unknown = set(files) - set(ACCESS_LIST_NAMES)
+    if unknown:
+        raise ValueError(f"配置项access_list_files只支持{list(ACCESS_LIST_NAMES)}: {sorted(unknown)}")
+    bloom = parse_bloom_filter(config.get("bloom_filter"))
+    if side_files is None:
+        side_files = SideFileCache(os.path.dirname(os.path.abspath(__file__)))
+    paths = [path for path in files.values() if path]
+    side_files.retain(paths)
+    access_lists = {}
+    for name in ACCESS_LIST_NAMES:
+        path = files.get(name)
+        if path is not None and not isinstance(path, str):
+            raise ValueError(f"配置项access_list_files.{name}必须是文件路径: {path!r}")
+        side_file = side_files.get(path, bloom) if path else None
+        if side_file is not None and name.startswith("whitelist") and not len(side_file):
+            # 路径写错时白名单为空，若视为生效会拒绝所有消息
+            logger.warning("[RandomReply] 白名单文件不存在或为空，文件中有条目之前不生效: %s", side_file.path)
+        rules = _as_str_list(config, name)
+        access_lists[name] = AccessList(rules, side_file)
+    return access_lists
+
+
+def build_snapshot(raw_config, keyword_config=None, side_files=None, compiled=None):
+    """校验并归一化原始配置，生成只读快照，配置不合法时抛出ValueError
+
+    compiled为CompiledCache时，关键词索引优先复用其中已编译的对象
+    """
+    if raw_config is None:
+        raw_config = {}
+    if not isinstance(raw_config, dict):
+        raise ValueError("配置文件内容必须是JSON对象")
+    config = dict(DEFAULT_CONFIG)
+    config.update(raw_config)
+
+    excluded_keywords = _as_str_list(config, "excluded_keywords")
+    plugin_keywords = ()
+    if config.get("use_keyword_plugin", False):
+        if keyword_config is None:
+            logger.warning("[RandomReply] 未找到keyword插件配置文件")
+        else:
+            plugin_keywords = extract_keyword_plugin_keywords(keyword_config, excluded_keywords)
+            logger.info("[RandomReply] 从keyword插件加载了%d个触发关键词", len(plugin_keywords))
+
+    policy = _build_policy(config, plugin_keywords, compiled=compiled)
+    policies = {}
+    for section in ("group_overrides", "user_overrides"):
+        overrides = as_object(config.get(section), section)
+        for target_id, override in overrides.items():
+            if not isinstance(override, dict):
+                raise ValueError(f"配置项{section}.{target_id}必须是对象: {override!r}")
+            unknown = set(override) - POLICY_KEYS
+            if unknown:
+                raise ValueError(f"配置项{section}.{target_id}包含不支持覆盖的配置: {sorted(unknown)}")
+            if target_id in policies:
+                raise ValueError(f"配置项{section}.{target_id}与已有的覆盖配置重复")
+            merged = dict(config)
+            merged.update(override)
+            try:
+                policies[target_id] = _build_policy(merged, plugin_keywords, policy, override, compiled)
+            except ValueError as e:
+                raise ValueError(f"{section}.{target_id}: {e}") from None
+
+    return ConfigSnapshot(
+        raw=MappingProxyType(config),
+        policy=policy,
+        policies=MappingProxyType(policies),
+        **_build_access_lists(config, side_files),
+        rate_limit=parse_rate_limit(config.get("rate_limit")),
+        dispatch=parse_dispatch(config.get("dispatch_queue")),
+        metrics=parse_metrics(config.get("metrics")),
+        dedup=parse_dedup(config.get("dedup")),
+        coalesce=parse_coalesce(config.get("coalesce")),
+        reply_cache=parse_reply_cache(config.get("reply_cache")),
+        state_backend=parse_state_backend(config.get("state_backend")),
+        circuit_breaker=parse_circuit_breaker(config.get("circuit_breaker")),
+        streaming=parse_streaming(config.get("streaming_truncation")),
+        log=parse_log(config.get("log")),
+        profiling=parse_profiling(config.get("profiling")),
+    )
+
+
+# inotify事件掩码
+_IN_MODIFY = 0x00000002
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+
+
+class _Inotify:
+    """基于ctypes的最小inotify封装，只用于唤醒监视线程"""
+
+    def __init__(self, directories):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        mask = _IN_MODIFY | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+        watched = 0
+        for directory in directories:
+            if os.path.isdir(directory) and libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) >= 0:
+                watched += 1
+        if not watched:
+            os.close(self.fd)
+            raise OSError("no directory could be watched")
+        # 停止监视时通过管道唤醒等待中的线程，关闭后不再写入（文件描述符可能已被复用）
+        self._wake_r, self._wake_w = os.pipe()
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def wait(self, timeout):
+        """等待文件事件，返回是否有事件发生，被wake()唤醒时返回False"""
+        readable, _, _ = select.select([self.fd, self._wake_r], [], [], timeout)
+        if not readable or self._wake_r in readable:
+            return False
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def wake(self):
+        with self._lock:
+            if not self._closed:
+                os.write(self._wake_w, b"\0")
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            for fd in (self.fd, self._wake_r, self._wake_w):
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+
+
+class ConfigWatcher(threading.Thread):
+    """监视配置文件变化的后台线程
+
+    Linux下优先使用inotify及时感知修改，不可用时退化为按mtime轮询。
+    只有文件的(mtime, size)发生变化时才调用回调重新解析配置。
+    回调以弱引用保存，插件实例被回收后线程自动退出；插件关闭时调用stop()立即停止。
+    """
+
+    def __init__(self, paths, on_change, interval=2.0, debounce=0.2):
+        super().__init__(name="RandomReplyConfigWatcher", daemon=True)
+        self._base_paths = list(paths)
+        self.paths = list(paths)
+        self.interval = interval
+        self.debounce = debounce
+        self._on_change = weakref.WeakMethod(on_change)
+        self._stop_event = threading.Event()
+        self._last_signature = self._signature()
+        self._inotify = None
+        if sys.platform.startswith("linux"):
+            try:
+                self._inotify = _Inotify({os.path.dirname(os.path.abspath(p)) for p in self.paths})
+            except (OSError, AttributeError) as e:
+                logger.info("[RandomReply] inotify不可用，使用mtime轮询监视配置: %s", e)
+
+    def watch(self, extra_paths):
+        """设置额外监视的文件（如外部名单文件），文件变化时同样触发回调
+
+        这些文件所在的目录不在inotify监视范围内时，依靠每interval秒一次的检查发现变化。
+        """
+        paths = self._base_paths + [p for p in extra_paths if p not in self._base_paths]
+        if paths != self.paths:
+            self.paths = paths
+            self._last_signature = self._signature()
+
+    def _signature(self):
+        signature = []
+        for path in self.paths:
+            try:
+                st = os.stat(path)
+                signature.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def run(self):
+        try:
+            while not self._stop_event.is_set():
+                if self._inotify is not None:
+                    if self._inotify.wait(self.interval):
+                        # 等待写入完成，合并连续的多个事件
+                        self._stop_event.wait(self.debounce)
+                else:
+                    self._stop_event.wait(self.interval)
+                if self._stop_event.is_set():
+                    break
+
+                signature = self._signature()
+                if signature == self._last_signature:
+                    continue
+                self._last_signature = signature
+
+                callback = self._on_change()
+                if callback is None:
+                    break
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error("[RandomReply] 重新加载配置失败: %s", e, exc_info=True)
+                del callback
+        finally:
+            if self._inotify is not None:
+                self._inotify.close()
+
+    def stop(self, timeout=5.0):
+        """停止监视并等待线程退出"""
+        self._stop_event.set()
+        if self._inotify is not None:
+            self._inotify.wake()
+        if self.is_alive() and self is not threading.current_thread():
+            self.join(timeout)
@@ -0,0 +1,35 @@
+def _describe(low, high, integer, positive):
+    kind = "整数" if integer else "数字"
+    if positive:
+        return f"(0, {high}]之间的{kind}" if high is not None else ("正整数" if integer else "正数")
+    if low is not None and high is not None:
+        return f"{low}-{high}之间的{kind}"
+    if low == 0:
+        return "非负整数" if integer else "非负数"
+    if low == 1 and integer:
+        return "正整数"
+    if low is not None:
+        return f">={low}的{kind}"
+    return kind
+
+
+def as_number(value, key, low=None, high=None, integer=False, positive=False):
+    """校验数字配置项并原样返回，不合法时抛出ValueError
+
+    key为错误信息中的配置项名称（如"dedup.window_seconds"），low和high为闭区间边界，
+    positive为True时要求大于0，integer为True时只接受整数。布尔值不算数字。
+    """
+    types = int if integer else (int, float)
+    if (isinstance(value, bool) or not isinstance(value, types) or (positive and value <= 0) or
+            (low is not None and value < low) or (high is not None and value > high)):
+        raise ValueError(f"配置项{key}必须是{_describe(low, high, integer, positive)}: {value!r}")
+    return value
+
+
+def as_object(value, key):
+    """校验对象（dict）配置项，None视为空对象"""
+    if value is None:
+        return {}
+    if not isinstance(value, dict):
+        raise ValueError(f"配置项{key}必须是对象: {value!r}")
+    return value
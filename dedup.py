@@ -0,0 +1,53 @@
+import hashlib
+import re
+from collections import namedtuple
+
+from .config_values import as_number
+
+# 重复消息抑制配置
+DedupConfig = namedtuple("DedupConfig", ["window", "global_threshold"])
+
+# 计算指纹前去掉的字符：空白、标点符号等非文字字符
+_NOISE = re.compile(r"[\s\W_]+")
+
+
+def parse_dedup(value):
+    """解析配置中的dedup，未启用时返回None"""
+    if not isinstance(value, dict) or not value.get("enabled", False):
+        return None
+    window = as_number(value.get("window_seconds", 60), "dedup.window_seconds", positive=True)
+    global_threshold = as_number(value.get("global_threshold", 3), "dedup.global_threshold", 0, integer=True)
+    return DedupConfig(float(window), global_threshold)
+
+
+def fingerprint(content):
+    """计算消息指纹，忽略大小写、空白和标点，近似相同的消息得到相同指纹"""
+    normalized = _NOISE.sub("", content.casefold())
+    if not normalized:
+        normalized = content
+    return hashlib.blake2b(normalized.encode("utf-8"), digest_size=8).digest()
+
+
+class DuplicateFilter:
+    """重复和刷屏消息抑制
+
+    同一群内窗口期内出现过相同指纹的消息不再触发；
+    同一指纹在窗口期内出现在global_threshold个及以上的群（转发接龙）时，所有群都不再触发。
+    指纹记录保存在共享状态后端中，每次出现都会刷新过期时间，条目数由后端的max_entries限制。
+    """
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    def check(self, config, group_id, content, now=None):
+        """记录本条消息，返回是否为重复消息（应被抑制）"""
+        if now is None:
+            # 由后端决定时钟：内存后端为单调时钟，sqlite后端为系统时间
+            now = self._backend.clock()
+        key = fingerprint(content).hex()
+        new_in_group = self._backend.add(f"dedup:{group_id}:{key}", ttl=config.window, now=now)
+        if not config.global_threshold:
+            return not new_in_group
+        # 全局计数只在指纹首次出现在某个群时加一，同时刷新过期时间
+        groups = self._backend.incr(f"dedup:*:{key}", 1 if new_in_group else 0, ttl=config.window, now=now)
+        return not new_in_group or groups >= config.global_threshold
@@ -0,0 +1,13 @@
+from collections import ChainMap
+
+from bridge.context import Context, ContextType
+
+
+def derive_context(context, content, overrides):
+    """基于原始上下文派生一个新的文本上下文，不复制原始上下文的内容
+
+    新上下文仍是Context实例，kwargs为ChainMap(overrides, 原始kwargs)：
+    读取时优先取覆盖值，其余键直接读原始上下文；写入（包括下游插件和channel的写入）
+    只落在覆盖层，原始上下文保持不变。派生的开销只与覆盖的键数有关，与原始上下文的键数无关。
+    """
+    return Context(ContextType.TEXT, content, ChainMap(overrides, context.kwargs))
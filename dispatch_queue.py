@@ -0,0 +1,162 @@
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+
+from .config_values import as_number, as_object
+from .plugin_log import logger
+
+# 分发队列配置，未启用（默认）时在消息线程中同步调用produce
+DispatchConfig = namedtuple("DispatchConfig", ["max_size", "workers"])
+
+
+def parse_dispatch(value):
+    """解析配置中的dispatch_queue，未启用时返回None
+
+    默认不启用：启用后消息在produce()执行前就已结束处理（BREAK），
+    produce()失败时原消息不会再交给后续插件和默认流程处理。
+    """
+    value = as_object(value, "dispatch_queue")
+    if not value.get("enabled", False):
+        return None
+    max_size = as_number(value.get("max_size", 100), "dispatch_queue.max_size", 1, integer=True)
+    workers = as_number(value.get("workers", 2), "dispatch_queue.workers", 1, integer=True)
+    return DispatchConfig(max_size=max_size, workers=workers)
+
+
+class DispatchQueue:
+    """触发决策与produce()之间的有界分发队列
+
+    由少量工作线程消费，关键词触发的任务优先处理。
+    队列满时优先丢弃随机触发的任务：新的随机任务直接丢弃，
+    新的关键词任务会挤掉最早的随机任务，只有队列中全是关键词任务时才丢弃它。
+    被挤掉的任务会传给on_drop，新提交被拒绝的任务由submit()的返回值告知调用方。
+    """
+
+    def __init__(self, handler, max_size=100, workers=2, name="RandomReplyDispatch", on_drop=None):
+        self._handler = handler
+        self._on_drop = on_drop
+        self._name = name
+        self._cond = threading.Condition(threading.Lock())
+        self._keyword_items = deque()
+        self._random_items = deque()
+        self.max_size = max_size
+        self.workers = workers
+        self._running_workers = 0
+        self._worker_seq = 0
+        self._threads = []
+        self._closed = False
+        self.dropped_random = 0
+        self.dropped_keyword = 0
+        self.processed = 0
+        self.failed = 0
+
+    def configure(self, max_size, workers):
+        """调整队列容量和工作线程数，已排队的任务保留"""
+        with self._cond:
+            self.max_size = max_size
+            self.workers = workers
+            # 多余的工作线程会在空闲时自行退出
+            self._cond.notify_all()
+
+    def __len__(self):
+        return len(self._keyword_items) + len(self._random_items)
+
+    def submit(self, item, keyword=False):
+        """提交任务，返回是否被接受"""
+        now = time.monotonic()
+        evicted = None
+        with self._cond:
+            if self._closed:
+                return False
+            if len(self) >= self.max_size:
+                if not keyword:
+                    self.dropped_random += 1
+                    self._log_drop("随机触发")
+                    return False
+                if not self._random_items:
+                    self.dropped_keyword += 1
+                    self._log_drop("关键词触发")
+                    return False
+                _, evicted = self._random_items.popleft()
+                self.dropped_random += 1
+                self._log_drop("随机触发")
+
+            (self._keyword_items if keyword else self._random_items).append((now, item))
+            if self._running_workers < self.workers:
+                self._start_worker()
+            self._cond.notify()
+        if evicted is not None and self._on_drop is not None:
+            self._on_drop(evicted)
+        return True
+
+    def _log_drop(self, kind):
+        dropped = self.dropped_random + self.dropped_keyword
+        # 只记录第一次和之后每100次丢弃，避免拥塞时刷屏
+        if dropped == 1 or dropped % 100 == 0:
+            logger.warning("[RandomReply] 分发队列已满，丢弃%s的任务，累计丢弃: 随机%d, 关键词%d",
+                           kind, self.dropped_random, self.dropped_keyword)
+
+    def _start_worker(self):
+        self._running_workers += 1
+        self._worker_seq += 1
+        thread = threading.Thread(target=self._worker, name=f"{self._name}-{self._worker_seq}", daemon=True)
+        self._threads = [t for t in self._threads if t.is_alive()]
+        self._threads.append(thread)
+        thread.start()
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._keyword_items and not self._random_items:
+                    if self._closed or self._running_workers > self.workers:
+                        self._running_workers -= 1
+                        return
+                    self._cond.wait()
+                if self._keyword_items:
+                    _, item = self._keyword_items.popleft()
+                else:
+                    _, item = self._random_items.popleft()
+
+            try:
+                self._handler(item)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.limited(logging.ERROR, "dispatch", "[RandomReply] 分发任务处理失败: %s", e, exc_info=True)
+
+    def close(self, timeout=5.0):
+        """停止接受任务，丢弃排队中的任务，等待工作线程处理完当前任务后退出"""
+        with self._cond:
+            self._closed = True
+            discarded = len(self)
+            self._keyword_items.clear()
+            self._random_items.clear()
+            self._cond.notify_all()
+            threads = list(self._threads)
+            self._threads.clear()
+        if discarded:
+            logger.info("[RandomReply] 分发队列已关闭，丢弃%d个排队中的任务", discarded)
+        deadline = time.monotonic() + timeout
+        for thread in threads:
+            if thread is not threading.current_thread():
+                thread.join(max(deadline - time.monotonic(), 0))
+
+    def oldest_age(self):
+        """队列中最早任务已等待的秒数，队列为空时为0"""
+        with self._cond:
+            times = [q[0][0] for q in (self._keyword_items, self._random_items) if q]
+        return time.monotonic() - min(times) if times else 0.0
+
+    def stats(self):
+        """返回队列状态，用于监控和排查积压"""
+        return {
+            "depth": len(self),
+            "keyword_depth": len(self._keyword_items),
+            "random_depth": len(self._random_items),
+            "oldest_age": self.oldest_age(),
+            "dropped_random": self.dropped_random,
+            "dropped_keyword": self.dropped_keyword,
+            "processed": self.processed,
+            "failed": self.failed,
+        }
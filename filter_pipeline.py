@@ -0,0 +1,203 @@
+import logging
+import threading
+import time
+
+from .plugin_log import logger
+
+# 消息对象必须具备的属性
+REQUIRED_MSG_ATTRS = ("actual_user_nickname", "other_user_nickname", "other_user_id", "actual_user_id")
+
+_UNSET = object()
+
+
+class MessageView:
+    """过滤阶段使用的轻量消息视图
+
+    只保存过滤需要的字段，不依赖Context和ChatMessage的具体实现，
+    离线工具可以直接用原始数据构造视图并复用同一套过滤阶段。
+    关键词匹配结果在第一次访问keyword时才计算。
+    """
+
+    __slots__ = ("content", "cleaned_content", "is_group", "msg", "group_id", "user_id", "is_at",
+                 "policy", "prefixes", "_keyword")
+
+    def __init__(self, content, is_group, msg, group_id, user_id, is_at, policy, prefixes):
+        self.content = content
+        self.cleaned_content = content.strip()
+        self.is_group = is_group
+        self.msg = msg
+        self.group_id = group_id
+        self.user_id = user_id
+        self.is_at = is_at
+        self.policy = policy
+        self.prefixes = prefixes
+        self._keyword = _UNSET
+
+    @property
+    def keyword(self):
+        """命中的(匹配方式, 关键词)，未命中为None"""
+        keyword = self._keyword
+        if keyword is _UNSET:
+            keyword = self.policy.trigger_index.match(self.cleaned_content) if self.cleaned_content else None
+            self._keyword = keyword
+        return keyword
+
+
+def check_length(policy, content):
+    """消息长度是否满足最小长度"""
+    return len(content) >= policy.min_msg_length
+
+
+# 以下为过滤阶段，参数为(消息视图, 配置快照)，消息应被拒绝时返回拒绝原因，否则返回None
+
+def _private_stage(view, snapshot):
+    if not view.is_group and view.policy.protect_private_msgs:
+        return "private"
+    return None
+
+
+def _enabled_stage(view, snapshot):
+    if not view.policy.enabled:
+        return "disabled"
+    return None
+
+
+def _msg_stage(view, snapshot):
+    msg = view.msg
+    if not msg:
+        logger.limited(logging.WARNING, "no_msg", "[RandomReply] 消息对象为空，跳过处理")
+        return "no_msg"
+    for attr in REQUIRED_MSG_ATTRS:
+        if getattr(msg, attr, None) is None:
+            logger.limited(logging.WARNING, ("missing_attr", attr), "[RandomReply] 消息缺少关键属性 %s，跳过处理", attr)
+            return "missing_attr"
+    return None
+
+
+def _length_stage(view, snapshot):
+    # 关键词触发的消息不检查长度，开启消息合并时对合并后的文本检查
+    if snapshot.coalesce is None and not check_length(view.policy, view.cleaned_content) and view.keyword is None:
+        return "length"
+    return None
+
+
+def _blacklist_stage(view, snapshot):
+    if view.group_id in snapshot.blacklist_groups or view.user_id in snapshot.blacklist_users:
+        return "blacklist"
+    return None
+
+
+def _whitelist_stage(view, snapshot):
+    # 白名单为空表示不限制，群白名单只对群聊生效
+    if view.is_group and snapshot.whitelist_groups and view.group_id not in snapshot.whitelist_groups:
+        return "whitelist"
+    if snapshot.whitelist_users and view.user_id not in snapshot.whitelist_users:
+        return "whitelist"
+    return None
+
+
+def _prefix_stage(view, snapshot):
+    prefixes = view.prefixes
+    if prefixes and view.content.startswith(prefixes):
+        return "prefix"
+    return None
+
+
+def _at_stage(view, snapshot):
+    if view.is_at:
+        return "at"
+    return None
+
+
+class Stage:
+    __slots__ = ("name", "check", "requires", "calls", "rejects", "cost")
+
+    def __init__(self, name, check, requires=()):
+        self.name = name
+        self.check = check
+        self.requires = frozenset(requires)
+        self.calls = 0
+        self.rejects = 0
+        self.cost = 0.0
+
+    def rank(self):
+        """单位拒绝率的耗时，越小越应该靠前执行"""
+        cost = self.cost / self.calls if self.calls else 0.0
+        reject_rate = (self.rejects + 0.5) / (self.calls + 1.0)
+        return cost / reject_rate
+
+
+def default_stages():
+    """消息过滤阶段，requires为必须先执行的阶段（依赖其校验结果的阶段）"""
+    return [
+        Stage("private", _private_stage),
+        Stage("disabled", _enabled_stage),
+        Stage("msg", _msg_stage),
+        Stage("length", _length_stage),
+        Stage("blacklist", _blacklist_stage, requires=("msg",)),
+        Stage("whitelist", _whitelist_stage, requires=("msg",)),
+        Stage("prefix", _prefix_stage),
+        Stage("at", _at_stage, requires=("msg",)),
+    ]
+
+
+class FilterPipeline:
+    """按实际流量自适应排序的过滤流水线
+
+    每sample_every条消息抽样一条，记录各阶段的耗时和拒绝率；
+    每reorder_every条消息按"耗时 / 拒绝率"从小到大重新排序（满足依赖关系的前提下），
+    使典型的被拒绝消息执行尽量少的代码。重新排序后统计量减半，逐渐淡化旧流量的影响。
+    各阶段互不影响结果，顺序只决定先由哪个阶段拒绝。
+    """
+
+    def __init__(self, stages=None, sample_every=16, reorder_every=1024):
+        self.stages = stages if stages is not None else default_stages()
+        self._sample_every = sample_every
+        self._reorder_every = reorder_every
+        self._count = 0
+        self._lock = threading.Lock()
+        self.order = tuple(self.stages)
+
+    def run(self, view, snapshot):
+        """依次执行各阶段，返回第一个拒绝原因，全部通过返回None"""
+        self._count += 1
+        count = self._count
+        if count % self._sample_every:
+            for stage in self.order:
+                reason = stage.check(view, snapshot)
+                if reason is not None:
+                    return reason
+            return None
+
+        if count % self._reorder_every == 0:
+            self.reorder()
+        perf_counter = time.perf_counter
+        for stage in self.order:
+            start = perf_counter()
+            reason = stage.check(view, snapshot)
+            stage.cost += perf_counter() - start
+            stage.calls += 1
+            if reason is not None:
+                stage.rejects += 1
+                return reason
+        return None
+
+    def reorder(self):
+        """按统计量重新排序，依赖的阶段总是排在前面"""
+        with self._lock:
+            pending = sorted(self.stages, key=Stage.rank)
+            order = []
+            done = set()
+            while pending:
+                stage = next((s for s in pending if s.requires <= done), pending[0])
+                pending.remove(stage)
+                order.append(stage)
+                done.add(stage.name)
+            for stage in self.stages:
+                stage.calls //= 2
+                stage.rejects //= 2
+                stage.cost /= 2
+            self.order = tuple(order)
+
+    def positions(self):
+        return {stage.name: i for i, stage in enumerate(self.order)}
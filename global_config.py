@@ -0,0 +1,70 @@
+import logging
+import threading
+
+from config import conf
+
+from .plugin_log import logger
+
+
+def _compile_prefixes(value):
+    """过滤空白前缀，编译为可直接传给str.startswith的元组"""
+    if not isinstance(value, (list, tuple)):
+        return ()
+    return tuple(p for p in value if isinstance(p, str) and p.strip())
+
+
+def _copy_value(value):
+    # 复制一份用于比较，避免配置中的列表被原地修改后检测不到变化
+    if isinstance(value, list):
+        return tuple(value)
+    return value
+
+
+# 插件读取的全局配置项：(配置项, 默认值, 编译函数)，编译结果以同名属性提供
+_KEYS = (
+    ("group_chat_prefix", (), _compile_prefixes),
+)
+
+
+class GlobalConfigView:
+    """插件用到的全局配置项的预编译缓存
+
+    消息处理时直接读取属性，不再调用conf()。后台按interval秒检查一次，
+    只有conf()返回的对象被替换（全局配置重新加载）或相关配置项的值变化时才重新编译。
+    """
+
+    def __init__(self, timer_wheel, interval=2.0):
+        self._timer_wheel = timer_wheel
+        self._interval = interval
+        self._lock = threading.Lock()
+        self._source = None
+        self._values = None
+        for key, default, _ in _KEYS:
+            setattr(self, key, default)
+        self.refresh()
+        self._timeout = timer_wheel.schedule(interval, self._tick)
+
+    def refresh(self):
+        """检查全局配置，有变化时重新编译，返回是否重新编译"""
+        with self._lock:
+            try:
+                source = conf()
+                values = tuple(_copy_value(source.get(key, default)) for key, default, _ in _KEYS)
+            except Exception as e:
+                logger.limited(logging.WARNING, "global_config", "[RandomReply] 读取全局配置失败: %s", e)
+                return False
+            if source is self._source and values == self._values:
+                return False
+            for (key, _, compile_value), value in zip(_KEYS, values):
+                setattr(self, key, compile_value(value))
+            self._source = source
+            self._values = values
+            return True
+
+    def _tick(self):
+        if self.refresh():
+            logger.info("[RandomReply] 全局配置已变化，已重新编译前缀等配置")
+        self._timeout = self._timer_wheel.schedule(self._interval, self._tick)
+
+    def stop(self):
+        self._timeout.cancel()
@@ -0,0 +1,312 @@
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .config_values import as_number, as_object
+from .plugin_log import logger
+
+# 处理耗时直方图的默认桶（秒）
+DEFAULT_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001,
+                   0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# 指标导出配置，http_port为0且file为空时不导出
+MetricsConfig = namedtuple("MetricsConfig", ["http_host", "http_port", "file", "file_interval"])
+
+
+def parse_metrics(value):
+    """解析配置中的metrics，未配置任何导出方式时返回None"""
+    if value is None:
+        return None
+    value = as_object(value, "metrics")
+    port = as_number(value.get("http_port", 0), "metrics.http_port", 0, 65535, integer=True)
+    interval = as_number(value.get("file_interval", 15), "metrics.file_interval", positive=True)
+    file = value.get("file") or ""
+    if not port and not file:
+        return None
+    return MetricsConfig(str(value.get("http_host", "127.0.0.1")), port, file, float(interval))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    """单调递增计数器
+
+    不加锁，依赖GIL保证单次自增基本原子，极端并发下可能少计，换取热路径上的低开销。
+    """
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class CounterFamily:
+    """按一个标签区分的一组计数器"""
+
+    def __init__(self, name, help, label):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._children = {}
+
+    def labels(self, value):
+        child = self._children.get(value)
+        if child is None:
+            child = self._children.setdefault(value, Counter())
+        return child
+
+    def inc(self, value, amount=1):
+        self.labels(value).inc(amount)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for value, child in sorted(self._children.items()):
+            lines.append(f'{self.name}{{{self.label}="{_escape(value)}"}} {child.value}')
+        return lines
+
+
+class Histogram:
+    """固定分桶直方图，observe只做一次二分查找和几次自增"""
+
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds=DEFAULT_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class HistogramFamily:
+    """按一个标签区分的一组直方图"""
+
+    def __init__(self, name, help, label, bounds=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.bounds = bounds
+        self._children = {}
+
+    def labels(self, value):
+        child = self._children.get(value)
+        if child is None:
+            child = self._children.setdefault(value, Histogram(self.bounds))
+        return child
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for value, child in sorted(self._children.items()):
+            label = f'{self.label}="{_escape(value)}"'
+            cumulative = 0
+            counts = list(child.counts)
+            for bound, n in zip(child.bounds, counts):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{{{label},le="{bound:g}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label}}} {child.sum}")
+            lines.append(f"{self.name}_count{{{label}}} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """导出时通过回调取值的指标，回调返回数值或{标签值: 数值}"""
+
+    def __init__(self, name, help, func, label=None, type="gauge"):
+        self.name = name
+        self.help = help
+        self.func = func
+        self.label = label
+        self.type = type
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        try:
+            value = self.func()
+        except Exception as e:
+            logger.limited(logging.WARNING, ("metric", self.name), "[RandomReply] 读取指标%s失败: %s", self.name, e)
+            return lines
+        if isinstance(value, dict):
+            for label_value, v in sorted(value.items()):
+                lines.append(f'{self.name}{{{self.label}="{_escape(label_value)}"}} {v}')
+        else:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+
+class MetricsRegistry:
+    """插件指标登记表，可按Prometheus文本格式导出"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help, label):
+        return self._register(CounterFamily(name, help, label))
+
+    def histogram(self, name, help, label, bounds=DEFAULT_BUCKETS):
+        return self._register(HistogramFamily(name, help, label, bounds))
+
+    def gauge(self, name, help, func, label=None, type="gauge"):
+        """登记回调指标，同名指标会被替换（插件重载后回调指向新实例）"""
+        metric = Gauge(name, help, func, label, type)
+        with self._lock:
+            self._metrics[name] = metric
+        return metric
+
+    def remove(self, names):
+        """注销指标，插件关闭时注销引用插件实例的回调指标"""
+        with self._lock:
+            for name in names:
+                self._metrics.pop(name, None)
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# 进程内共享的指标登记表
+metrics = MetricsRegistry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsExporter:
+    """通过本地HTTP端点或定期写文件导出指标"""
+
+    def __init__(self, timer_wheel):
+        self._timer_wheel = timer_wheel
+        self._lock = threading.Lock()
+        self._config = None
+        self._server = None
+        self._server_thread = None
+        self._file_timeout = None
+        self._file_thread = None
+
+    def configure(self, config):
+        """按新配置启动或停止导出，配置未变化时不做任何事"""
+        with self._lock:
+            if config == self._config:
+                return
+            old, self._config = self._config, config
+            http_changed = old is None or config is None or \
+                (old.http_host, old.http_port) != (config.http_host, config.http_port)
+            if http_changed:
+                self._stop_http()
+                if config is not None and config.http_port:
+                    self._start_http(config.http_host, config.http_port)
+            if self._file_timeout is not None:
+                self._file_timeout.cancel()
+                self._file_timeout = None
+            if config is not None and config.file:
+                self._file_timeout = self._timer_wheel.schedule(config.file_interval, self._tick)
+
+    def _start_http(self, host, port):
+        try:
+            self._server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            logger.warning("[RandomReply] 指标HTTP端点启动失败 %s:%d: %s", host, port, e)
+            return
+        self._server.daemon_threads = True
+        self._server_thread = threading.Thread(target=self._server.serve_forever, name="RandomReplyMetrics", daemon=True)
+        self._server_thread.start()
+        logger.info("[RandomReply] 指标HTTP端点已启动: http://%s:%d/metrics", host, port)
+
+    def _stop_http(self):
+        if self._server is not None:
+            server, self._server = self._server, None
+            self._server_thread = None
+            threading.Thread(target=lambda: (server.shutdown(), server.server_close()), daemon=True).start()
+
+    def close(self, timeout=5.0):
+        """停止导出，HTTP端点关闭后端口立即释放"""
+        with self._lock:
+            self._config = None
+            if self._file_timeout is not None:
+                self._file_timeout.cancel()
+                self._file_timeout = None
+            server, self._server = self._server, None
+            thread, self._server_thread = self._server_thread, None
+            file_thread = self._file_thread
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+            thread.join(timeout)
+        if file_thread is not None:
+            file_thread.join(timeout)
+
+    def _tick(self):
+        # 磁盘较慢时写文件可能阻塞，放到单独的线程中，避免拖慢定时器线程上的其他任务
+        self._file_thread = threading.Thread(target=self._write_file, name="RandomReplyMetricsFile", daemon=True)
+        self._file_thread.start()
+
+    def _write_file(self):
+        with self._lock:
+            config = self._config
+            if config is None or not config.file:
+                return
+        # 写临时文件后原子替换，写完再安排下一次，两次写入不会重叠
+        try:
+            tmp_path = config.file + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(metrics.render())
+            os.replace(tmp_path, config.file)
+        except OSError as e:
+            logger.limited(logging.WARNING, "metrics_file", "[RandomReply] 写入指标文件失败 %s: %s", config.file, e)
+        with self._lock:
+            if self._config is config:
+                self._file_timeout = self._timer_wheel.schedule(config.file_interval, self._tick)
@@ -0,0 +1,132 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from collections import namedtuple
+
+from common.log import logger as _base_logger
+
+from .config_values import as_number, as_object
+
+# 日志配置：debug为运行时调试开关，warning_interval为同一条限频日志的最小输出间隔（秒）
+LogConfig = namedtuple("LogConfig", ["debug", "warning_interval"])
+
+DEFAULT_LOG_CONFIG = LogConfig(debug=False, warning_interval=60.0)
+
+# 日志队列容量，队列满时丢弃新日志而不是阻塞消息处理线程
+QUEUE_SIZE = 10000
+
+
+def parse_log(value):
+    """解析配置中的log，未配置时返回默认配置"""
+    if value is None:
+        return DEFAULT_LOG_CONFIG
+    value = as_object(value, "log")
+    interval = as_number(value.get("warning_interval", DEFAULT_LOG_CONFIG.warning_interval), "log.warning_interval", 0)
+    return LogConfig(bool(value.get("debug", False)), float(interval))
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """入队时不格式化日志，消息参数和异常堆栈都由后台线程格式化"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _ForwardHandler(logging.Handler):
+    """在后台线程中把日志转交给dow的logger，由其已配置的handler输出"""
+
+    def handle(self, record):
+        _base_logger.handle(record)
+        return True
+
+    def emit(self, record):
+        _base_logger.handle(record)
+
+
+class PluginLogger(logging.Logger):
+    """插件专用的logger
+
+    日志经有界队列交给后台线程格式化和输出，消息处理线程只负责创建日志记录。
+    调用方使用%风格的参数（logger.info("...%s", value)），不要预先拼接字符串。
+    debug_enabled为运行时调试开关，热路径上的调试日志先判断该属性，关闭时连日志记录都不创建。
+    limited()对重复出现的日志限频，限频期间被省略的条数在下一次输出时附带。
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.debug_enabled = False
+        self.warning_interval = DEFAULT_LOG_CONFIG.warning_interval
+        self.suppressed = 0
+        self._limits = {}
+        self._limits_lock = threading.Lock()
+
+    def setLevel(self, level):
+        super().setLevel(level)
+        # 本logger没有登记到logging.manager中，需要自己清理级别缓存
+        self._cache.clear()
+
+    def configure(self, config):
+        """应用日志配置，未开启调试时跟随dow的日志级别"""
+        self.debug_enabled = config.debug
+        self.warning_interval = config.warning_interval
+        self.setLevel(logging.DEBUG if config.debug else _base_logger.getEffectiveLevel())
+
+    def limited(self, level, key, msg, *args, interval=None, **kwargs):
+        """同一key的日志在interval秒内只输出一次，默认间隔为warning_interval"""
+        if not self.isEnabledFor(level):
+            return
+        if interval is None:
+            interval = self.warning_interval
+        now = time.monotonic()
+        with self._limits_lock:
+            state = self._limits.get(key)
+            if state is not None and now - state[0] < interval:
+                state[1] += 1
+                self.suppressed += 1
+                return
+            suppressed = state[1] if state is not None else 0
+            self._limits[key] = [now, 0]
+        if suppressed:
+            msg += "（此前省略%d条相同日志）"
+            args += (suppressed,)
+        self._log(level, msg, args, stacklevel=2, **kwargs)
+
+
+_queue = queue.Queue(QUEUE_SIZE)
+_queue_handler = _DeferredQueueHandler(_queue)
+_listener = logging.handlers.QueueListener(_queue, _ForwardHandler())
+
+logger = PluginLogger("RandomReply")
+logger.propagate = False
+logger.addHandler(_queue_handler)
+logger.setLevel(_base_logger.getEffectiveLevel())
+_listener.start()
+
+
+def dropped():
+    """日志队列满时丢弃的日志数"""
+    return _queue_handler.dropped
+
+
+def _stop_listener():
+    # 退出前输出队列中剩余的日志
+    try:
+        _listener.stop()
+    except queue.Full:
+        pass
+
+
+atexit.register(_stop_listener)
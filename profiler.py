@@ -0,0 +1,228 @@
+import cProfile
+import glob
+import io
+import os
+import pstats
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import namedtuple
+
+from .config_values import as_number
+from .plugin_log import logger
+
+# 性能剖析配置：按sample_rate抽样事件处理器调用，每interval秒写一次结果，每种文件保留最近keep份
+ProfilingConfig = namedtuple(
+    "ProfilingConfig", ["sample_rate", "output_dir", "interval", "keep", "tracemalloc", "tracemalloc_frames"]
+)
+
+_PLUGIN_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# 汇总文件中每个处理器列出的插件函数数量
+_SUMMARY_FUNCTIONS = 15
+
+# 解释器同一时间只允许一个cProfile在工作（3.12起基于sys.monitoring，第二个enable()会抛出ValueError），
+# 所有处理器、包括重载前旧实例的处理器共用这把锁
+_PROFILE_LOCK = threading.Lock()
+
+
+def parse_profiling(value):
+    """解析配置中的profiling，未启用时返回None"""
+    if not isinstance(value, dict) or not value.get("enabled", False):
+        return None
+    sample_rate = as_number(value.get("sample_rate", 0.01), "profiling.sample_rate", high=1, positive=True)
+    interval = as_number(value.get("interval_seconds", 60), "profiling.interval_seconds", positive=True)
+    keep = as_number(value.get("keep", 10), "profiling.keep", 1, integer=True)
+    frames = as_number(value.get("tracemalloc_frames", 1), "profiling.tracemalloc_frames", 1, integer=True)
+    output_dir = value.get("output_dir") or os.path.join(tempfile.gettempdir(), "randomreply_profiles")
+    return ProfilingConfig(float(sample_rate), output_dir, float(interval), keep,
+                           bool(value.get("tracemalloc", False)), frames)
+
+
+class _HandlerProfile:
+    """一个事件处理器在当前统计周期内的剖析数据"""
+
+    __slots__ = ("lock", "profile", "calls", "seconds", "alloc_bytes")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.profile = cProfile.Profile()
+        self.calls = 0
+        self.seconds = 0.0
+        self.alloc_bytes = 0
+
+
+class HandlerProfiler:
+    """事件处理器的抽样性能剖析
+
+    启用后wrap()返回的包装函数按sample_rate抽样调用，在cProfile下执行并累计到该处理器的统计中，
+    开启tracemalloc时同时记录调用前后已分配内存的变化。每interval秒把各处理器的统计写成pstats文件，
+    并写一份汇总（各处理器的抽样次数、耗时、内存变化，以及插件内各函数（过滤阶段、触发判断等）的累计耗时），
+    开启tracemalloc时另外保存插件代码的内存分配快照，写文件在单独的线程中进行，不占用定时器线程。
+    未启用时wrap()直接返回原处理器，处理链路上没有任何额外开销。
+    整个进程同一时间只剖析一个调用，其他线程的并发调用和嵌套调用直接执行，不计入统计；
+    剖析接口被其他工具（调试器、覆盖率统计等）占用时同样直接执行。
+    """
+
+    def __init__(self, timer_wheel):
+        self._timer_wheel = timer_wheel
+        self._lock = threading.Lock()
+        self._config = None
+        self._profiles = {}
+        self._timeout = None
+        self._started_tracemalloc = False
+        self._flush_thread = None
+
+    @property
+    def enabled(self):
+        return self._config is not None
+
+    def configure(self, config):
+        with self._lock:
+            if config == self._config:
+                return
+            old_config = self._config
+            self._config = config
+            if self._timeout is not None:
+                self._timeout.cancel()
+                self._timeout = None
+            if old_config is not None:
+                self._flush(old_config)
+            if config is not None and config.tracemalloc:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start(config.tracemalloc_frames)
+                    self._started_tracemalloc = True
+            elif self._started_tracemalloc:
+                tracemalloc.stop()
+                self._started_tracemalloc = False
+            if config is not None:
+                self._timeout = self._timer_wheel.schedule(config.interval, self._tick)
+        if config is not None:
+            logger.info("[RandomReply] 性能剖析已开启，抽样比例: %s，输出目录: %s", config.sample_rate, config.output_dir)
+        elif old_config is not None:
+            logger.info("[RandomReply] 性能剖析已关闭")
+
+    def close(self, timeout=5.0):
+        """关闭剖析，写出当前周期的统计"""
+        self.configure(None)
+        thread = self._flush_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def wrap(self, name, handler):
+        """返回按当前配置包装后的处理器，未启用时返回原处理器"""
+        config = self._config
+        if config is None:
+            return handler
+        with self._lock:
+            state = self._profiles.setdefault(name, _HandlerProfile())
+        sample_rate = config.sample_rate
+        trace_alloc = config.tracemalloc
+
+        def profiled(*args, **kwargs):
+            # 锁不可重入，嵌套调用也会在这里直接执行
+            if random.random() >= sample_rate or not _PROFILE_LOCK.acquire(False):
+                return handler(*args, **kwargs)
+            try:
+                with state.lock:
+                    profile = state.profile
+                    try:
+                        profile.enable()
+                    except ValueError:
+                        # 剖析接口被其他工具占用，本次不剖析
+                        return handler(*args, **kwargs)
+                    before = tracemalloc.get_traced_memory()[0] if trace_alloc else 0
+                    start = time.perf_counter()
+                    try:
+                        return handler(*args, **kwargs)
+                    finally:
+                        profile.disable()
+                        state.seconds += time.perf_counter() - start
+                        state.calls += 1
+                        if trace_alloc:
+                            state.alloc_bytes += tracemalloc.get_traced_memory()[0] - before
+            finally:
+                _PROFILE_LOCK.release()
+
+        return profiled
+
+    def _tick(self):
+        # tracemalloc快照和写文件可能耗时较长，放到单独的线程中，避免拖慢定时器线程上的其他任务
+        self._flush_thread = threading.Thread(target=self._periodic_flush, name="RandomReplyProfiler", daemon=True)
+        self._flush_thread.start()
+
+    def _periodic_flush(self):
+        with self._lock:
+            config = self._config
+            if config is None:
+                return
+            self._flush(config)
+            self._timeout = self._timer_wheel.schedule(config.interval, self._tick)
+
+    def _flush(self, config):
+        """写出当前周期的统计并开始新的周期，调用方持有self._lock"""
+        results = []
+        for name, state in self._profiles.items():
+            with state.lock:
+                if not state.calls:
+                    continue
+                results.append((name, state.profile, state.calls, state.seconds, state.alloc_bytes))
+                state.profile = cProfile.Profile()
+                state.calls = 0
+                state.seconds = 0.0
+                state.alloc_bytes = 0
+        snapshot = None
+        if config.tracemalloc and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                [tracemalloc.Filter(True, os.path.join(_PLUGIN_DIR, "*"))])
+        if not results and snapshot is None:
+            return
+
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        try:
+            os.makedirs(config.output_dir, exist_ok=True)
+            summary = io.StringIO()
+            for name, profile, calls, seconds, alloc_bytes in results:
+                profile.dump_stats(os.path.join(config.output_dir, f"profile-{stamp}-{name}.pstats"))
+                summary.write(f"== {name}: 抽样{calls}次，总耗时{seconds:.6f}秒，平均{seconds / calls * 1e6:.1f}微秒")
+                if config.tracemalloc:
+                    summary.write(f"，内存净增{alloc_bytes}字节")
+                summary.write("\n")
+                self._write_functions(summary, profile)
+            if snapshot is not None:
+                snapshot.dump(os.path.join(config.output_dir, f"alloc-{stamp}.tracemalloc"))
+                summary.write("== 插件代码内存分配（按行）\n")
+                for stat in snapshot.statistics("lineno")[:_SUMMARY_FUNCTIONS]:
+                    summary.write(f"{stat}\n")
+            with open(os.path.join(config.output_dir, f"summary-{stamp}.txt"), "w", encoding="utf-8") as f:
+                f.write(summary.getvalue())
+            for pattern in ("profile-*.pstats", "alloc-*.tracemalloc", "summary-*.txt"):
+                self._rotate(config, pattern)
+        except OSError as e:
+            logger.warning("[RandomReply] 写入性能剖析结果失败 %s: %s", config.output_dir, e)
+            return
+        logger.info("[RandomReply] 性能剖析结果已写入: %s", config.output_dir)
+
+    @staticmethod
+    def _write_functions(out, profile):
+        """按累计耗时列出插件内的函数"""
+        stats = pstats.Stats(profile).stats
+        rows = []
+        for (filename, lineno, function), (_, ncalls, _, cumtime, _) in stats.items():
+            if filename.startswith(_PLUGIN_DIR):
+                rows.append((cumtime, ncalls, f"{os.path.basename(filename)}:{lineno}({function})"))
+        rows.sort(reverse=True)
+        for cumtime, ncalls, where in rows[:_SUMMARY_FUNCTIONS]:
+            out.write(f"    {cumtime:.6f}秒  {ncalls:>8}次  {where}\n")
+
+    @staticmethod
+    def _rotate(config, pattern):
+        # 按处理器分别保留最近keep份（时间在文件名前部，排序即为时间顺序）
+        groups = {}
+        for path in sorted(glob.glob(os.path.join(config.output_dir, pattern))):
+            groups.setdefault("-".join(os.path.basename(path).split("-")[3:]), []).append(path)
+        for paths in groups.values():
+            for path in paths[:-config.keep]:
+                os.remove(path)
@@ -1,21 +1,74 @@
+import logging
 import os
-import random
 import json
+import sys
 import threading
+import time
+import types
+import weakref
 from bridge.context import ContextType
 from bridge.reply import Reply, ReplyType
 from channel.chat_message import ChatMessage
-from common.log import logger
-from config import conf
 from plugins import Plugin, Event, EventContext, EventAction, register
+from .access_list import SideFileCache
+from .channel_registry import channel_registry
+from .circuit_breaker import STATE_NAMES, CircuitBreaker
+from .coalescer import MessageCoalescer
+from .compiled_cache import CompiledCache, source_key
+from .config_loader import DEFAULT_CONFIG, ConfigWatcher, build_snapshot, read_json
+from .derived_context import derive_context
+from .dispatch_queue import DispatchQueue
+from .filter_pipeline import FilterPipeline, MessageView, check_length
+from .global_config import GlobalConfigView
+from .metrics import MetricsExporter, metrics
+from . import plugin_log
+from .plugin_log import logger
+from .profiler import HandlerProfiler
+from .reply_cache import CACHEABLE_REPLY_TYPES, ReplyCache
+from .reply_stream import StreamingTruncator, is_stream
+from .state_backend import create_state_backend
+from .timer_wheel import TimerWheel
+from .trigger_decision import TriggerDecider
+from .trigger_index import MATCH_MODE_NAMES
+
+# 插件指标，可通过配置项metrics以Prometheus文本格式导出
+_REJECTED = metrics.counter("randomreply_messages_rejected_total", "未触发回复的消息数，按拒绝原因区分", "reason")
+_TRIGGERED = metrics.counter("randomreply_triggers_total", "触发回复的消息数，按触发原因区分", "reason")
+_REPLIES = metrics.counter("randomreply_replies_processed_total", "处理的随机回复数，按是否被截断区分", "result")
+_REPLY_CACHE = metrics.counter("randomreply_reply_cache_lookups_total", "关键词回复缓存查询次数，按是否命中区分", "result")
+_HANDLER_SECONDS = metrics.histogram("randomreply_handler_seconds", "事件处理器耗时（秒）", "handler")
+_BACKEND_SECONDS = metrics.histogram("randomreply_backend_reply_seconds", "触发后到收到回复的耗时（秒），按结果区分", "result")
+_PRODUCE_SECONDS = metrics.histogram("randomreply_produce_seconds", "调用channel.produce()的耗时（秒）", "channel").labels("gewechat")
+
+# 当前生效的插件实例记录在sys.modules中的占位模块上：dow的#scanp会用importlib.reload重新执行插件模块，
+# 模块和类上的属性都会被重置，只有这里的记录在重新加载后仍然可以找到旧实例
+_ACTIVE_INSTANCE_KEY = "randomreply_active_instance"
+
+
+def _active_holder():
+    holder = sys.modules.get(_ACTIVE_INSTANCE_KEY)
+    if holder is None:
+        holder = types.ModuleType(_ACTIVE_INSTANCE_KEY)
+        holder.instance = None
+        holder = sys.modules.setdefault(_ACTIVE_INSTANCE_KEY, holder)
+    return holder
 
-# 调试模式开关，设置为False关闭调试日志，需要时改为True启用
-DEBUG_MODE = False
 
 @register(name="RandomReply", desc="根据概率随机回复群聊消息", version="0.3", author="memor221")
 class RandomReply(Plugin):
     def __init__(self):
         super().__init__()
+        # dow重新加载插件时直接创建新实例，不会通知旧实例，先关闭旧实例释放线程、端口和数据库连接
+        holder = _active_holder()
+        previous = holder.instance
+        if previous is not None:
+            previous.close()
+        holder.instance = self
+        self._closed = False
+        # 引用本实例的回调指标和安装了send诊断包装的channel，关闭时注销和还原
+        self._gauges = []
+        self._hooked_channels = weakref.WeakSet()
+        
         # 处理 ON_RECEIVE_MESSAGE 事件，比 ON_HANDLE_CONTEXT 更早触发
         self.handlers[Event.ON_RECEIVE_MESSAGE] = self.on_receive_message
         # 添加装饰回复的处理器，处理特殊字符和格式问题
@@ -23,340 +76,458 @@ class RandomReply(Plugin):
         # 添加监控发送回复的处理器，诊断发送问题
         self.handlers[Event.ON_SEND_REPLY] = self.on_send_reply
         
-        # 配置文件锁
+        # 配置文件锁，只在加载和发布配置快照时使用
         self._config_lock = threading.Lock()
         
+        curdir = os.path.dirname(__file__)
+        self._config_path = os.path.join(curdir, "config.json")
+        self._keyword_config_path = os.path.join(os.path.dirname(curdir), "keyword", "config.json")
+        
+        # 外部黑白名单文件，重新加载配置时只读取文件新增的部分
+        self._side_files = SideFileCache(curdir)
+        
+        # 当前生效的只读配置快照，消息处理线程直接读取，无需加锁
+        self._snapshot = None
+        
+        # 触发判断（去重、限流、自适应概率），限流和去重的共享状态后端在发布配置时按state_backend创建，
+        # 后端配置不变时状态在配置热更新后保留
+        self._decider = TriggerDecider()
+        self._state_backend = None
+        self._state_backend_config = None
+        
+        # 关键词触发消息的回复缓存
+        self._reply_cache = ReplyCache()
+        
+        # 所有超时和延迟任务共用一个时间轮线程，关闭插件时停止
+        self._timer_wheel = TimerWheel()
+        
+        # 预编译的关键词索引和名单规则缓存，配置文件未变化时重启直接加载，不再重新编译
+        self._compiled_cache = CompiledCache(os.path.join(curdir, ".compiled_snapshot.cache"))
+        
+        # 触发时用到的channel类在初始化时解析，第一条触发的消息不再需要导入
+        channel_registry.preload()
+        
+        # 预编译的全局配置项（如group_chat_prefix），消息处理时不再调用conf()
+        self._global_config = GlobalConfigView(self._timer_wheel)
+        
+        # 跟踪提交给后端的请求，后端变慢或出错时暂停随机触发
+        self._circuit_breaker = CircuitBreaker(self._timer_wheel, self._on_request_complete)
+        self._gauge("randomreply_circuit_breaker_state", "熔断器状态",
+                    lambda: {name: int(self._circuit_breaker.state == state) for state, name in STATE_NAMES.items()},
+                    label="state")
+        self._gauge("randomreply_backend_inflight", "已提交给后端、尚未收到回复的请求数", self._circuit_breaker.inflight)
+        
+        # 消息过滤流水线，按各阶段的耗时和拒绝率自适应排序
+        self._filter_pipeline = FilterPipeline()
+        self._gauge("randomreply_filter_stage_position", "过滤阶段当前的执行顺序（从0开始）",
+                    self._filter_pipeline.positions, label="stage")
+        
+        # 按(群组, 用户)合并连续发送的短消息；合并窗口在时间轮线程中结束，
+        # 合并后的消息交给单独的工作线程判断和提交，未启用分发队列时produce()也不会阻塞其他定时任务
+        self._coalescer = MessageCoalescer(self._timer_wheel, self._on_coalesced)
+        self._coalesce_queue = DispatchQueue(self._flush_coalesced, workers=1, name="RandomReplyCoalesce")
+        
+        # 触发后的上下文经有界队列异步提交，避免阻塞消息接收
+        self._dispatch_queue = DispatchQueue(self._dispatch_item, on_drop=self._on_dispatch_dropped)
+        self._gauge("randomreply_dispatch_queue_depth", "分发队列中等待的任务数",
+                    lambda: self._dispatch_queue.stats()["depth"])
+        self._gauge("randomreply_dispatch_queue_oldest_age_seconds", "分发队列中最早任务已等待的时间（秒）",
+                    self._dispatch_queue.oldest_age)
+        self._gauge("randomreply_dispatch_dropped_total", "分发队列满时丢弃的任务数",
+                    lambda: {"random": self._dispatch_queue.dropped_random, "keyword": self._dispatch_queue.dropped_keyword},
+                    label="kind", type="counter")
+        
+        self._gauge("randomreply_log_discarded_total", "未输出的日志数，按原因区分（日志队列满、限频）",
+                    lambda: {"queue_full": plugin_log.dropped(), "rate_limited": logger.suppressed},
+                    label="reason", type="counter")
+        
+        # 指标导出（HTTP端点或定期写文件）
+        self._metrics_exporter = MetricsExporter(self._timer_wheel)
+        
+        # 事件处理器的抽样性能剖析，配置项profiling启用时才包装处理器
+        self._profiler = HandlerProfiler(self._timer_wheel)
+        
         # 加载插件配置
         self._load_config()
+        
+        # 监视配置文件变化，修改后自动重新加载
+        self._config_watcher = ConfigWatcher([self._config_path, self._keyword_config_path], self._reload_config)
+        self._config_watcher.watch(self._side_files.paths())
+        self._config_watcher.start()
+    
+    def _gauge(self, name, help, func, **kwargs):
+        """登记引用本实例的回调指标，关闭插件时注销"""
+        self._gauges.append(name)
+        metrics.gauge(name, help, func, **kwargs)
+    
+    def close(self):
+        """停止插件创建的后台线程、定时任务、指标端点和数据库连接，可以重复调用"""
+        with self._config_lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._config_watcher.stop()
+        self._dispatch_queue.close()
+        self._coalescer.close()
+        self._coalesce_queue.close()
+        self._circuit_breaker.close()
+        self._global_config.stop()
+        self._profiler.close()
+        self._compiled_cache.close()
+        self._metrics_exporter.close()
+        self._timer_wheel.stop()
+        metrics.remove(self._gauges)
+        # 还原channel的send方法，channel不再引用本实例
+        for channel in list(self._hooked_channels):
+            send = getattr(channel, "send", None)
+            if getattr(send, "_random_reply_hook", None) is self:
+                channel.send = send._random_reply_original
+        if self._state_backend is not None:
+            self._state_backend.close()
+        holder = _active_holder()
+        if holder.instance is self:
+            holder.instance = None
+        logger.info("[RandomReply] 插件已关闭")
+    
+    @property
+    def config(self):
+        """当前生效的配置（只读）"""
+        return self._snapshot.raw
     
     def _load_config(self):
-        """加载配置文件，带并发控制"""
+        """首次加载配置文件，配置文件不存在时写入默认配置"""
         with self._config_lock:
             try:
-                curdir = os.path.dirname(__file__)
-                config_path = os.path.join(curdir, "config.json")
-                if os.path.exists(config_path):
-                    with open(config_path, "r", encoding="utf-8") as f:
-                        self.config = json.load(f)
-                else:
-                    self.config = {
-                        "enabled": True,
-                        "probability": 5,
-                        "blacklist_groups": [],
-                        "blacklist_users": [],
-                        "protect_private_msgs": True,  # 新增：保护私聊消息
-                        "min_msg_length": 5,  # 新增：最小消息长度
-                        "max_msg_length": 100,  # 新增：最大消息长度
-                        "trigger_keywords": [],  # 触发关键词列表
-                        "use_keyword_plugin": False,  # 是否使用keyword插件的关键词
-                        "excluded_keywords": []  # 排除的关键词
-                    }
-                    with open(config_path, "w", encoding="utf-8") as f:
-                        json.dump(self.config, f, indent=4, ensure_ascii=False)
-                
-                # 确保配置中有protect_private_msgs字段
-                if "protect_private_msgs" not in self.config:
-                    self.config["protect_private_msgs"] = True
-                    with open(config_path, "w", encoding="utf-8") as f:
-                        json.dump(self.config, f, indent=4, ensure_ascii=False)
-                    
-                # 初始化关键词列表
-                self.keyword_triggers = self.config.get("trigger_keywords", [])
-                # 加载keyword插件的关键词
-                self.load_keyword_triggers_from_config()
-                    
-                logger.info(f"[RandomReply] 插件配置加载成功: {self.config}")
+                raw_config = read_json(self._config_path)
+                if raw_config is None:
+                    raw_config = dict(DEFAULT_CONFIG)
+                    with open(self._config_path, "w", encoding="utf-8") as f:
+                        json.dump(raw_config, f, indent=4, ensure_ascii=False)
+                snapshot = self._build_snapshot(raw_config, initial=True)
+                logger.info("[RandomReply] 插件配置加载成功: %s", self._config_path)
             except Exception as e:
-                logger.warning(f"[RandomReply] 加载配置文件失败: {e}")
-                self.config = {
-                    "enabled": True,
-                    "probability": 5,
-                    "blacklist_groups": [],
-                    "blacklist_users": [],
-                    "protect_private_msgs": True,  # 新增：保护私聊消息
-                    "min_msg_length": 5,  # 新增：最小消息长度
-                    "max_msg_length": 100,  # 新增：最大消息长度
-                    "trigger_keywords": [],  # 触发关键词列表
-                    "use_keyword_plugin": False,  # 是否使用keyword插件的关键词
-                    "excluded_keywords": []  # 排除的关键词
-                }
-                # 初始化默认关键词列表
-                self.keyword_triggers = []
-            
-            logger.info(f"[RandomReply] 插件已初始化，随机回复概率: {self.config.get('probability', 5)}, 私聊消息保护: {self.config.get('protect_private_msgs', True)}, 最小消息长度: {self.config.get('min_msg_length', 5)}, 最大消息长度: {self.config.get('max_msg_length', 100)}, 关键词数量: {len(self.keyword_triggers)}")
+                logger.warning("[RandomReply] 加载配置文件失败: %s", e)
+                snapshot = build_snapshot(DEFAULT_CONFIG)
+            self._publish(snapshot)
+            # 完整配置只在开启调试日志时输出
+            if logger.debug_enabled:
+                logger.debug("[RandomReply] 完整配置: %s", dict(snapshot.raw))
     
-    def load_keyword_triggers_from_config(self):
-        """根据配置决定是否加载keyword插件的关键词"""
-        # 检查是否启用keyword自动匹配
-        if self.config.get("use_keyword_plugin", False):
-            keyword_triggers = self.load_keyword_triggers()
-            
-            # 合并配置中的触发关键词
-            config_triggers = self.config.get("trigger_keywords", [])
-            if config_triggers and isinstance(config_triggers, list):
-                # 去重合并
-                all_triggers = list(set(keyword_triggers + config_triggers))
-                self.keyword_triggers = all_triggers
-            else:
-                self.keyword_triggers = keyword_triggers
+    def _reload_config(self):
+        """配置文件变化时重新解析，校验失败则继续使用旧配置"""
+        with self._config_lock:
+            try:
+                snapshot = self._build_snapshot(read_json(self._config_path))
+            except Exception as e:
+                logger.warning("[RandomReply] 配置文件校验失败，继续使用旧配置: %s", e)
+                return
+            self._publish(snapshot)
+            self._config_watcher.watch(self._side_files.paths())
+            logger.info("[RandomReply] 检测到配置文件变化，已重新加载")
+    
+    def _build_snapshot(self, raw_config, initial=False):
+        """读取keyword插件配置并构建配置快照，关键词索引优先从预编译缓存中取
+
+        initial为True（插件启动）时加载预编译缓存，keyword配置文件读取失败只记录错误，不使用其中的关键词；
+        重新加载时keyword配置文件可能正被写入，读取失败或格式不正确时抛出异常，由调用方继续使用旧配置。
+        """
+        cache_key = source_key((self._config_path, self._keyword_config_path))
+        if initial:
+            self._compiled_cache.load(cache_key)
+        keyword_config = None
+        if isinstance(raw_config, dict) and raw_config.get("use_keyword_plugin", False):
+            try:
+                keyword_config = read_json(self._keyword_config_path)
+                if keyword_config is not None and not (isinstance(keyword_config, dict) and
+                                                       isinstance(keyword_config.get("keyword"), dict)):
+                    raise ValueError("keyword配置文件格式不正确")
+            except Exception as e:
+                if not initial:
+                    raise ValueError(f"加载keyword配置文件时出错: {e}") from e
+                logger.error("[RandomReply] 加载keyword配置文件时出错: %s", e)
+                keyword_config = None
+        self._compiled_cache.begin()
+        snapshot = build_snapshot(raw_config, keyword_config, self._side_files, self._compiled_cache)
+        self._compiled_cache.finish(cache_key)
+        return snapshot
+    
+    def _publish(self, snapshot):
+        """发布新的配置快照，单次引用赋值，读取方看到的总是完整的一份配置"""
+        if snapshot.state_backend != self._state_backend_config:
+            self._switch_state_backend(snapshot.state_backend)
+        self._snapshot = snapshot
+        logger.configure(snapshot.log)
+        if snapshot.dispatch is not None:
+            self._dispatch_queue.configure(snapshot.dispatch.max_size, snapshot.dispatch.workers)
+        self._metrics_exporter.configure(snapshot.metrics)
+        self._circuit_breaker.configure(snapshot.circuit_breaker)
+        self._install_handlers(snapshot.profiling)
+        policy = snapshot.policy
+        logger.info("[RandomReply] 配置已生效，随机回复概率: %s, 私聊消息保护: %s, 最小消息长度: %d, 最大消息长度: %d, "
+                    "关键词数量: %d, 覆盖配置数量: %d, 调试日志: %s",
+                    policy.probability, policy.protect_private_msgs, policy.min_msg_length, policy.max_msg_length,
+                    len(policy.trigger_index), len(snapshot.policies), snapshot.log.debug)
+    
+    def _install_handlers(self, profiling):
+        """开启性能剖析时把事件处理器替换为抽样剖析的包装，关闭时恢复原处理器"""
+        self._profiler.configure(profiling)
+        for event, handler in ((Event.ON_RECEIVE_MESSAGE, self.on_receive_message),
+                               (Event.ON_DECORATE_REPLY, self.on_decorate_reply),
+                               (Event.ON_SEND_REPLY, self.on_send_reply)):
+            self.handlers[event] = self._profiler.wrap(handler.__name__, handler)
     
-    def load_keyword_triggers(self):
-        """从keyword插件配置文件中加载关键词"""
+    def _switch_state_backend(self, config):
+        """按配置创建新的状态后端并替换限流器和去重器，创建失败时继续使用旧后端"""
         try:
-            # 获取keyword插件配置文件路径
-            keyword_config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "keyword", "config.json")
-            if os.path.exists(keyword_config_path):
-                with open(keyword_config_path, "r", encoding="utf-8") as f:
-                    keyword_config = json.load(f)
-                    
-                # 从keyword配置中提取关键词
-                keywords = []
-                if "keyword" in keyword_config and isinstance(keyword_config["keyword"], dict):
-                    # 获取所有的关键词键
-                    keywords = list(keyword_config["keyword"].keys())
-                    # 过滤掉空字符串
-                    keywords = [k for k in keywords if k.strip()]
-                    
-                    # 过滤掉指定的关键词（从配置中获取）
-                    excluded_keywords = self.config.get("excluded_keywords", [])
-                    if excluded_keywords and isinstance(excluded_keywords, list):
-                        keywords = [k for k in keywords if k not in excluded_keywords]
-                    
-                    logger.info(f"[RandomReply] 从keyword插件加载了{len(keywords)}个触发关键词")
-                    return keywords
-                else:
-                    logger.warning("[RandomReply] keyword配置文件格式不正确")
-            else:
-                logger.warning(f"[RandomReply] 未找到keyword插件配置文件: {keyword_config_path}")
+            backend = create_state_backend(config, self._timer_wheel)
         except Exception as e:
-            logger.error(f"[RandomReply] 加载keyword配置文件时出错: {e}")
-        
-        return []
+            logger.error("[RandomReply] 创建%s状态后端失败: %s", config.type, e)
+            if self._state_backend is not None:
+                return
+            backend = create_state_backend(config._replace(type="memory"))
+        old_backend = self._state_backend
+        self._state_backend = backend
+        self._state_backend_config = config
+        self._decider.use_backend(backend)
+        if old_backend is not None:
+            old_backend.close()
+        logger.info("[RandomReply] 限流和去重状态后端: %s", config.type)
     
     def on_receive_message(self, e_context: EventContext):
         """处理 ON_RECEIVE_MESSAGE 事件"""
+        start = time.perf_counter()
+        try:
+            self._on_receive_message(e_context)
+        finally:
+            _HANDLER_SECONDS.labels("on_receive_message").observe(time.perf_counter() - start)
+    
+    def _on_receive_message(self, e_context: EventContext):
         try:
             context = e_context["context"]
+            # 整个处理过程只读取一次配置快照，保证前后使用的是同一份配置
+            snapshot = self._snapshot
             
             # 检查消息是否为空
             if context is None:
-                if DEBUG_MODE:
+                if logger.debug_enabled:
                     logger.debug("[RandomReply] 收到空上下文，跳过处理")
+                _REJECTED.inc("empty_context")
                 return
     
             # 检查是否已经被随机回复插件触发过
             if context.get("random_reply_triggered", False):
-                if DEBUG_MODE:
+                if logger.debug_enabled:
                     logger.debug("[RandomReply] 消息已被随机回复插件触发过，跳过处理")
+                _REJECTED.inc("already_triggered")
                 e_context.action = EventAction.CONTINUE
                 return
     
-            # 安全地检查是否是群聊消息
-            is_group = context.get("isgroup", False)
-            
-            # 处理私聊消息
-            if not is_group:
-                # 检查是否启用私聊消息保护
-                if self.config.get("protect_private_msgs", True):
-                    if DEBUG_MODE:
-                        logger.debug("[RandomReply] 私聊消息保护已启用，跳过处理")
-                    e_context.action = EventAction.CONTINUE
-                    return
-                else:
-                    if DEBUG_MODE:
-                        logger.debug("[RandomReply] 私聊消息保护已禁用，继续处理")
-            else:
-                if DEBUG_MODE:
-                    logger.debug("[RandomReply] 群聊消息，继续处理")
-                
             # 确保消息类型存在并且是文本消息
             if not hasattr(context, 'type') or context.type is None or context.type != ContextType.TEXT:
-                if DEBUG_MODE:
+                if logger.debug_enabled:
                     logger.debug("[RandomReply] 不是文本消息，跳过处理")
+                _REJECTED.inc("not_text")
                 e_context.action = EventAction.CONTINUE
                 return
             
             # 检查消息内容是否为空
             content = context.content
             if not content:
-                if DEBUG_MODE:
+                if logger.debug_enabled:
                     logger.debug("[RandomReply] 消息内容为空，跳过处理")
+                _REJECTED.inc("empty_content")
                 e_context.action = EventAction.CONTINUE
                 return
-
-            # 获取消息信息 - 去除前后空白
-            cleaned_content = content.strip()
-            
-            # 检查关键词触发
-            keyword_triggered = self._check_keyword_match(cleaned_content)
-            
-            # 只有在非关键词触发的情况下才检查消息长度
-            if not keyword_triggered and not self._check_message_length(cleaned_content):
-                e_context.action = EventAction.CONTINUE
-                return
-            
-            if not self.config.get("enabled", True):
-                if DEBUG_MODE:
-                    logger.debug("[RandomReply] 插件已禁用，跳过处理")
-                e_context.action = EventAction.CONTINUE
-                return
-            
-            # 安全地获取消息对象
+    
+            # 按群组（私聊时为对方用户）查找生效的策略，只查一次字典
             msg = context.get("msg")
-            if not msg:
-                logger.warning("[RandomReply] 消息对象为空，跳过处理")
-                e_context.action = EventAction.CONTINUE
-                return
-                
-            # 检查必要的属性是否存在
-            required_attrs = ['actual_user_nickname', 'other_user_nickname', 'other_user_id', 'actual_user_id']
-            for attr in required_attrs:
-                if not hasattr(msg, attr) or getattr(msg, attr) is None:
-                    logger.warning(f"[RandomReply] 消息缺少关键属性 {attr}，跳过处理")
-                    e_context.action = EventAction.CONTINUE
-                    return
-                
-            try:
-                if DEBUG_MODE:
-                    logger.debug(f"[RandomReply] 收到消息: content='{content}', from='{msg.actual_user_nickname}', group='{msg.other_user_nickname}'")
-            except Exception as e:
-                logger.warning(f"[RandomReply] 无法获取消息详情: {e}")
-                e_context.action = EventAction.CONTINUE
-                return
-                                
-            group_id = msg.other_user_id
-            user_id = msg.actual_user_id
+            group_id = getattr(msg, "other_user_id", None)
+            policy = snapshot.policies.get(group_id, snapshot.policy)
+            view = MessageView(content, context.get("isgroup", False), msg, group_id,
+                               getattr(msg, "actual_user_id", None), bool(getattr(msg, "is_at", False)),
+                               policy, self._global_config.group_chat_prefix)
             
-            # 检查黑名单
-            if self._check_blacklist(group_id, user_id):
+            # 私聊保护、开关、消息对象、长度、黑白名单、前缀和@检查，顺序按实际流量自适应调整
+            reason = self._filter_pipeline.run(view, snapshot)
+            if reason is not None:
+                if logger.debug_enabled:
+                    logger.debug("[RandomReply] 消息未通过%s检查，跳过处理", reason)
+                _REJECTED.inc(reason)
                 e_context.action = EventAction.CONTINUE
                 return
             
-            # 检查前缀匹配
-            if self._check_prefix_match(content):
-                e_context.action = EventAction.CONTINUE
-                return
+            cleaned_content = view.cleaned_content
+            keyword_triggered = view.keyword
+            user_id = view.user_id
+            if logger.debug_enabled:
+                logger.debug("[RandomReply] 收到消息: content='%s', from='%s', group='%s'",
+                             content, msg.actual_user_nickname, msg.other_user_nickname)
+                if keyword_triggered:
+                    logger.debug("[RandomReply] 检测到%s的触发关键词: '%s'，自动回复",
+                                 MATCH_MODE_NAMES[keyword_triggered[0]], keyword_triggered[1])
                 
-            # 检查是否被@
-            if hasattr(msg, 'is_at') and msg.is_at:
-                if DEBUG_MODE:
-                    logger.debug("[RandomReply] 消息含有@，跳过随机判断")
+            # 开启消息合并时，非关键词消息先进入缓冲区，窗口结束后对合并的文本统一判断
+            if not keyword_triggered and snapshot.coalesce is not None:
+                self._coalescer.add(snapshot.coalesce, (group_id, user_id), cleaned_content, (context, msg))
+                _REJECTED.inc("coalesced")
                 e_context.action = EventAction.CONTINUE
                 return
-                
-            # 输出一些调试信息
-            if DEBUG_MODE:
-                logger.debug(f"[RandomReply] 开始随机判断: content='{content}'")
-                
-            # 获取配置的随机回复概率（0-1000）
-            probability = self.config.get("probability", 0)  # 默认为0
-            if probability < 0:
-                probability = 0
-            elif probability > 1000:
-                probability = 1000
-                
-            # 如果匹配关键词则直接触发，否则根据概率决定是否回复
-            if keyword_triggered or probability == 1000 or (probability > 0 and random.randint(1, 1000) <= probability):
-                # 记录触发原因
-                if keyword_triggered:
-                    logger.info(f"[RandomReply] 关键词触发成功！匹配方式: {'完全匹配' if cleaned_content == content.strip() else '首词匹配'}")
-                else:
-                    logger.info(f"[RandomReply] 随机触发成功！概率: {probability/10}%")
-                
-                try:
-                    # 使用原始的ChatChannel处理流程
-                    from channel.chat_channel import ChatChannel
-                    from bridge.context import Context
-                    
-                    # 确保使用正确的GeWeChatChannel实例
-                    from channel.gewechat.gewechat_channel import GeWeChatChannel
-                    
-                    # 获取当前的channel实例
-                    gewechat_channel = self._check_channel_type(context.kwargs.get('channel', GeWeChatChannel()))
-                    
-                    # 创建一个新的Context对象
-                    new_context = Context(ContextType.TEXT)
-                    new_context.content = content
-                    
-                    # 确保正确复制群聊信息和用户信息
-                    new_context["session_id"] = msg.other_user_id    # 群组ID
-                    new_context["receiver"] = msg.other_user_id      # 接收者为群组
-                    new_context["group_name"] = msg.other_user_nickname
-                    new_context["user_id"] = msg.actual_user_id      # 实际发送者ID
-                    new_context["user_nickname"] = msg.actual_user_nickname  # 发送者昵称
-                    new_context["isgroup"] = is_group  # 添加群聊标记
-                    
-                    # 复制原始上下文的关键属性
-                    for key in context.kwargs:
-                        if key not in ["session_id", "receiver", "group_name", "user_id", "user_nickname", "isgroup"]:
-                            new_context[key] = context[key]
-                    
-                    # 添加前缀匹配标记，绕过前缀检查
-                    new_context["content_prefix_matched"] = True
-                    
-                    # 重要：添加标记表明这是AI需要实际回应的消息
-                    new_context["need_reply"] = True
-                    
-                    # 添加标记，表示这是随机触发的消息
-                    new_context["random_reply_triggered"] = True
-                    
-                    # 记录请求的关键信息
-                    if DEBUG_MODE:
-                        logger.debug(f"[RandomReply] 将消息'{content}'作为需要AI回复的上下文提交处理")
-                        logger.debug(f"[RandomReply] 消息信息: 用户={msg.actual_user_nickname}({msg.actual_user_id}), 群组={msg.other_user_nickname}({msg.other_user_id}), 类型={'群聊' if is_group else '私聊'}")
-                    
-                    # 设置超时处理
-                    import threading
-                    
-                    def timeout_handler():
-                        logger.warning("[RandomReply] 请求处理超时，可能需要检查服务状态")
-                    
-                    timer = threading.Timer(30.0, timeout_handler)
-                    timer.daemon = True
-                    timer.start()
-                    
-                    try:
-                        # 通过produce方法将上下文发送给channel处理
-                        gewechat_channel.produce(new_context)
-                        if DEBUG_MODE:
-                            logger.debug("[RandomReply] 已成功提交上下文进行处理")
-                        
-                        # 请求开始处理，取消定时器
-                        timer.cancel()
-                        
-                        # 中断原始消息的处理链
-                        e_context.action = EventAction.BREAK
-                        return
-                    except Exception as e:
-                        logger.error(f"[RandomReply] 提交请求时发生错误: {e}")
-                        timer.cancel()
-                        e_context.action = EventAction.CONTINUE
-                except Exception as e:
-                    logger.error(f"[RandomReply] 创建和处理新上下文失败: {e}")
-                    import traceback
-                    logger.error(f"[RandomReply] 异常详情: {traceback.format_exc()}")
-                    e_context.action = EventAction.CONTINUE
+            
+            # 触发成功时中断原始消息的处理链
+            if self._trigger(snapshot, policy, context, msg, content, cleaned_content, keyword_triggered):
+                e_context.action = EventAction.BREAK
             else:
-                # 不处理该消息
-                if DEBUG_MODE:
-                    logger.debug(f"[RandomReply] 随机触发失败，跳过此消息。概率: {probability/10}%")
                 e_context.action = EventAction.CONTINUE
                 
         except Exception as e:
-            logger.error(f"[RandomReply] 处理消息时发生错误: {e}")
+            logger.limited(logging.ERROR, "receive_message", "[RandomReply] 处理消息时发生错误: %s", e, exc_info=True)
+            _REJECTED.inc("error")
             e_context.action = EventAction.CONTINUE
             
         return
 
+    def _trigger(self, snapshot, policy, context, msg, content, cleaned_content, keyword_triggered):
+        """对通过过滤的消息做随机判断，触发时构建新的上下文并提交处理，返回是否已提交"""
+        group_id = msg.other_user_id
+        user_id = msg.actual_user_id
+        is_group = context.get("isgroup", False)
+        
+        # 输出一些调试信息
+        if logger.debug_enabled:
+            logger.debug("[RandomReply] 开始随机判断: content='%s'", content)
+            
+        # 去重、限流、概率和熔断判断，关键词消息直接触发
+        reason, probability = self._decider.decide(snapshot, policy, group_id, user_id, cleaned_content,
+                                                   keyword_triggered, self._circuit_breaker.allow_random)
+        # 熔断半开时放行的随机触发是探测请求，未能提交时要归还预留的探测名额
+        probe = self._circuit_breaker.take_probe()
+        if reason != "keyword" and reason != "random":
+            if probe is not None:
+                self._circuit_breaker.release_probe(probe)
+            if logger.debug_enabled:
+                logger.debug("[RandomReply] 未触发回复: 原因=%s, 群组=%s, 用户=%s, 概率: %s%%",
+                             reason, group_id, user_id, probability / 10)
+            _REJECTED.inc(reason)
+            return False
+        
+        # 记录触发原因
+        _TRIGGERED.inc(reason)
+        if keyword_triggered:
+            logger.info("[RandomReply] 关键词触发成功！匹配方式: %s", MATCH_MODE_NAMES[keyword_triggered[0]])
+        else:
+            logger.info("[RandomReply] 随机触发成功！概率: %.3g%%", probability / 10)
+        
+        try:
+            # 获取当前的channel实例，确保使用正确的GeWeChatChannel实例
+            gewechat_channel = self._check_channel_type(context.kwargs.get('channel'))
+            
+            overrides = {
+                # 确保正确设置群聊信息和用户信息
+                "session_id": msg.other_user_id,    # 群组ID
+                "receiver": msg.other_user_id,      # 接收者为群组
+                "group_name": msg.other_user_nickname,
+                "user_id": msg.actual_user_id,      # 实际发送者ID
+                "user_nickname": msg.actual_user_nickname,  # 发送者昵称
+                "isgroup": is_group,  # 添加群聊标记
+                # 添加前缀匹配标记，绕过前缀检查
+                "content_prefix_matched": True,
+                # 重要：添加标记表明这是AI需要实际回应的消息
+                "need_reply": True,
+                # 添加标记，表示这是随机触发的消息
+                "random_reply_triggered": True,
+                # 记录触发原因和命中的关键词，回复缓存等后续处理会用到
+                "random_reply_reason": reason,
+            }
+            if keyword_triggered:
+                overrides["random_reply_keyword"] = keyword_triggered[1]
+            if probe is not None:
+                overrides["random_reply_probe"] = probe
+            
+            # 派生新的上下文，原始上下文的其他属性（msg、channel等）直接透过覆盖层读取，不逐个复制
+            new_context = derive_context(context, content, overrides)
+            
+            # 关键词消息命中回复缓存时直接发送缓存的回复，不再请求后端
+            cached_reply = None
+            if keyword_triggered and snapshot.reply_cache is not None:
+                cached = self._reply_cache.get(snapshot.reply_cache, group_id, cleaned_content)
+                _REPLY_CACHE.inc("hit" if cached else "miss")
+                if cached:
+                    cached_reply = Reply(*cached)
+                    # 缓存的回复已经处理过，on_decorate_reply中不再重复处理和写入缓存
+                    new_context["random_reply_cached"] = True
+                    if logger.debug_enabled:
+                        logger.debug("[RandomReply] 关键词'%s'命中回复缓存", keyword_triggered[1])
+            
+            # 记录请求的关键信息
+            if logger.debug_enabled:
+                logger.debug("[RandomReply] 将消息'%s'作为需要AI回复的上下文提交处理", content)
+                logger.debug("[RandomReply] 消息信息: 用户=%s(%s), 群组=%s(%s), 类型=%s",
+                             msg.actual_user_nickname, msg.actual_user_id, msg.other_user_nickname,
+                             msg.other_user_id, "群聊" if is_group else "私聊")
+            
+            if snapshot.dispatch is not None:
+                # 放入分发队列异步提交，队列满时由队列决定丢弃哪个任务
+                if self._dispatch_queue.submit((gewechat_channel, new_context, cached_reply), keyword=bool(keyword_triggered)):
+                    return True
+                _REJECTED.inc("queue_full")
+            else:
+                try:
+                    # 未启用分发队列时同步提交
+                    self._dispatch_item((gewechat_channel, new_context, cached_reply))
+                    return True
+                except Exception as e:
+                    logger.limited(logging.ERROR, "dispatch", "[RandomReply] 提交请求时发生错误: %s", e, exc_info=True)
+                    _REJECTED.inc("error")
+        except Exception as e:
+            logger.limited(logging.ERROR, "trigger", "[RandomReply] 创建和处理新上下文失败: %s", e, exc_info=True)
+            _REJECTED.inc("error")
+        if probe is not None:
+            self._circuit_breaker.release_probe(probe)
+        return False
+    
+    def _on_coalesced(self, parts, payload):
+        """消息合并窗口结束，交给合并消息的工作线程处理"""
+        if not self._coalesce_queue.submit((parts, payload)):
+            _REJECTED.inc("queue_full")
+    
+    def _flush_coalesced(self, item):
+        """对合并后的文本统一做触发判断"""
+        parts, (context, msg) = item
+        snapshot = self._snapshot
+        policy = snapshot.policies.get(msg.other_user_id, snapshot.policy)
+        if not policy.enabled:
+            return
+        content = "\n".join(parts)
+        if logger.debug_enabled:
+            logger.debug("[RandomReply] 合并了%d条消息: user=%s, group=%s", len(parts), msg.actual_user_id, msg.other_user_id)
+        if not check_length(policy, content):
+            if logger.debug_enabled:
+                logger.debug("[RandomReply] 合并后的消息内容太短(%d字符 < %d字符)，跳过处理", len(content), policy.min_msg_length)
+            _REJECTED.inc("length")
+            return
+        self._trigger(snapshot, policy, context, msg, content, content, None)
+    
     def on_decorate_reply(self, e_context: EventContext):
         """处理 ON_DECORATE_REPLY 事件，在回复被发送前处理格式"""
+        start = time.perf_counter()
+        try:
+            self._on_decorate_reply(e_context)
+        finally:
+            _HANDLER_SECONDS.labels("on_decorate_reply").observe(time.perf_counter() - start)
+    
+    def _on_decorate_reply(self, e_context: EventContext):
         try:
             reply = e_context["reply"]
             context = e_context["context"]
             
             # 记录回复对象的详细信息，便于调试
-            if DEBUG_MODE and reply and hasattr(reply, 'type') and hasattr(reply, 'content'):
-                logger.debug(f"[RandomReply] on_decorate_reply处理的回复: type={reply.type}, content_len={len(reply.content) if reply.content else 0}, content='{reply.content}'")
+            if logger.debug_enabled and reply and hasattr(reply, 'type') and hasattr(reply, 'content'):
+                # 流式回复的内容是生成器，长度要等消费完才知道
+                if is_stream(reply.content):
+                    logger.debug("[RandomReply] on_decorate_reply处理的回复: type=%s, 流式回复", reply.type)
+                else:
+                    logger.debug("[RandomReply] on_decorate_reply处理的回复: type=%s, content_len=%d, content='%s'",
+                                 reply.type, len(reply.content) if reply.content else 0, reply.content)
                 
                 # 检查上下文的用户ID和群组ID
                 user_id = context.get("user_id")
@@ -365,60 +536,75 @@ class RandomReply(Plugin):
                 group_name = context.get("group_name")
                 
                 if user_id and session_id:
-                    logger.debug(f"[RandomReply] 回复关联: 用户={user_nickname}({user_id}), 群组={group_name}({session_id})")
+                    logger.debug("[RandomReply] 回复关联: 用户=%s(%s), 群组=%s(%s)", user_nickname, user_id, group_name, session_id)
                 
             # 检查上下文中的channel信息
             if context and "channel" in context:
                 channel = context["channel"]
-                if DEBUG_MODE:
-                    logger.debug(f"[RandomReply] on_decorate_reply处理的上下文channel: {type(channel).__name__}")
+                if logger.debug_enabled:
+                    logger.debug("[RandomReply] on_decorate_reply处理的上下文channel: %s", type(channel).__name__)
                 
                 # 检查channel类型
                 channel = self._check_channel_type(channel)
                 context["channel"] = channel
             
-            # 检查是否是我们的随机回复消息
-            if context and context.get("random_reply_triggered", False):
+            # 检查是否是我们的随机回复消息（命中回复缓存的回复已经处理过）
+            if context and context.get("random_reply_triggered", False) and not context.get("random_reply_cached", False):
+                # 结束请求跟踪，记录后端耗时和结果
+                request_id = context.get("random_reply_request_id")
+                if request_id is not None:
+                    self._circuit_breaker.finish(request_id, error=not reply or reply.type == ReplyType.ERROR)
+                
                 # 确保用户ID存在，用于正确关联回复
                 if "user_id" not in context and "msg" in context:
                     msg = context["msg"]
                     if hasattr(msg, "actual_user_id"):
                         context["user_id"] = msg.actual_user_id
-                        if DEBUG_MODE:
-                            logger.debug(f"[RandomReply] 补充用户ID: {msg.actual_user_id}")
+                        if logger.debug_enabled:
+                            logger.debug("[RandomReply] 补充用户ID: %s", msg.actual_user_id)
                     
                 # 处理回复内容
-                reply = self._process_reply(reply)
+                snapshot = self._snapshot
+                reply = self._process_reply(reply, snapshot.policies.get(context.get("receiver"), snapshot.policy),
+                                            snapshot.streaming)
                 e_context["reply"] = reply
                 
+                # 缓存关键词触发消息的回复
+                self._cache_keyword_reply(context, reply)
+                
                 # 记录处理前后的变化
-                if DEBUG_MODE and reply and hasattr(reply, 'content'):
-                    logger.debug(f"[RandomReply] 处理后的回复内容: '{reply.content}'")
+                if logger.debug_enabled and reply and hasattr(reply, 'content'):
+                    logger.debug("[RandomReply] 处理后的回复内容: '%s'", reply.content)
             
             # 尝试检查gewechat_channel最终发送的消息内容
             try:
-                if DEBUG_MODE and "channel" in context and reply and reply.type == ReplyType.TEXT:
-                    logger.debug(f"[RandomReply] 即将发送的消息内容: '{reply.content}'")
+                if logger.debug_enabled and "channel" in context and reply and reply.type == ReplyType.TEXT:
+                    logger.debug("[RandomReply] 即将发送的消息内容: '%s'", reply.content)
                     
                     # 尝试检查接收者信息
                     receiver = context.get("receiver")
                     user_id = context.get("user_id")
                     if receiver:
-                        logger.debug(f"[RandomReply] 消息接收者: {receiver}, 关联用户ID: {user_id}")
+                        logger.debug("[RandomReply] 消息接收者: %s, 关联用户ID: %s", receiver, user_id)
             except Exception as send_check_error:
-                logger.warning(f"[RandomReply] 检查发送信息时出错: {send_check_error}")
+                logger.warning("[RandomReply] 检查发送信息时出错: %s", send_check_error)
             
             return
         except Exception as e:
-            logger.error(f"[RandomReply] 处理回复时出错: {e}")
-            import traceback
-            logger.error(f"[RandomReply] 处理回复异常详情: {traceback.format_exc()}")
+            logger.limited(logging.ERROR, "decorate_reply", "[RandomReply] 处理回复时出错: %s", e, exc_info=True)
             return
 
     def on_send_reply(self, e_context: EventContext):
         """
         处理 ON_SEND_REPLY 事件，监控消息发送过程
         """
+        start = time.perf_counter()
+        try:
+            self._on_send_reply(e_context)
+        finally:
+            _HANDLER_SECONDS.labels("on_send_reply").observe(time.perf_counter() - start)
+    
+    def _on_send_reply(self, e_context: EventContext):
         try:
             # 获取关键信息
             reply = e_context["reply"]
@@ -426,193 +612,177 @@ class RandomReply(Plugin):
             channel = e_context["channel"]
             
             # 记录详细的发送信息
-            if DEBUG_MODE:
-                logger.debug(f"[RandomReply] 监控消息发送: channel类型={type(channel).__name__}")
+            if logger.debug_enabled:
+                logger.debug("[RandomReply] 监控消息发送: channel类型=%s", type(channel).__name__)
             
                 if reply:
-                    logger.debug(f"[RandomReply] 要发送的回复: type={reply.type}, content='{reply.content if hasattr(reply, 'content') else 'N/A'}'")
+                    logger.debug("[RandomReply] 要发送的回复: type=%s, content='%s'",
+                                 reply.type, getattr(reply, "content", "N/A"))
             
                 if context:
                     receiver = context.get("receiver")
                     session_id = context.get("session_id")
                     isgroup = context.get("isgroup")
-                    logger.debug(f"[RandomReply] 消息上下文: receiver={receiver}, session_id={session_id}, isgroup={isgroup}")
-                
-            # 检查channel的send方法
-            if hasattr(channel, 'send'):
-                # 获取原始send方法，用于后续恢复
-                original_send = channel.send
+                    logger.debug("[RandomReply] 消息上下文: receiver=%s, session_id=%s, isgroup=%s", receiver, session_id, isgroup)
                 
-                # 定义包装后的send方法，用于捕获发送错误
-                def wrapped_send(self_ref, reply_obj, context_obj):
-                    try:
-                        if DEBUG_MODE:
-                            logger.debug(f"[RandomReply] 准备通过{type(self_ref).__name__}.send发送消息: {reply_obj}")
-                        
-                        # 检查是否为基类引用，如果是，则应该直接使用GeWeChatChannel
-                        if type(self_ref).__name__ == 'ChatChannel' and not hasattr(self_ref, '_send'):
-                            logger.warning("[RandomReply] 检测到使用的是ChatChannel基类，尝试修正为GeWeChatChannel实例")
-                            from channel.gewechat.gewechat_channel import GeWeChatChannel
-                            
-                            # 创建一个新的GeWeChatChannel实例
-                            gewechat_instance = GeWeChatChannel()
-                            
-                            # 使用子类实例的send方法
-                            logger.info("[RandomReply] 改用GeWeChatChannel实例发送消息")
-                            result = gewechat_instance.send(reply_obj, context_obj)
-                            return result
-                        
-                        # 检查client属性
-                        if DEBUG_MODE and hasattr(self_ref, 'client'):
-                            client = self_ref.client
-                            if hasattr(client, 'post_text'):
-                                logger.debug(f"[RandomReply] client.post_text方法存在")
-                            else:
-                                logger.warning(f"[RandomReply] client.post_text方法不存在")
-                        
-                        # 调用原始send方法
-                        result = original_send(reply_obj, context_obj)
-                        return result
-                    except NotImplementedError:
-                        # 专门处理未实现异常
-                        logger.error("[RandomReply] 发现NotImplementedError - Channel基类方法被调用")
-                        
-                        # 尝试直接使用GeWeChatChannel
-                        try:
-                            from channel.gewechat.gewechat_channel import GeWeChatChannel
-                            logger.info("[RandomReply] 尝试使用GeWeChatChannel发送消息")
-                            
-                            # 创建新的GeWeChatChannel实例并发送消息
-                            gewechat_instance = GeWeChatChannel()
-                            # 合成新的回复对象，确保不会出现引用问题
-                            from bridge.reply import Reply, ReplyType
-                            
-                            # 只复制重要属性
-                            new_reply = Reply(reply_obj.type, reply_obj.content)
-                            result = gewechat_instance.send(new_reply, context_obj)
-                            
-                            logger.info("[RandomReply] 使用GeWeChatChannel发送成功")
-                            return result
-                        except Exception as recovery_error:
-                            logger.error(f"[RandomReply] 恢复发送失败: {recovery_error}")
-                            import traceback
-                            logger.error(f"[RandomReply] 恢复发送异常详情: {traceback.format_exc()}")
-                            raise
-                    except Exception as e:
-                        # 记录详细的异常信息
-                        import traceback
-                        logger.error(f"[RandomReply] 监控到消息发送异常: {e}")
-                        logger.error(f"[RandomReply] 发送异常详情: {traceback.format_exc()}")
-                        # 重新抛出异常，不影响原来的错误处理流程
-                        raise
-                
-                # 应用补丁
-                channel.send = wrapped_send.__get__(channel, type(channel))
-                
-                # 注册恢复原始方法的定时器，确保不会永久更改send方法
-                import threading
-                def restore_send():
-                    try:
-                        channel.send = original_send
-                        if DEBUG_MODE:
-                            logger.debug("[RandomReply] 已恢复原始send方法")
-                    except:
-                        pass
-                
-                restore_timer = threading.Timer(30.0, restore_send)
-                restore_timer.daemon = True
-                restore_timer.start()
+            # 为channel的send方法安装一次诊断包装，已安装时直接跳过
+            self._install_send_hook(channel)
                 
             # 不修改动作，继续事件处理链
             return
         
         except Exception as e:
-            logger.error(f"[RandomReply] 监控消息发送过程中发生错误: {e}")
-            import traceback
-            logger.error(f"[RandomReply] 监控异常详情: {traceback.format_exc()}")
+            logger.limited(logging.ERROR, "send_reply", "[RandomReply] 监控消息发送过程中发生错误: %s", e, exc_info=True)
             # 继续事件处理链
             return
 
-    def _check_channel_type(self, channel):
-        """检查channel类型并返回正确的channel实例"""
-        try:
-            from channel.gewechat.gewechat_channel import GeWeChatChannel
-            if not str(type(channel).__name__).lower().endswith('gewechatchannel'):
-                logger.warning(f"[RandomReply] 上下文中的channel不是GeWeChatChannel，尝试修正")
-                return GeWeChatChannel()
-            return channel
-        except Exception as e:
-            logger.error(f"[RandomReply] 检查channel类型时出错: {e}")
-            return channel
+    def _install_send_hook(self, channel):
+        """为channel安装send诊断包装，同一channel只安装一次"""
+        send = getattr(channel, "send", None)
+        if send is None or getattr(send, "_random_reply_hook", None) is self:
+            return
+        
+        # 插件重载后替换旧实例安装的包装，而不是在其外层继续包装
+        original_send = getattr(send, "_random_reply_original", send)
+        
+        def hooked_send(reply_obj, context_obj):
+            return self._diagnostic_send(channel, original_send, reply_obj, context_obj)
+        
+        hooked_send._random_reply_hook = self
+        hooked_send._random_reply_original = original_send
+        channel.send = hooked_send
+        self._hooked_channels.add(channel)
+        if logger.debug_enabled:
+            logger.debug("[RandomReply] 已为%s安装send诊断包装", type(channel).__name__)
     
-    def _check_keyword_match(self, content):
-        """优化后的关键词匹配算法"""
-        if not self.keyword_triggers or not content:
-            return False
-            
-        # 使用集合存储关键词，提高查找效率
-        keyword_set = set(self.keyword_triggers)
-        
-        # 完全匹配检查
-        if content in keyword_set:
-            if DEBUG_MODE:
-                logger.debug(f"[RandomReply] 检测到完全匹配的触发关键词: '{content}'，自动回复")
-            return True
+    def _diagnostic_send(self, channel, original_send, reply_obj, context_obj):
+        """包装后的send方法，用于捕获发送错误"""
+        try:
+            if logger.debug_enabled:
+                logger.debug("[RandomReply] 准备通过%s.send发送消息: %s", type(channel).__name__, reply_obj)
             
-        # 首词匹配检查
-        if " " in content:
-            first_word = content.split(" ", 1)[0]
-            if first_word in keyword_set:
-                if DEBUG_MODE:
-                    logger.debug(f"[RandomReply] 检测到第一个词匹配触发关键词: '{first_word}'，自动回复")
-                return True
+            # 检查是否为基类引用，如果是，则应该直接使用GeWeChatChannel
+            if type(channel).__name__ == 'ChatChannel' and not hasattr(channel, '_send'):
+                logger.limited(logging.WARNING, "base_channel", "[RandomReply] 检测到使用的是ChatChannel基类，尝试修正为GeWeChatChannel实例")
                 
-        return False
-    
-    def _check_blacklist(self, group_id, user_id):
-        """检查黑名单"""
-        blacklist_groups = self.config.get("blacklist_groups", [])
-        blacklist_users = self.config.get("blacklist_users", [])
-        
-        if group_id in blacklist_groups:
-            if DEBUG_MODE:
-                logger.debug(f"[RandomReply] 群组 {group_id} 在黑名单中，跳过随机回复")
-            return True
+                # 使用登记的GeWeChatChannel实例
+                gewechat_instance = channel_registry.get()
+                
+                # 使用子类实例的send方法
+                logger.info("[RandomReply] 改用GeWeChatChannel实例发送消息")
+                return gewechat_instance.send(reply_obj, context_obj)
             
-        if user_id in blacklist_users:
-            if DEBUG_MODE:
-                logger.debug(f"[RandomReply] 用户 {user_id} 在黑名单中，跳过随机回复")
-            return True
+            # 检查client属性
+            if logger.debug_enabled and hasattr(channel, 'client'):
+                if hasattr(channel.client, 'post_text'):
+                    logger.debug("[RandomReply] client.post_text方法存在")
+                else:
+                    logger.warning("[RandomReply] client.post_text方法不存在")
             
-        return False
+            # 调用原始send方法
+            return original_send(reply_obj, context_obj)
+        except NotImplementedError:
+            # 专门处理未实现异常
+            logger.limited(logging.ERROR, "not_implemented", "[RandomReply] 发现NotImplementedError - Channel基类方法被调用")
+            
+            # 尝试直接使用GeWeChatChannel
+            try:
+                gewechat_instance = channel_registry.get()
+                if gewechat_instance is channel:
+                    # 登记的实例本身发送失败，无法再修正
+                    raise
+                logger.info("[RandomReply] 尝试使用GeWeChatChannel发送消息")
+                
+                # 使用登记的GeWeChatChannel实例发送消息
+                
+                # 只复制重要属性，合成新的回复对象，确保不会出现引用问题
+                new_reply = Reply(reply_obj.type, reply_obj.content)
+                result = gewechat_instance.send(new_reply, context_obj)
+                
+                logger.info("[RandomReply] 使用GeWeChatChannel发送成功")
+                return result
+            except Exception as recovery_error:
+                logger.limited(logging.ERROR, "send_recovery", "[RandomReply] 恢复发送失败: %s", recovery_error, exc_info=True)
+                raise
+        except Exception as e:
+            # 记录详细的异常信息
+            logger.limited(logging.ERROR, "send", "[RandomReply] 监控到消息发送异常: %s", e, exc_info=True)
+            # 重新抛出异常，不影响原来的错误处理流程
+            raise
     
-    def _check_message_length(self, content):
-        """检查消息长度"""
-        min_msg_length = self.config.get("min_msg_length", 5)
-        if len(content) < min_msg_length:
-            if DEBUG_MODE:
-                logger.debug(f"[RandomReply] 消息内容太短({len(content)}字符 < {min_msg_length}字符)，跳过处理")
-            return False
-        return True
+    def _on_dispatch_dropped(self, item):
+        """排队中的随机触发任务被关键词任务挤掉，归还它预留的熔断探测名额"""
+        probe = item[1].get("random_reply_probe")
+        if probe is not None:
+            self._circuit_breaker.release_probe(probe)
     
-    def _check_prefix_match(self, content):
-        """检查前缀匹配"""
-        group_chat_prefix = conf().get("group_chat_prefix", [])
-        if not group_chat_prefix:
-            return False
-            
-        valid_prefixes = [p for p in group_chat_prefix if p.strip() != ""]
-        for prefix in valid_prefixes:
-            if content.startswith(prefix):
-                if DEBUG_MODE:
-                    logger.debug(f"[RandomReply] 消息匹配前缀 '{prefix}'，跳过随机判断")
-                return True
-        return False
+    def _dispatch_item(self, item):
+        """处理一个分发任务，item为(channel, context, 缓存的回复)
+        
+        有缓存的回复时不再请求后端，经channel的装饰和发送流程直接发送，
+        与后端生成的回复一样加上@发送者和回复前后缀，并触发ON_DECORATE_REPLY和ON_SEND_REPLY事件；
+        否则通过produce方法将上下文发送给channel处理
+        """
+        channel, new_context, cached_reply = item
+        if cached_reply is not None:
+            channel._send_reply(new_context, channel._decorate_reply(new_context, cached_reply))
+            return
+        
+        # 登记请求，收到回复时在on_decorate_reply中结束，超时未回复记为错误
+        request_id = self._circuit_breaker.start(new_context.get("random_reply_reason"),
+                                                 new_context.get("random_reply_probe"))
+        new_context["random_reply_request_id"] = request_id
+        start = time.perf_counter()
+        try:
+            channel.produce(new_context)
+        except Exception:
+            self._circuit_breaker.finish(request_id, error=True)
+            raise
+        finally:
+            _PRODUCE_SECONDS.observe(time.perf_counter() - start)
+        if logger.debug_enabled:
+            logger.debug("[RandomReply] 已成功提交上下文进行处理")
+    
+    def _cache_keyword_reply(self, context, reply):
+        """把关键词触发消息的回复写入回复缓存"""
+        cache_config = self._snapshot.reply_cache
+        if cache_config is None or context.get("random_reply_reason") != "keyword":
+            return
+        if not reply or reply.type is None or reply.type.name not in CACHEABLE_REPLY_TYPES:
+            return
+        if not isinstance(reply.content, str) or not reply.content or not isinstance(context.content, str):
+            return
+        self._reply_cache.put(cache_config, context.get("session_id"), context.content,
+                              context.get("random_reply_keyword"), reply.type, reply.content)
+    
+    def _on_request_complete(self, latency, result):
+        """提交给后端的请求完成（收到回复、出错或超时）"""
+        _BACKEND_SECONDS.labels(result).observe(latency)
+        if logger.debug_enabled:
+            logger.debug("[RandomReply] 请求完成: 结果=%s, 耗时=%.2f秒", result, latency)
     
-    def _process_reply(self, reply):
+    def _check_channel_type(self, channel):
+        """检查channel类型并返回正确的channel实例"""
+        try:
+            if channel is not None and not channel_registry.is_gewechat(channel):
+                logger.limited(logging.WARNING, "channel_type", "[RandomReply] 上下文中的channel不是GeWeChatChannel，尝试修正")
+            return channel_registry.resolve(channel)
+        except Exception as e:
+            logger.limited(logging.ERROR, "channel_type_error", "[RandomReply] 检查channel类型时出错: %s", e)
+            return channel
+    
+    def _process_reply(self, reply, policy, streaming=None):
         """处理回复内容"""
         if not reply or not hasattr(reply, 'content'):
             return reply
+        
+        # 流式回复：启用流式截断时边接收边处理，否则等待完整回复后按普通回复处理
+        if is_stream(reply.content):
+            if streaming is not None:
+                truncator = StreamingTruncator(reply.content, policy.max_msg_length, streaming.sentence_boundary)
+                reply.content = self._stream_reply(truncator)
+                return reply
+            reply.content = "".join(reply.content)
             
         content = reply.content.strip()
         
@@ -622,9 +792,17 @@ class RandomReply(Plugin):
             content = content[1:-1].strip()
         
         # 限制长度
-        max_msg_length = self.config.get("max_msg_length", 100)
+        max_msg_length = policy.max_msg_length
         if len(content) > max_msg_length:
             content = content[:max_msg_length-3] + "..."
+            _REPLIES.inc("truncated")
+        else:
+            _REPLIES.inc("unchanged")
             
         reply.content = content
-        return reply
\ No newline at end of file
+        return reply
+    
+    def _stream_reply(self, truncator):
+        """输出流式截断后的回复，结束时记录是否被截断"""
+        yield from truncator
+        _REPLIES.inc("truncated" if truncator.truncated else "unchanged")
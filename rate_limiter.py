@@ -0,0 +1,58 @@
+from collections import namedtuple
+
+from .config_values import as_number
+
+# 令牌桶限流配置，速率单位为每分钟令牌数，速率<=0表示该层级不限流
+RateLimitConfig = namedtuple(
+    "RateLimitConfig",
+    ["group_rate", "group_burst", "user_rate", "user_burst", "global_rate", "global_burst"],
+)
+
+
+def parse_rate_limit(value):
+    """解析配置中的rate_limit，未启用时返回None"""
+    if not isinstance(value, dict) or not value.get("enabled", False):
+        return None
+
+    def number(key, default):
+        return max(float(as_number(value.get(key, default), f"rate_limit.{key}")), 0.0)
+
+    return RateLimitConfig(
+        group_rate=number("group_per_minute", 2) / 60.0,
+        group_burst=max(number("group_burst", 3), 1.0),
+        user_rate=number("user_per_minute", 1) / 60.0,
+        user_burst=max(number("user_burst", 2), 1.0),
+        global_rate=number("global_per_minute", 20) / 60.0,
+        global_burst=max(number("global_burst", 20), 1.0),
+    )
+
+
+class TokenBucketLimiter:
+    """按群组、用户和全局三个层级限流的令牌桶
+
+    桶状态保存在共享状态后端中，使用sqlite后端时同一台机器上的多个进程共享同一份限流预算。
+    限流参数在每次调用时传入，配置热更新后已有的桶状态保持不变。
+    """
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    @staticmethod
+    def _buckets(config, group_id, user_id):
+        """返回本次请求涉及的所有桶：[(键, 每秒速率, 容量), ...]"""
+        buckets = []
+        if config.global_rate > 0:
+            buckets.append(("rl:global", config.global_rate, config.global_burst))
+        if config.group_rate > 0 and group_id is not None:
+            buckets.append((f"rl:g:{group_id}", config.group_rate, config.group_burst))
+        if config.user_rate > 0 and user_id is not None:
+            buckets.append((f"rl:u:{user_id}", config.user_rate, config.user_burst))
+        return buckets
+
+    def would_allow(self, config, group_id, user_id, now=None):
+        """检查各层级是否都还有令牌，不消耗令牌"""
+        return self._backend.acquire_tokens(self._buckets(config, group_id, user_id), consume=False, now=now)
+
+    def try_acquire(self, config, group_id, user_id, now=None):
+        """各层级都有令牌时同时扣减并返回True，否则不扣减并返回False"""
+        return self._backend.acquire_tokens(self._buckets(config, group_id, user_id), consume=True, now=now)
@@ -0,0 +1,83 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from types import MappingProxyType
+
+from .config_values import as_number, as_object
+
+# 关键词回复缓存配置，keyword_ttls为按关键词单独设置的缓存时间（秒）
+ReplyCacheConfig = namedtuple("ReplyCacheConfig", ["default_ttl", "max_entries", "keyword_ttls"])
+
+# 可以缓存的回复类型，其他类型（语音、文件等）的内容可能在发送后失效
+CACHEABLE_REPLY_TYPES = frozenset(("TEXT", "IMAGE_URL", "VIDEO_URL"))
+
+
+def parse_reply_cache(value):
+    """解析配置中的reply_cache，未启用时返回None"""
+    if not isinstance(value, dict) or not value.get("enabled", False):
+        return None
+    default_ttl = as_number(value.get("default_ttl", 300), "reply_cache.default_ttl", 0)
+    max_entries = as_number(value.get("max_entries", 1000), "reply_cache.max_entries", 1, integer=True)
+    keyword_ttls = as_object(value.get("keyword_ttls"), "reply_cache.keyword_ttls")
+    ttls = {}
+    for keyword, ttl in keyword_ttls.items():
+        ttls[keyword] = float(as_number(ttl, f"reply_cache.keyword_ttls.{keyword}", 0))
+    return ReplyCacheConfig(float(default_ttl), max_entries, MappingProxyType(ttls))
+
+
+def normalize(content):
+    """归一化消息内容作为缓存键：去掉首尾空白、合并连续空白并忽略大小写"""
+    return " ".join(content.split()).casefold()
+
+
+class _Entry:
+    __slots__ = ("reply_type", "content", "expires_at")
+
+    def __init__(self, reply_type, content, expires_at):
+        self.reply_type = reply_type
+        self.content = content
+        self.expires_at = expires_at
+
+
+class ReplyCache:
+    """关键词触发消息的回复缓存
+
+    键为(群组, 归一化后的消息内容)，每个关键词可以设置不同的缓存时间，
+    条目数超过max_entries时按LRU淘汰。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def get(self, config, group_id, content, now=None):
+        """返回缓存的(回复类型, 回复内容)，未命中或已过期返回None"""
+        if now is None:
+            now = time.monotonic()
+        key = (group_id, normalize(content))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= now:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry.reply_type, entry.content
+
+    def put(self, config, group_id, content, keyword, reply_type, reply_content, now=None):
+        """缓存回复，关键词的缓存时间为0时不缓存"""
+        ttl = config.keyword_ttls.get(keyword, config.default_ttl)
+        if ttl <= 0:
+            return
+        if now is None:
+            now = time.monotonic()
+        key = (group_id, normalize(content))
+        with self._lock:
+            self._entries[key] = _Entry(reply_type, reply_content, now + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > config.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,121 @@
+import unicodedata
+from collections import namedtuple
+
+# 流式回复截断配置：sentence_boundary为True时优先在句子边界截断
+StreamingConfig = namedtuple("StreamingConfig", ["sentence_boundary"])
+
+ELLIPSIS = "..."
+
+# 包裹整个回复的引号，与非流式处理保持一致
+_QUOTES = "\"'"
+
+# 句子结束符，截断时优先在这些字符之后断开
+_SENTENCE_ENDS = frozenset("。！？!?；;…\n.")
+
+
+def parse_streaming(value):
+    """解析配置中的streaming_truncation，未启用时返回None"""
+    if not isinstance(value, dict) or not value.get("enabled", False):
+        return None
+    return StreamingConfig(bool(value.get("sentence_boundary", True)))
+
+
+def is_stream(content):
+    """回复内容是否为按块产生的流（生成器或其他迭代器）"""
+    return not isinstance(content, (str, bytes)) and hasattr(content, "__next__")
+
+
+def _extends_previous(text, i):
+    """text[i]是否与前一个字符属于同一个字形（组合符号、变体选择符、肤色修饰符、零宽连接符）"""
+    ch = text[i]
+    if ch in "\u200d\ufe0e\ufe0f" or "\U0001f3fb" <= ch <= "\U0001f3ff":
+        return True
+    if i > 0 and text[i - 1] == "\u200d":
+        return True
+    return unicodedata.category(ch) in ("Mn", "Mc", "Me")
+
+
+class StreamingTruncator:
+    """增量去除引号并截断流式回复
+
+    逐块消费上游产生的文本，开头的空白直接去掉，结尾的空白暂存到流结束时再处理；
+    不可能被截断影响的前缀立即输出，降低首次发送的延迟。
+    输出长度即将超过max_length时在句子边界（或字形边界）截断并追加"..."，
+    同时关闭上游生成器，不再为会被丢弃的内容付出生成成本。
+
+    与非流式处理一样，只有首尾是同一个引号时才去掉引号。以引号开头的回复
+    要到流结束才能确定是否去掉，此前输出的任何内容都可能与非流式处理的结果不一致，
+    因此整段接收后再处理。
+    """
+
+    def __init__(self, chunks, max_length, sentence_boundary=True):
+        self._chunks = chunks
+        self._limit = max_length - len(ELLIPSIS)
+        self._max_length = max_length
+        # 截断位置只在[limit/2, limit]内查找，此前的内容一定会被保留，可以提前输出
+        self._safe = self._limit // 2
+        self._sentence_boundary = sentence_boundary
+        self.truncated = False
+
+    def __iter__(self):
+        chunks = self._chunks
+        leading = True
+        emitted = 0
+        pending = ""
+        try:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                if leading:
+                    chunk = chunk.lstrip()
+                    if not chunk:
+                        continue
+                    leading = False
+                    if chunk[0] in _QUOTES:
+                        yield from self._quoted(chunk + "".join(c for c in chunks if c))
+                        return
+                pending += chunk
+
+                # 之后的内容只会让结果更长，所以按当前内容结束计算的长度超出限制时即可截断
+                if emitted + len(pending.rstrip()) > self._max_length:
+                    self.truncated = True
+                    yield pending[:self._cut(pending, self._limit - emitted, self._safe - emitted)] + ELLIPSIS
+                    return
+
+                # 结尾的空白可能在流结束时被去掉，暂不输出
+                ready = min(len(pending.rstrip()), self._safe - emitted)
+                if ready > 0:
+                    yield pending[:ready]
+                    emitted += ready
+                    pending = pending[ready:]
+
+            tail = pending.rstrip()
+            if tail:
+                yield tail
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+
+    def _quoted(self, text):
+        """处理以引号开头的完整回复：首尾是同一个引号时去掉，再按长度截断"""
+        text = text.rstrip()
+        if text.endswith(text[0]):
+            text = text[1:-1].strip()
+        if len(text) > self._max_length:
+            self.truncated = True
+            text = text[:self._cut(text, self._limit, self._safe)] + ELLIPSIS
+        if text:
+            yield text
+
+    def _cut(self, text, limit, low):
+        """返回截断位置：优先在[low, limit]内最后一个句子结束符之后，否则在不拆开字形的位置"""
+        limit = max(min(limit, len(text)), 0)
+        if self._sentence_boundary:
+            for i in range(limit - 1, max(low, 0) - 1, -1):
+                if text[i] in _SENTENCE_ENDS:
+                    return i + 1
+        cut = limit
+        while 0 < cut < len(text) and _extends_previous(text, cut):
+            cut -= 1
+        return cut
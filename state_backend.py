@@ -0,0 +1,406 @@
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict, namedtuple
+
+from .config_values import as_number, as_object
+from .plugin_log import logger
+
+# 共享状态后端配置：type为memory或sqlite，path为sqlite数据库文件路径
+StateBackendConfig = namedtuple("StateBackendConfig", ["type", "path", "max_entries"])
+
+DEFAULT_SQLITE_PATH = os.path.join(tempfile.gettempdir(), "randomreply_state.sqlite3")
+
+# SQLite后端清理过期状态的间隔（秒）和每个事务最多删除的行数，分批删除避免长时间占用写锁
+CLEANUP_INTERVAL = 60.0
+CLEANUP_BATCH = 1000
+
+
+def parse_state_backend(value):
+    """解析配置中的state_backend，默认使用进程内存"""
+    value = as_object(value, "state_backend")
+    backend_type = value.get("type", "memory")
+    if backend_type not in ("memory", "sqlite"):
+        raise ValueError(f"配置项state_backend.type只能是memory或sqlite: {backend_type!r}")
+    max_entries = as_number(value.get("max_entries", 100000), "state_backend.max_entries", 1, integer=True)
+    return StateBackendConfig(backend_type, str(value.get("path") or DEFAULT_SQLITE_PATH), max_entries)
+
+
+def create_state_backend(config, timer_wheel=None):
+    """按配置创建状态后端，传入timer_wheel时SQLite后端定期在后台清理过期状态"""
+    if config.type == "sqlite":
+        return SQLiteStateBackend(config.path, config.max_entries, timer_wheel)
+    return MemoryStateBackend(config.max_entries)
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated", "idle_ttl")
+
+    def __init__(self, tokens, updated, idle_ttl):
+        self.tokens = tokens
+        self.updated = updated
+        self.idle_ttl = idle_ttl
+
+
+class MemoryStateBackend:
+    """进程内状态后端（默认）
+
+    带过期时间的整数键值和令牌桶都保存在LRU有序字典中，
+    条目数超过max_entries时淘汰最久未使用的条目。
+    """
+
+    # 未传入now时使用的时钟，状态只在进程内有效，使用单调时钟不受系统时间调整影响
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._values = OrderedDict()
+        self._buckets = OrderedDict()
+
+    def _live(self, key, now):
+        item = self._values.get(key)
+        if item is None:
+            return None
+        if item[1] is not None and item[1] <= now:
+            del self._values[key]
+            return None
+        self._values.move_to_end(key)
+        return item
+
+    def _store(self, key, value, ttl, now):
+        self._values[key] = [value, now + ttl if ttl else None]
+        self._values.move_to_end(key)
+        while len(self._values) > self.max_entries:
+            self._values.popitem(last=False)
+
+    def get(self, key, now=None):
+        """返回键的当前值，不存在或已过期返回None"""
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            item = self._live(key, now)
+            return None if item is None else item[0]
+
+    def incr(self, key, amount=1, ttl=None, now=None):
+        """原子地增加键的值并刷新过期时间，返回增加后的值"""
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            item = self._live(key, now)
+            value = amount if item is None else item[0] + amount
+            self._store(key, value, ttl, now)
+            return value
+
+    def add(self, key, value=1, ttl=None, now=None):
+        """键不存在时写入并返回True；已存在时只刷新过期时间并返回False"""
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            item = self._live(key, now)
+            if item is not None:
+                item[1] = now + ttl if ttl else None
+                return False
+            self._store(key, value, ttl, now)
+            return True
+
+    def compare_and_set(self, key, expected, value, ttl=None, now=None):
+        """当前值等于expected（不存在视为None）时写入value，返回是否写入"""
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            item = self._live(key, now)
+            if (None if item is None else item[0]) != expected:
+                return False
+            self._store(key, value, ttl, now)
+            return True
+
+    def acquire_tokens(self, buckets, consume=True, now=None):
+        """检查一组令牌桶是否都有令牌，consume为True时同时各扣减一个
+
+        buckets为[(键, 每秒速率, 容量), ...]，所有桶要么都扣减，要么都不扣减。
+        """
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            states = []
+            for key, rate, burst in buckets:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    bucket = _Bucket(burst, now, burst / rate)
+                    self._buckets[key] = bucket
+                    self._evict_buckets(now)
+                else:
+                    self._buckets.move_to_end(key)
+                    if now > bucket.updated:
+                        bucket.tokens = min(burst, bucket.tokens + (now - bucket.updated) * rate)
+                        bucket.updated = now
+                    bucket.idle_ttl = burst / rate
+                states.append(bucket)
+            if any(b.tokens < 1.0 for b in states):
+                return False
+            if consume:
+                for b in states:
+                    b.tokens -= 1.0
+            return True
+
+    def _evict_buckets(self, now):
+        # 空闲时间超过回满所需时间的桶与新桶等价，可以直接淘汰
+        while len(self._buckets) > 1:
+            key, oldest = next(iter(self._buckets.items()))
+            if len(self._buckets) <= self.max_entries and now - oldest.updated < oldest.idle_ttl:
+                break
+            del self._buckets[key]
+
+    def __len__(self):
+        return len(self._values) + len(self._buckets)
+
+    def close(self):
+        pass
+
+
+def _close_connection(conn):
+    try:
+        conn.close()
+    except sqlite3.Error:
+        pass
+
+
+class _ThreadConnection:
+    """线程私有的数据库连接，线程退出时随thread-local数据一起回收并关闭连接"""
+
+    __slots__ = ("conn", "__weakref__")
+
+    def __init__(self, conn):
+        self.conn = conn
+        weakref.finalize(self, _close_connection, conn)
+
+
+class SQLiteStateBackend:
+    """基于SQLite（WAL模式）的本机多进程共享状态后端
+
+    同一台机器上的多个dify-on-wechat进程指向同一个数据库文件即可共享
+    限流预算和去重记录。读改写操作在BEGIN IMMEDIATE事务中完成，保证原子性。
+    数据库文件在重启后仍然保留，时间使用time.time()：单调时钟在系统重启后从零开始，
+    重启前写入的时间戳会导致令牌桶长期不回补、去重记录长期不过期。
+    数据库出错时放行（不限流、不去重），避免状态后端故障导致插件不可用。
+    过期状态的清理和条目数限制由定时器每CLEANUP_INTERVAL秒交给单独的线程执行，不占用消息线程。
+    """
+
+    clock = staticmethod(time.time)
+
+    def __init__(self, path, max_entries=100000, timer_wheel=None):
+        self.path = path
+        self.max_entries = max_entries
+        self._timer_wheel = timer_wheel
+        self._local = threading.local()
+        self._connections = weakref.WeakSet()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._timeout = None
+        self._cleanup_thread = None
+        # 提前创建表结构，路径不可用时在加载配置阶段就能发现
+        self._connection()
+        if timer_wheel is not None:
+            self._timeout = timer_wheel.schedule(CLEANUP_INTERVAL, self._tick)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=1.0, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # 状态只用于限流和去重，不需要持久化保证
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value INTEGER NOT NULL, expires REAL)")
+        conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+        conn.execute("CREATE INDEX IF NOT EXISTS kv_expires ON kv (expires)")
+        conn.execute("CREATE INDEX IF NOT EXISTS buckets_updated ON buckets (updated)")
+        return conn
+
+    def _connection(self):
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            holder = _ThreadConnection(self._connect())
+            self._local.holder = holder
+            with self._lock:
+                self._connections.add(holder)
+        return holder.conn
+
+    def _transaction(self, func, default):
+        try:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(conn)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as e:
+            logger.limited(logging.WARNING, "state_backend", "[RandomReply] 共享状态数据库操作失败: %s", e)
+            return default
+        return result
+
+    def _tick(self):
+        # 删除可能涉及大量行，放到单独的线程中，避免拖慢定时器线程上的其他任务
+        with self._lock:
+            if self._closed:
+                return
+            self._cleanup_thread = threading.Thread(target=self._periodic_cleanup, name="RandomReplyStateCleanup",
+                                                    daemon=True)
+            self._cleanup_thread.start()
+
+    def _periodic_cleanup(self):
+        self.cleanup()
+        with self._lock:
+            if not self._closed:
+                self._timeout = self._timer_wheel.schedule(CLEANUP_INTERVAL, self._tick)
+
+    def cleanup(self, now=None):
+        """删除过期的键，并把键值和令牌桶各自限制在max_entries条以内
+
+        超出条数时键值先淘汰最早过期的，没有过期时间的最后淘汰；令牌桶淘汰最久未使用的。
+        使用独立的连接分批删除，每批一个事务。
+        """
+        if now is None:
+            now = time.time()
+        try:
+            conn = self._connect()
+        except sqlite3.Error as e:
+            logger.limited(logging.WARNING, "state_backend_cleanup", "[RandomReply] 清理共享状态数据库失败: %s", e)
+            return
+        try:
+            self._delete_batches(conn, "SELECT rowid FROM kv WHERE expires <= ?", (now,), "kv")
+            self._trim(conn, "kv", "SELECT rowid FROM kv WHERE expires IS NOT NULL ORDER BY expires")
+            self._trim(conn, "kv", "SELECT rowid FROM kv WHERE expires IS NULL")
+            self._trim(conn, "buckets", "SELECT rowid FROM buckets ORDER BY updated")
+        except sqlite3.Error as e:
+            logger.limited(logging.WARNING, "state_backend_cleanup", "[RandomReply] 清理共享状态数据库失败: %s", e)
+        finally:
+            _close_connection(conn)
+
+    def _trim(self, conn, table, select):
+        # 表名只来自本模块中的常量
+        (count,) = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()
+        if count > self.max_entries:
+            self._delete_batches(conn, select, (), table, count - self.max_entries)
+
+    @staticmethod
+    def _delete_batches(conn, select, params, table, limit=None):
+        """按select选出的行（rowid）分批删除，最多删除limit行"""
+        while limit is None or limit > 0:
+            batch = CLEANUP_BATCH if limit is None else min(limit, CLEANUP_BATCH)
+            deleted = conn.execute(f"DELETE FROM {table} WHERE rowid IN ({select} LIMIT ?)", params + (batch,)).rowcount
+            if limit is not None:
+                limit -= deleted
+            if deleted < batch:
+                break
+
+    @staticmethod
+    def _live(conn, key, now):
+        row = conn.execute("SELECT value, expires FROM kv WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= now):
+            return None
+        return row[0]
+
+    @staticmethod
+    def _store(conn, key, value, ttl, now):
+        conn.execute("INSERT OR REPLACE INTO kv (key, value, expires) VALUES (?, ?, ?)",
+                     (key, value, now + ttl if ttl else None))
+
+    def get(self, key, now=None):
+        if now is None:
+            now = time.time()
+        try:
+            return self._live(self._connection(), key, now)
+        except sqlite3.Error as e:
+            logger.limited(logging.WARNING, "state_backend", "[RandomReply] 共享状态数据库操作失败: %s", e)
+            return None
+
+    def incr(self, key, amount=1, ttl=None, now=None):
+        if now is None:
+            now = time.time()
+
+        def op(conn):
+            current = self._live(conn, key, now)
+            value = amount if current is None else current + amount
+            self._store(conn, key, value, ttl, now)
+            return value
+
+        return self._transaction(op, amount)
+
+    def add(self, key, value=1, ttl=None, now=None):
+        if now is None:
+            now = time.time()
+
+        def op(conn):
+            if self._live(conn, key, now) is not None:
+                conn.execute("UPDATE kv SET expires = ? WHERE key = ?", (now + ttl if ttl else None, key))
+                return False
+            self._store(conn, key, value, ttl, now)
+            return True
+
+        return self._transaction(op, True)
+
+    def compare_and_set(self, key, expected, value, ttl=None, now=None):
+        if now is None:
+            now = time.time()
+
+        def op(conn):
+            if self._live(conn, key, now) != expected:
+                return False
+            self._store(conn, key, value, ttl, now)
+            return True
+
+        return self._transaction(op, False)
+
+    @staticmethod
+    def _bucket_tokens(conn, buckets, now):
+        states = []
+        for key, rate, burst in buckets:
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                tokens = burst
+            else:
+                tokens = min(burst, row[0] + max(now - row[1], 0.0) * rate)
+            states.append((key, tokens))
+        return states
+
+    def acquire_tokens(self, buckets, consume=True, now=None):
+        if now is None:
+            now = time.time()
+
+        if not consume:
+            # 只检查不扣减时无需写锁
+            try:
+                states = self._bucket_tokens(self._connection(), buckets, now)
+            except sqlite3.Error as e:
+                logger.limited(logging.WARNING, "state_backend", "[RandomReply] 共享状态数据库操作失败: %s", e)
+                return True
+            return all(tokens >= 1.0 for _, tokens in states)
+
+        def op(conn):
+            states = self._bucket_tokens(conn, buckets, now)
+            if not all(tokens >= 1.0 for _, tokens in states):
+                return False
+            conn.executemany("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                             [(key, tokens - 1.0, now) for key, tokens in states])
+            return True
+
+        return self._transaction(op, True)
+
+    def close(self, timeout=5.0):
+        """停止定期清理，关闭所有线程的连接"""
+        with self._lock:
+            self._closed = True
+            if self._timeout is not None:
+                self._timeout.cancel()
+            thread = self._cleanup_thread
+            holders = list(self._connections)
+            self._connections.clear()
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
+        for holder in holders:
+            _close_connection(holder.conn)
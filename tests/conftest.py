@@ -0,0 +1,10 @@
+import os
+import sys
+
+# 测试不依赖dow框架：用benchmarks/fakes.py中的替身模块加载插件包
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import fakes  # noqa: E402
+
+fakes.install()
+fakes.load_plugin_package()
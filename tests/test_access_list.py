@@ -0,0 +1,27 @@
+from random_reply.access_list import AccessList, SideFileCache
+from random_reply.config_loader import build_snapshot
+
+
+def test_whitelist_with_missing_or_empty_file_is_inactive(tmp_path):
+    side_files = SideFileCache(str(tmp_path))
+    config = {"access_list_files": {"whitelist_users": "whitelist.txt"}}
+
+    snapshot = build_snapshot(config, side_files=side_files)
+    assert not snapshot.whitelist_users
+
+    (tmp_path / "whitelist.txt").write_text("# 只有注释\n\n", encoding="utf-8")
+    snapshot = build_snapshot(config, side_files=side_files)
+    assert not snapshot.whitelist_users
+
+    (tmp_path / "whitelist.txt").write_text("wxid_a\nwxid_b*\n", encoding="utf-8")
+    snapshot = build_snapshot(config, side_files=side_files)
+    assert snapshot.whitelist_users
+    assert "wxid_a" in snapshot.whitelist_users
+    assert "wxid_b1" in snapshot.whitelist_users
+    assert "wxid_c" not in snapshot.whitelist_users
+
+
+def test_access_list_is_active_with_inline_rules():
+    assert not AccessList([])
+    assert AccessList(["wxid_a"])
+    assert AccessList(["re:^wxid_\\d+$"])
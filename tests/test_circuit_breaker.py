@@ -0,0 +1,76 @@
+import threading
+
+from random_reply.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, parse_circuit_breaker
+from random_reply.timer_wheel import TimerWheel
+
+
+def _open_breaker(probes):
+    wheel = TimerWheel()
+    breaker = CircuitBreaker(wheel)
+    breaker.configure(parse_circuit_breaker({"enabled": True, "min_requests": 1, "error_rate": 0.5,
+                                             "open_seconds": 1, "half_open_probes": probes}))
+    breaker.finish(breaker.start("random", now=0.0), error=True, now=0.5)
+    assert breaker.state == OPEN
+    return wheel, breaker
+
+
+def test_half_open_reserves_probe_slots_atomically():
+    wheel, breaker = _open_breaker(probes=1)
+    try:
+        results = []
+        barrier = threading.Barrier(10)
+
+        def call():
+            barrier.wait()
+            results.append(breaker.allow_random(now=10.0))
+            breaker.take_probe()
+
+        threads = [threading.Thread(target=call) for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert breaker.state == HALF_OPEN
+        assert results.count(True) == 1
+    finally:
+        breaker.close()
+        wheel.stop()
+
+
+def test_only_probe_outcomes_close_half_open_breaker():
+    wheel, breaker = _open_breaker(probes=1)
+    try:
+        assert breaker.allow_random(now=10.0)
+        probe = breaker.take_probe()
+        assert probe is not None
+        assert not breaker.allow_random(now=10.0)
+        assert breaker.take_probe() is None
+
+        # 关键词触发和熔断前提交的请求不影响半开状态
+        breaker.finish(breaker.start("keyword", now=10.0), now=10.1)
+        assert breaker.state == HALF_OPEN
+
+        breaker.finish(breaker.start("random", probe, now=10.0), now=10.2)
+        assert breaker.state == CLOSED
+    finally:
+        breaker.close()
+        wheel.stop()
+
+
+def test_failed_probe_reopens_and_released_slot_is_reusable():
+    wheel, breaker = _open_breaker(probes=1)
+    try:
+        assert breaker.allow_random(now=10.0)
+        breaker.release_probe(breaker.take_probe())
+        assert breaker.allow_random(now=10.0)
+        probe = breaker.take_probe()
+
+        breaker.finish(breaker.start("random", probe, now=10.0), error=True, now=10.1)
+        assert breaker.state == OPEN
+        # 旧的探测标记在状态切换后失效，不会影响下一轮半开
+        breaker.release_probe(probe)
+        assert breaker.allow_random(now=20.0)
+        assert not breaker.allow_random(now=20.0)
+    finally:
+        breaker.close()
+        wheel.stop()
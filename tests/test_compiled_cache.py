@@ -0,0 +1,47 @@
+import gc
+import threading
+
+from random_reply.compiled_cache import CompiledCache
+from random_reply.trigger_index import MATCH_CONTAINS, MATCH_EXACT, MATCH_FIRST_WORD
+
+KEY = b"test-key"
+
+
+def _build(cache, keywords, modes):
+    cache.begin()
+    index = cache.trigger_index(keywords, modes)
+    cache.finish(KEY)
+    return index
+
+
+def test_contains_index_is_saved_off_thread_and_reloaded(tmp_path, monkeypatch):
+    path = str(tmp_path / "compiled.cache")
+    cache = CompiledCache(path)
+    save_threads = []
+    save = cache._save
+
+    def recording_save(*args):
+        save_threads.append(threading.current_thread())
+        save(*args)
+
+    monkeypatch.setattr(cache, "_save", recording_save)
+    keywords = {"天气", "北京", "你好"}
+    built = _build(cache, keywords, [MATCH_EXACT, MATCH_CONTAINS])
+    cache.close()
+    assert save_threads and threading.main_thread() not in save_threads
+
+    loaded = CompiledCache(path)
+    assert loaded.load(KEY)
+    assert gc.isenabled()
+    index = _build(loaded, keywords, [MATCH_EXACT, MATCH_CONTAINS])
+    assert loaded._save_thread is None
+    assert index is not built
+    assert index.match("今天北京天气") == built.match("今天北京天气")
+    assert not CompiledCache(path).load(b"other-key")
+
+
+def test_indexes_without_contains_mode_are_not_cached(tmp_path):
+    cache = CompiledCache(str(tmp_path / "compiled.cache"))
+    _build(cache, {"天气"}, [MATCH_EXACT, MATCH_FIRST_WORD])
+    assert cache._save_thread is None
+    assert not (tmp_path / "compiled.cache").exists()
@@ -0,0 +1,45 @@
+from random_reply.dedup import DuplicateFilter, fingerprint, parse_dedup
+from random_reply.state_backend import MemoryStateBackend
+
+
+def _config(window=60, global_threshold=0):
+    return parse_dedup({"enabled": True, "window_seconds": window, "global_threshold": global_threshold})
+
+
+def test_duplicate_in_group_expires_after_window():
+    dedup = DuplicateFilter(MemoryStateBackend())
+    config = _config(window=60)
+    assert not dedup.check(config, "g1", "你好", now=0.0)
+    assert dedup.check(config, "g1", "你好", now=30.0)
+    # 每次出现都会刷新过期时间
+    assert dedup.check(config, "g1", "你好", now=80.0)
+    assert not dedup.check(config, "g1", "你好", now=141.0)
+
+
+def test_duplicates_are_scoped_to_group():
+    dedup = DuplicateFilter(MemoryStateBackend())
+    config = _config()
+    assert not dedup.check(config, "g1", "你好", now=0.0)
+    assert not dedup.check(config, "g2", "你好", now=0.0)
+    assert not dedup.check(config, "g1", "再见", now=0.0)
+
+
+def test_fingerprint_ignores_case_whitespace_and_punctuation():
+    assert fingerprint("Hello, World!") == fingerprint("hello world")
+    assert fingerprint("你好！！") == fingerprint("你好")
+    assert fingerprint("你好") != fingerprint("你们好")
+    # 只有标点的消息按原文计算指纹
+    assert fingerprint("？") != fingerprint("！")
+
+
+def test_global_threshold_suppresses_content_in_every_group():
+    dedup = DuplicateFilter(MemoryStateBackend())
+    config = _config(window=60, global_threshold=3)
+    assert not dedup.check(config, "g1", "接龙", now=0.0)
+    # 同一群内重复出现不计入群数
+    assert dedup.check(config, "g1", "接龙", now=1.0)
+    assert not dedup.check(config, "g2", "接龙", now=2.0)
+    assert dedup.check(config, "g3", "接龙", now=3.0)
+    assert dedup.check(config, "g4", "接龙", now=4.0)
+    # 窗口期过后重新计数
+    assert not dedup.check(config, "g5", "接龙", now=100.0)
@@ -0,0 +1,86 @@
+import threading
+import time
+
+from random_reply.dispatch_queue import DispatchQueue, parse_dispatch
+
+
+def test_dispatch_queue_is_disabled_by_default():
+    assert parse_dispatch(None) is None
+    assert parse_dispatch({"max_size": 10}) is None
+    assert parse_dispatch({"enabled": True, "max_size": 10}).max_size == 10
+
+
+def test_full_queue_sheds_random_items_first():
+    started = threading.Event()
+    release = threading.Event()
+    handled = []
+    dropped = []
+
+    def handler(item):
+        if item == "busy":
+            started.set()
+            release.wait(5)
+        handled.append(item)
+
+    queue = DispatchQueue(handler, max_size=3, workers=1, on_drop=dropped.append)
+    try:
+        # 唯一的工作线程被占用，之后的任务都在队列中等待
+        assert queue.submit("busy")
+        assert started.wait(2)
+        assert queue.submit("r1") and queue.submit("r2")
+        assert queue.submit("k1", keyword=True)
+
+        # 队列已满：新的随机任务直接丢弃，新的关键词任务挤掉最早的随机任务
+        assert not queue.submit("r3")
+        assert queue.submit("k2", keyword=True)
+        assert queue.submit("k3", keyword=True)
+        assert dropped == ["r1", "r2"]
+        # 队列中全是关键词任务时才丢弃新的关键词任务
+        assert not queue.submit("k4", keyword=True)
+
+        time.sleep(0.01)
+        stats = queue.stats()
+        assert stats["depth"] == 3
+        assert stats["keyword_depth"] == 3
+        assert stats["random_depth"] == 0
+        assert stats["dropped_random"] == 3
+        assert stats["dropped_keyword"] == 1
+        assert stats["oldest_age"] > 0
+
+        release.set()
+        deadline = time.monotonic() + 2
+        while len(handled) < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert handled == ["busy", "k1", "k2", "k3"]
+        assert queue.stats()["depth"] == 0 and queue.oldest_age() == 0.0
+        assert queue.processed == 4
+    finally:
+        release.set()
+        queue.close()
+
+
+def test_keyword_items_are_handled_before_random_items():
+    started = threading.Event()
+    release = threading.Event()
+    handled = []
+
+    def handler(item):
+        started.set()
+        release.wait(5)
+        handled.append(item)
+
+    queue = DispatchQueue(handler, max_size=10, workers=1)
+    try:
+        queue.submit("first")
+        assert started.wait(2)
+        for item in ("r1", "r2"):
+            queue.submit(item)
+        queue.submit("k1", keyword=True)
+        release.set()
+        deadline = time.monotonic() + 2
+        while len(handled) < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert handled[1:] == ["k1", "r1", "r2"]
+    finally:
+        release.set()
+        queue.close()
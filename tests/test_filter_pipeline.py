@@ -0,0 +1,53 @@
+import time
+
+import pytest
+
+from random_reply.filter_pipeline import FilterPipeline, Stage, default_stages
+
+
+def _stage(name, reject, requires=(), delay=0.0):
+    def check(view, snapshot):
+        if delay:
+            time.sleep(delay)
+        return name if reject(view) else None
+    return Stage(name, check, requires)
+
+
+def test_reorder_runs_cheap_selective_stages_first():
+    slow = _stage("slow", lambda view: False, delay=0.001)
+    cheap = _stage("cheap", lambda view: True)
+    pipeline = FilterPipeline([slow, cheap], sample_every=1, reorder_every=10)
+    assert [s.name for s in pipeline.order] == ["slow", "cheap"]
+    for _ in range(10):
+        assert pipeline.run(None, None) == "cheap"
+    assert [s.name for s in pipeline.order] == ["cheap", "slow"]
+    # 排在前面的阶段拒绝后，后面的阶段不再执行
+    slow.check = lambda view, snapshot: pytest.fail("slow阶段不应再执行")
+    for _ in range(10):
+        assert pipeline.run(None, None) == "cheap"
+
+
+def test_reorder_keeps_dependencies_and_halves_statistics():
+    stages = {stage.name: stage for stage in default_stages()}
+    for stage in stages.values():
+        stage.calls, stage.rejects, stage.cost = 100, 0, 1.0
+    # at阶段最便宜且总是拒绝，但依赖msg阶段的校验结果
+    stages["at"].rejects, stages["at"].cost = 100, 0.001
+    pipeline = FilterPipeline(list(stages.values()))
+    pipeline.reorder()
+    positions = pipeline.positions()
+    assert positions["msg"] < positions["at"]
+    assert positions["at"] <= positions["msg"] + 1
+    for name in ("blacklist", "whitelist"):
+        assert positions["msg"] < positions[name]
+    assert stages["at"].calls == 50 and stages["at"].rejects == 50
+    assert stages["private"].cost == 0.5
+
+
+def test_order_does_not_change_whether_a_message_is_rejected():
+    first = _stage("first", lambda view: view % 2 == 0)
+    second = _stage("second", lambda view: view % 3 == 0)
+    forward = FilterPipeline([first, second], sample_every=1, reorder_every=10 ** 6)
+    backward = FilterPipeline([second, first], sample_every=1, reorder_every=10 ** 6)
+    for view in range(30):
+        assert (forward.run(view, None) is None) == (backward.run(view, None) is None)
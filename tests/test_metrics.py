@@ -0,0 +1,31 @@
+import threading
+import time
+
+from random_reply.metrics import MetricsExporter, parse_metrics
+from random_reply.timer_wheel import TimerWheel
+
+
+def test_metrics_file_is_written_off_timer_thread(tmp_path):
+    path = tmp_path / "metrics.prom"
+    wheel = TimerWheel()
+    exporter = MetricsExporter(wheel)
+    write_threads = []
+    write_file = exporter._write_file
+
+    def recording_write_file():
+        write_threads.append(threading.current_thread())
+        write_file()
+
+    exporter._write_file = recording_write_file
+    try:
+        exporter.configure(parse_metrics({"file": str(path), "file_interval": 0.05}))
+        deadline = time.monotonic() + 2
+        while len(write_threads) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        # 写完一次后会安排下一次
+        assert len(write_threads) >= 2
+        assert wheel._thread not in write_threads
+        assert "randomreply" in path.read_text(encoding="utf-8")
+    finally:
+        exporter.close()
+        wheel.stop()
@@ -0,0 +1,82 @@
+import cProfile
+import os
+import threading
+import time
+
+from random_reply import profiler
+from random_reply.profiler import HandlerProfiler, parse_profiling
+from random_reply.timer_wheel import TimerWheel
+
+
+def _profiler(tmp_path, **options):
+    wheel = TimerWheel()
+    handler_profiler = HandlerProfiler(wheel)
+    handler_profiler.configure(parse_profiling(dict({"enabled": True, "sample_rate": 1,
+                                                     "output_dir": str(tmp_path)}, **options)))
+    return wheel, handler_profiler
+
+
+def test_concurrent_calls_all_run_with_one_profiled(tmp_path):
+    wheel, handler_profiler = _profiler(tmp_path)
+    try:
+        barrier = threading.Barrier(8, timeout=2)
+        calls = []
+
+        def handler(i):
+            # 所有调用同时处于处理器中，任何一个被剖析阻塞都会导致barrier超时
+            barrier.wait()
+            calls.append(i)
+
+        wrapped = handler_profiler.wrap("handler", handler)
+        threads = [threading.Thread(target=wrapped, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert sorted(calls) == list(range(8))
+        assert handler_profiler._profiles["handler"].calls == 1
+    finally:
+        handler_profiler.close()
+        wheel.stop()
+
+
+class _BusyProfile(cProfile.Profile):
+    def enable(self, *args, **kwargs):
+        raise ValueError("Another profiling tool is already active")
+
+
+def test_handler_runs_unprofiled_when_profiler_is_busy(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiler.cProfile, "Profile", _BusyProfile)
+    wheel, handler_profiler = _profiler(tmp_path)
+    try:
+        wrapped = handler_profiler.wrap("handler", lambda x: x * 2)
+        assert wrapped(21) == 42
+        assert handler_profiler._profiles["handler"].calls == 0
+        # 锁已经释放，之后的调用仍然会尝试剖析
+        assert profiler._PROFILE_LOCK.acquire(False)
+        profiler._PROFILE_LOCK.release()
+    finally:
+        handler_profiler.close()
+        wheel.stop()
+
+
+def test_periodic_flush_runs_off_timer_thread(tmp_path):
+    wheel, handler_profiler = _profiler(tmp_path, interval_seconds=0.05)
+    flush_threads = []
+    flush = handler_profiler._flush
+
+    def recording_flush(config):
+        flush_threads.append(threading.current_thread())
+        flush(config)
+
+    handler_profiler._flush = recording_flush
+    try:
+        handler_profiler.wrap("handler", lambda: None)()
+        deadline = time.monotonic() + 2
+        while not any(name.startswith("summary-") for name in os.listdir(tmp_path)) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert any(name.startswith("summary-") for name in os.listdir(tmp_path))
+        assert flush_threads and wheel._thread not in flush_threads
+    finally:
+        handler_profiler.close()
+        wheel.stop()
@@ -0,0 +1,191 @@
+import gc
+import importlib
+import socket
+import sys
+import threading
+import time
+import weakref
+
+import bench_pipeline
+import fakes
+from random_reply.config_loader import build_snapshot
+from random_reply.random_reply import RandomReply
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _new_plugin(config):
+    plugin = RandomReply()
+    plugin._publish(build_snapshot(config))
+    return plugin
+
+
+def _receive(plugin, channel, content):
+    context = bench_pipeline.make_context((content, "group1@chatroom", "wxid_user1", False), channel)
+    e_context = fakes.EventContext(fakes.Event.ON_RECEIVE_MESSAGE, {"context": context})
+    plugin.on_receive_message(e_context)
+    return e_context
+
+
+def _wait_for(predicate, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not predicate() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return predicate()
+
+
+def test_reload_closes_previous_instance_without_leaking_threads(tmp_path):
+    baseline = set(threading.enumerate())
+    config = {
+        "probability": 1000,
+        "protect_private_msgs": False,
+        "min_msg_length": 1,
+        "trigger_keywords": ["你好"],
+        "metrics": {"http_port": _free_port()},
+        "coalesce": {"enabled": True, "window_seconds": 30},
+        "dispatch_queue": {"enabled": True},
+        "state_backend": {"type": "sqlite", "path": str(tmp_path / "state.sqlite3")},
+    }
+    channel = fakes.GeWeChatChannel()
+    original_send = channel.send
+
+    old = _new_plugin(config)
+    # 关键词消息经分发队列提交，普通消息进入合并缓冲区等待定时器
+    assert _receive(old, channel, "你好").action == fakes.EventAction.BREAK
+    _receive(old, channel, "随便聊聊")
+    assert _wait_for(lambda: len(channel.produced) == 1)
+    old.on_send_reply(fakes.EventContext(fakes.Event.ON_SEND_REPLY, {
+        "channel": channel, "context": channel.produced[0], "reply": fakes.Reply(fakes.ReplyType.TEXT, "回复")}))
+    assert channel.send is not original_send
+    assert set(threading.enumerate()) - baseline
+
+    # dow重新加载插件时直接创建新实例，旧实例应被关闭并可以被回收，新实例可以绑定同一个指标端口
+    old_ref = weakref.ref(old)
+    del old
+    new = _new_plugin(config)
+    gc.collect()
+    assert old_ref() is None
+    assert new._metrics_exporter._server is not None
+    assert channel.send == original_send
+
+    new.close()
+    new.close()
+    assert _wait_for(lambda: not (set(threading.enumerate()) - baseline)), set(threading.enumerate()) - baseline
+
+
+def test_module_reload_closes_previous_instance():
+    """dow的#scanp用importlib.reload重新执行插件模块，新的类也要能找到并关闭旧实例"""
+    baseline = set(threading.enumerate())
+    config = {"metrics": {"http_port": _free_port()}}
+    old = _new_plugin(config)
+    module = importlib.reload(sys.modules["random_reply.random_reply"])
+    new = module.RandomReply()
+    try:
+        assert old._closed
+        new._publish(build_snapshot(config))
+        assert new._metrics_exporter._server is not None
+    finally:
+        new.close()
+    assert _wait_for(lambda: not (set(threading.enumerate()) - baseline)), set(threading.enumerate()) - baseline
+
+
+class _BlockingGeWeChatChannel(fakes.GeWeChatChannel):
+    def __init__(self):
+        super().__init__()
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def produce(self, context):
+        self.started.set()
+        self.release.wait(5)
+        super().produce(context)
+
+
+def test_coalesced_flush_does_not_block_timer_wheel():
+    config = {
+        "probability": 1000,
+        "protect_private_msgs": False,
+        "min_msg_length": 1,
+        "coalesce": {"enabled": True, "window_seconds": 0.1},
+        "dispatch_queue": {"enabled": False},
+    }
+    channel = _BlockingGeWeChatChannel()
+    plugin = _new_plugin(config)
+    try:
+        _receive(plugin, channel, "随便聊聊")
+        assert channel.started.wait(2)
+        # produce()阻塞期间时间轮上的其他定时任务照常执行
+        fired = threading.Event()
+        plugin._timer_wheel.schedule(0.1, fired.set)
+        assert fired.wait(1)
+    finally:
+        channel.release.set()
+        plugin.close()
+    assert len(channel.produced) == 1
+
+
+class _SendRecorder:
+    """记录ON_SEND_REPLY事件的插件"""
+
+    def __init__(self):
+        self.replies = []
+        self.handlers = {fakes.Event.ON_SEND_REPLY: lambda e_context: self.replies.append(e_context["reply"].content)}
+
+
+def test_cached_reply_is_decorated_and_sent_like_generated_reply(monkeypatch):
+    config = {
+        "probability": 0,
+        "protect_private_msgs": False,
+        "min_msg_length": 1,
+        "trigger_keywords": ["你好"],
+        "reply_cache": {"enabled": True},
+        "dispatch_queue": {"enabled": False},
+    }
+    monkeypatch.setitem(fakes.global_config, "group_chat_reply_prefix", "[机器人] ")
+    recorder = _SendRecorder()
+    channel = fakes.GeWeChatChannel()
+    plugin = _new_plugin(config)
+    monkeypatch.setattr(fakes.PluginManager(), "instances", [plugin, recorder])
+    try:
+        # 未命中：请求后端，由channel按dow的流程装饰并发送后端生成的回复
+        assert _receive(plugin, channel, "你好").action == fakes.EventAction.BREAK
+        context = channel.produced.popleft()
+        channel._send_reply(context, channel._decorate_reply(context, fakes.Reply(fakes.ReplyType.TEXT, '"你好呀"')))
+
+        # 命中：不再请求后端
+        assert _receive(plugin, channel, "你好").action == fakes.EventAction.BREAK
+        assert not channel.produced
+    finally:
+        plugin.close()
+
+    miss, hit = channel.replies
+    assert miss == hit == (fakes.ReplyType.TEXT, "[机器人] @测试用户\n你好呀")
+    assert recorder.replies == ["[机器人] @测试用户\n你好呀"] * 2
+
+
+def test_reload_keeps_previous_snapshot_when_keyword_config_is_partial(tmp_path):
+    config_path = tmp_path / "config.json"
+    keyword_path = tmp_path / "keyword.json"
+    config_path.write_text('{"use_keyword_plugin": true}', encoding="utf-8")
+    keyword_path.write_text('{"keyword": {"天气": "晴", "你好": "你好呀"}}', encoding="utf-8")
+    plugin = RandomReply()
+    try:
+        plugin._config_path = str(config_path)
+        plugin._keyword_config_path = str(keyword_path)
+        plugin._reload_config()
+        assert len(plugin._snapshot.policy.trigger_index) == 2
+
+        # keyword插件正在写入配置文件
+        keyword_path.write_text('{"keyword": {"天气": "晴", "你', encoding="utf-8")
+        plugin._reload_config()
+        assert len(plugin._snapshot.policy.trigger_index) == 2
+
+        keyword_path.write_text('{"keyword": {"天气": "晴"}}', encoding="utf-8")
+        plugin._reload_config()
+        assert len(plugin._snapshot.policy.trigger_index) == 1
+    finally:
+        plugin.close()
@@ -0,0 +1,59 @@
+from random_reply.rate_limiter import TokenBucketLimiter, parse_rate_limit
+from random_reply.state_backend import MemoryStateBackend
+
+
+def _config(**options):
+    value = {"enabled": True, "group_per_minute": 0, "user_per_minute": 0, "global_per_minute": 0}
+    value.update(options)
+    return parse_rate_limit(value)
+
+
+def test_rate_limit_is_disabled_unless_enabled():
+    assert parse_rate_limit(None) is None
+    assert parse_rate_limit({"group_per_minute": 2}) is None
+
+
+def test_group_bucket_allows_burst_then_refills():
+    limiter = TokenBucketLimiter(MemoryStateBackend())
+    config = _config(group_per_minute=60, group_burst=2)
+    assert limiter.try_acquire(config, "g1", "u1", now=0.0)
+    assert limiter.try_acquire(config, "g1", "u2", now=0.0)
+    assert not limiter.try_acquire(config, "g1", "u3", now=0.0)
+    # 每个群有各自的桶
+    assert limiter.try_acquire(config, "g2", "u1", now=0.0)
+    # 每秒补充一个令牌，不超过容量
+    assert not limiter.try_acquire(config, "g1", "u1", now=0.5)
+    assert limiter.try_acquire(config, "g1", "u1", now=1.0)
+    assert not limiter.try_acquire(config, "g1", "u1", now=1.0)
+    assert limiter.try_acquire(config, "g1", "u1", now=100.0)
+    assert limiter.try_acquire(config, "g1", "u1", now=100.0)
+    assert not limiter.try_acquire(config, "g1", "u1", now=100.0)
+
+
+def test_user_bucket_is_shared_across_groups():
+    limiter = TokenBucketLimiter(MemoryStateBackend())
+    config = _config(user_per_minute=6, user_burst=1)
+    assert limiter.try_acquire(config, "g1", "u1", now=0.0)
+    assert not limiter.try_acquire(config, "g2", "u1", now=0.0)
+    assert limiter.try_acquire(config, "g2", "u2", now=0.0)
+    assert limiter.try_acquire(config, "g2", "u1", now=10.0)
+
+
+def test_buckets_are_consumed_all_or_nothing():
+    limiter = TokenBucketLimiter(MemoryStateBackend())
+    config = _config(group_per_minute=1, group_burst=1, global_per_minute=1, global_burst=2)
+    assert limiter.try_acquire(config, "g1", "u1", now=0.0)
+    # 群桶已空，全局桶的令牌不应被扣减
+    assert not limiter.try_acquire(config, "g1", "u1", now=0.0)
+    assert not limiter.try_acquire(config, "g1", "u1", now=0.0)
+    assert limiter.try_acquire(config, "g2", "u1", now=0.0)
+    assert not limiter.try_acquire(config, "g3", "u1", now=0.0)
+
+
+def test_would_allow_does_not_consume_tokens():
+    limiter = TokenBucketLimiter(MemoryStateBackend())
+    config = _config(group_per_minute=1, group_burst=1)
+    assert limiter.would_allow(config, "g1", "u1", now=0.0)
+    assert limiter.would_allow(config, "g1", "u1", now=0.0)
+    assert limiter.try_acquire(config, "g1", "u1", now=0.0)
+    assert not limiter.would_allow(config, "g1", "u1", now=0.0)
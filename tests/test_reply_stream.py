@@ -0,0 +1,57 @@
+import pytest
+
+import fakes
+from random_reply.config_loader import build_snapshot
+from random_reply.random_reply import RandomReply
+
+
+@pytest.fixture
+def plugin():
+    plugin = RandomReply()
+    try:
+        yield plugin
+    finally:
+        plugin.close()
+
+
+def _chunks(text, size):
+    return iter([text[i:i + size] for i in range(0, len(text), size)])
+
+
+@pytest.mark.parametrize("text", [
+    '"Hello" she said.',            # 开头的引号没有配对
+    '"Hello, world"',               # 首尾配对的引号
+    "  'Hello, world'  ",
+    'He said "hi" to me.',          # 引号只在中间
+    'He said "hi"',                 # 只有结尾是引号
+    '"',
+    '" Hello "  ',
+    "'Hello\"",                     # 首尾引号不同
+    '"' + "很长的一句话。" * 10 + '"',  # 需要截断的引号回复
+    '"' + "很长的一句话。" * 10,
+])
+@pytest.mark.parametrize("size", [1, 3, 100])
+def test_streamed_quotes_match_buffered_reply(plugin, text, size):
+    snapshot = build_snapshot({"max_msg_length": 40,
+                               "streaming_truncation": {"enabled": True, "sentence_boundary": False}})
+    buffered = plugin._process_reply(fakes.Reply(fakes.ReplyType.TEXT, text), snapshot.policy)
+    streamed = plugin._process_reply(fakes.Reply(fakes.ReplyType.TEXT, _chunks(text, size)), snapshot.policy,
+                                     snapshot.streaming)
+    assert "".join(streamed.content) == buffered.content
+
+
+def test_streamed_reply_is_processed_with_debug_logging(plugin):
+    plugin._publish(build_snapshot({"max_msg_length": 20, "log": {"debug": True},
+                                    "streaming_truncation": {"enabled": True}}))
+    try:
+        request_id = plugin._circuit_breaker.start("random")
+        context = fakes.Context(fakes.ContextType.TEXT, "你好", {
+            "random_reply_triggered": True, "random_reply_request_id": request_id, "receiver": "group1@chatroom"})
+        reply = fakes.Reply(fakes.ReplyType.TEXT, _chunks("很长的一句话。" * 10, 3))
+        e_context = fakes.EventContext(fakes.Event.ON_DECORATE_REPLY, {"context": context, "reply": reply})
+        plugin.on_decorate_reply(e_context)
+        assert plugin._circuit_breaker.inflight() == 0
+        content = "".join(e_context["reply"].content)
+        assert len(content) <= 20 and content.endswith("...")
+    finally:
+        plugin._publish(build_snapshot({}))
@@ -0,0 +1,60 @@
+import random
+from collections import Counter
+
+import bench_pipeline
+import fakes
+import simulate
+from random_reply.config_loader import build_snapshot
+from random_reply.random_reply import RandomReply
+
+
+class _CountingGeWeChatChannel(fakes.GeWeChatChannel):
+    # 类名以GeWeChatChannel结尾，插件才会直接使用该实例
+    def __init__(self):
+        super().__init__()
+        self.reasons = Counter()
+
+    def produce(self, context):
+        self.reasons[context.get("random_reply_reason")] += 1
+
+
+def _replay_plugin(config, messages, seed):
+    channel = _CountingGeWeChatChannel()
+    plugin = RandomReply()
+    try:
+        plugin._publish(build_snapshot(config))
+        plugin._decider._rng = random.Random(seed).random
+        for message in messages:
+            e_context = fakes.EventContext(fakes.Event.ON_RECEIVE_MESSAGE,
+                                           {"context": bench_pipeline.make_context(message, channel)})
+            plugin.on_receive_message(e_context)
+    finally:
+        plugin.close()
+    return channel.reasons
+
+
+def _replay_simulator(config, messages, seed):
+    variant = simulate.Variant("config", build_snapshot(config), tuple(fakes.global_config["group_chat_prefix"]), seed)
+    for now, (content, group_id, user_id, is_at) in enumerate(messages):
+        msg = simulate.SimMessage(group_id, "测试群", user_id, "测试用户", is_at)
+        variant.process(msg, content, True, float(now))
+    variant.finish()
+    totals = Counter()
+    for counter in variant.counts.values():
+        totals.update(counter)
+    return totals
+
+
+def test_simulator_matches_plugin_trigger_counts():
+    keywords = [f"关键词{i}" for i in range(50)]
+    config = bench_pipeline.build_case_config(len(keywords), 20, 50)
+    config["min_msg_length"] = 3
+    messages = bench_pipeline.synthetic_messages(3000, keywords, seed=7)
+
+    plugin_reasons = _replay_plugin(config, messages, seed=3)
+    simulated = _replay_simulator(config, messages, seed=3)
+
+    assert plugin_reasons["keyword"] > 0 and plugin_reasons["random"] > 0
+    assert simulated["keyword"] == plugin_reasons["keyword"]
+    assert simulated["random"] == plugin_reasons["random"]
+    assert sum(simulated.values()) == len(messages)
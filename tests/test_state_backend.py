@@ -0,0 +1,117 @@
+import gc
+import sqlite3
+import threading
+import time
+
+from random_reply import state_backend
+from random_reply.dedup import DedupConfig, DuplicateFilter
+from random_reply.rate_limiter import TokenBucketLimiter, parse_rate_limit
+from random_reply.state_backend import MemoryStateBackend, SQLiteStateBackend
+from random_reply.timer_wheel import TimerWheel
+
+
+def test_sqlite_backend_stores_wall_clock_time(tmp_path):
+    path = str(tmp_path / "state.sqlite3")
+    backend = SQLiteStateBackend(path)
+    try:
+        before = time.time()
+        DuplicateFilter(backend).check(DedupConfig(60.0, 0), "g1", "你好")
+        assert backend.acquire_tokens([("rl:global", 1.0, 1.0)])
+        with sqlite3.connect(path) as conn:
+            (expires,) = conn.execute("SELECT expires FROM kv").fetchone()
+            (updated,) = conn.execute("SELECT updated FROM buckets").fetchone()
+        assert before + 60 <= expires <= time.time() + 60
+        assert before <= updated <= time.time()
+    finally:
+        backend.close()
+
+
+def test_sqlite_state_from_before_restart_expires(tmp_path):
+    """重启前写入的状态（时间戳来自单调时钟或较早的系统时间）按实际经过的时间回补和过期"""
+    path = str(tmp_path / "state.sqlite3")
+    config = parse_rate_limit({"enabled": True, "group_per_minute": 1, "group_burst": 1,
+                               "user_per_minute": 0, "global_per_minute": 0})
+    backend = SQLiteStateBackend(path)
+    try:
+        limiter = TokenBucketLimiter(backend)
+        assert limiter.try_acquire(config, "g1", None)
+        assert not limiter.try_acquire(config, "g1", None)
+        # 模拟重启：把时间戳改为一小时前
+        with sqlite3.connect(path) as conn:
+            conn.execute("UPDATE buckets SET updated = updated - 3600")
+            conn.execute("INSERT INTO kv (key, value, expires) VALUES ('dedup:g1:x', 1, ?)", (time.monotonic() + 60,))
+        assert limiter.try_acquire(config, "g1", None)
+        assert backend.get("dedup:g1:x") is None
+    finally:
+        backend.close()
+
+
+def test_memory_backend_uses_monotonic_clock():
+    backend = MemoryStateBackend()
+    assert backend.clock is time.monotonic
+    DuplicateFilter(backend).check(DedupConfig(60.0, 0), "g1", "你好")
+    (value, expires), = backend._values.values()
+    assert expires <= time.monotonic() + 60
+
+
+def test_sqlite_cleanup_expires_and_caps_entries(tmp_path, monkeypatch):
+    monkeypatch.setattr(state_backend, "CLEANUP_BATCH", 3)
+    backend = SQLiteStateBackend(str(tmp_path / "state.sqlite3"), max_entries=5)
+    try:
+        now = time.time()
+        for i in range(10):
+            backend.add(f"expired{i}", ttl=1, now=now - 10)
+        for i in range(4):
+            backend.add(f"forever{i}", now=now)
+        for i in range(4):
+            backend.add(f"live{i}", ttl=60 + i, now=now)
+        for i in range(8):
+            backend.acquire_tokens([(f"rl:{i}", 1.0, 1.0)], now=now + i)
+        backend.cleanup(now)
+        conn = backend._connection()
+        keys = {key for (key,) in conn.execute("SELECT key FROM kv")}
+        # 先淘汰最早过期的键，没有过期时间的键最后淘汰
+        assert keys == {"live3", "forever0", "forever1", "forever2", "forever3"}
+        buckets = {key for (key,) in conn.execute("SELECT key FROM buckets")}
+        assert buckets == {f"rl:{i}" for i in range(3, 8)}
+    finally:
+        backend.close()
+
+
+def test_sqlite_cleanup_runs_off_timer_thread(tmp_path, monkeypatch):
+    monkeypatch.setattr(state_backend, "CLEANUP_INTERVAL", 0.05)
+    wheel = TimerWheel()
+    backend = SQLiteStateBackend(str(tmp_path / "state.sqlite3"), timer_wheel=wheel)
+    cleanup_threads = []
+    cleanup = backend.cleanup
+
+    def recording_cleanup(now=None):
+        cleanup_threads.append(threading.current_thread())
+        cleanup(now)
+
+    backend.cleanup = recording_cleanup
+    try:
+        backend.add("dedup:g1:x", ttl=0.01)
+        deadline = time.monotonic() + 2
+        while backend._connection().execute("SELECT COUNT(*) FROM kv").fetchone()[0] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert backend._connection().execute("SELECT COUNT(*) FROM kv").fetchone()[0] == 0
+        assert cleanup_threads and wheel._thread not in cleanup_threads
+    finally:
+        backend.close()
+        wheel.stop()
+
+
+def test_sqlite_connections_are_closed_when_threads_exit(tmp_path):
+    backend = SQLiteStateBackend(str(tmp_path / "state.sqlite3"))
+    try:
+        threads = [threading.Thread(target=backend.get, args=("dedup:g1:x",)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        gc.collect()
+        # 只剩主线程创建表结构时打开的连接
+        assert len(backend._connections) == 1
+    finally:
+        backend.close()
@@ -0,0 +1,78 @@
+import random
+
+import pytest
+
+from random_reply.trigger_index import (
+    MATCH_CONTAINS, MATCH_EXACT, MATCH_FIRST_WORD, MATCH_PREFIX, TriggerIndex, parse_match_modes,
+)
+
+# 字母表很小，随机生成的关键词之间有大量公共前缀和相互包含，容易覆盖自动机的失败链
+_ALPHABET = "ab天气，"
+
+
+def _random_text(rnd, low, high):
+    return "".join(rnd.choice(_ALPHABET) for _ in range(rnd.randint(low, high)))
+
+
+def _naive_prefix(keywords, content):
+    found = [k for k in keywords if content.startswith(k)]
+    return max(found, key=len) if found else None
+
+
+def _first_end(keywords, content):
+    """朴素查找：消息中最早结束的关键词出现位置"""
+    ends = [content.find(k) + len(k) for k in keywords if k in content]
+    return min(ends) if ends else None
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_prefix_and_contains_match_naive_search(seed):
+    rnd = random.Random(seed)
+    keywords = {_random_text(rnd, 1, 4) for _ in range(rnd.randint(1, 30))}
+    keywords = {k for k in keywords if k.strip()}
+    prefix_index = TriggerIndex(keywords, (MATCH_PREFIX,))
+    contains_index = TriggerIndex(keywords, (MATCH_CONTAINS,))
+    for _ in range(300):
+        content = _random_text(rnd, 1, 12)
+
+        expected = _naive_prefix(keywords, content)
+        assert prefix_index.match(content) == ((MATCH_PREFIX, expected) if expected else None), content
+
+        end = _first_end(keywords, content)
+        result = contains_index.match(content)
+        if end is None:
+            assert result is None, content
+        else:
+            # 自动机返回最早结束的那个位置上的某个关键词
+            mode, keyword = result
+            assert mode == MATCH_CONTAINS and keyword in keywords
+            assert content.find(keyword) + len(keyword) == end, content
+
+
+def test_modes_are_checked_in_fixed_order():
+    index = TriggerIndex(["天气", "天气北京", "北京"], parse_match_modes(["contains", "prefix", "first_word", "exact"]))
+    assert index.match("天气北京") == (MATCH_EXACT, "天气北京")
+    assert index.match("天气，北京") == (MATCH_FIRST_WORD, "天气")
+    assert index.match("天气北京市") == (MATCH_PREFIX, "天气北京")
+    assert index.match("去北京") == (MATCH_CONTAINS, "北京")
+    assert index.match("上海") is None
+
+
+def test_blank_keywords_are_ignored():
+    index = TriggerIndex(["", "  ", " 天气 "], (MATCH_EXACT,))
+    assert len(index) == 1
+    assert index.match("天气") == (MATCH_EXACT, "天气")
+    assert not TriggerIndex([" "], (MATCH_CONTAINS,))
+
+
+def test_first_word_splits_on_whitespace_and_chinese_punctuation_only():
+    index = TriggerIndex(["天气", "v1", "http", "a"], parse_match_modes(["first_word"]))
+    assert index.match("天气 北京") == (MATCH_FIRST_WORD, "天气")
+    assert index.match("天气　北京") == (MATCH_FIRST_WORD, "天气")
+    assert index.match("天气：北京") == (MATCH_FIRST_WORD, "天气")
+    assert index.match("a b") == (MATCH_FIRST_WORD, "a")
+    # 英文标点是词的一部分
+    assert index.match("v1.2") is None
+    assert index.match("http://example.com") is None
+    assert index.match("a.b") is None
+    assert index.match("天气,北京") is None
@@ -0,0 +1,124 @@
+import logging
+import math
+import threading
+import time
+
+from .plugin_log import logger
+
+
+class Timeout:
+    """时间轮中的一个定时任务，可通过cancel()取消"""
+
+    __slots__ = ("wheel", "callback", "args", "slot", "rounds", "cancelled")
+
+    def __init__(self, wheel, callback, args, slot, rounds):
+        self.wheel = wheel
+        self.callback = callback
+        self.args = args
+        self.slot = slot
+        self.rounds = rounds
+        self.cancelled = False
+
+    def cancel(self):
+        self.wheel.cancel(self)
+
+
+class TimerWheel:
+    """哈希时间轮，所有定时任务共用一个守护线程
+
+    schedule和cancel都是O(1)，线程数量不随消息量增长。
+    定时精度为一个tick，回调在时间轮线程中执行，只应做轻量的工作。
+    没有待执行任务时线程阻塞等待，不会空转。
+    """
+
+    def __init__(self, tick=0.1, slots=512, name="RandomReplyTimerWheel"):
+        self.tick = tick
+        self._slots = [dict() for _ in range(slots)]
+        self._cond = threading.Condition(threading.Lock())
+        self._tick = 0
+        self._start = time.monotonic()
+        self._pending = 0
+        self._stopped = False
+        self._name = name
+        self._thread = None
+
+    def schedule(self, delay, callback, *args):
+        """delay秒后在时间轮线程中调用callback(*args)，返回Timeout"""
+        ticks = max(1, math.ceil(delay / self.tick))
+        n = len(self._slots)
+        with self._cond:
+            if self._pending == 0:
+                # 空闲期间时间轮没有推进，重新对齐起始时间
+                self._start = time.monotonic() - self._tick * self.tick
+            slot = (self._tick + ticks) % n
+            timeout = Timeout(self, callback, args, slot, (ticks - 1) // n)
+            if self._stopped:
+                # 已停止的时间轮不再接受任务，返回的Timeout不会被执行
+                timeout.cancelled = True
+                return timeout
+            self._slots[slot][id(timeout)] = timeout
+            self._pending += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+                self._thread.start()
+            elif self._pending == 1:
+                self._cond.notify()
+        return timeout
+
+    def cancel(self, timeout):
+        """取消定时任务，已执行或已取消的任务忽略"""
+        with self._cond:
+            if timeout.cancelled:
+                return
+            timeout.cancelled = True
+            if self._slots[timeout.slot].pop(id(timeout), None) is not None:
+                self._pending -= 1
+
+    def __len__(self):
+        return self._pending
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending == 0 and not self._stopped:
+                    self._cond.wait()
+                if self._stopped:
+                    return
+                next_time = self._start + (self._tick + 1) * self.tick
+
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            expired = []
+            with self._cond:
+                self._tick += 1
+                bucket = self._slots[self._tick % len(self._slots)]
+                for key, timeout in list(bucket.items()):
+                    if timeout.rounds > 0:
+                        timeout.rounds -= 1
+                    else:
+                        del bucket[key]
+                        timeout.cancelled = True
+                        expired.append(timeout)
+                self._pending -= len(expired)
+
+            for timeout in expired:
+                try:
+                    timeout.callback(*timeout.args)
+                except Exception as e:
+                    logger.limited(logging.ERROR, "timer_task", "[RandomReply] 定时任务执行出错: %s", e, exc_info=True)
+
+    def stop(self, timeout=5.0):
+        """停止时间轮线程并等待其退出，未执行的任务直接丢弃"""
+        with self._cond:
+            self._stopped = True
+            for bucket in self._slots:
+                for pending in bucket.values():
+                    pending.cancelled = True
+                bucket.clear()
+            self._pending = 0
+            self._cond.notify()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join(timeout)
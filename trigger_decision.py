@@ -0,0 +1,55 @@
+import random
+
+from .adaptive_probability import AdaptiveProbability
+from .dedup import DuplicateFilter
+from .rate_limiter import TokenBucketLimiter
+
+
+class TriggerDecider:
+    """对通过过滤的消息做触发判断
+
+    依次执行去重、限流预检、（自适应）概率、随机抽取、熔断检查和扣减限流预算，
+    返回(结果, 概率)：结果为触发原因（keyword、random）或拒绝原因（duplicate、rate_limit、
+    circuit_open、probability）。插件和离线模拟工具共用这一套判断，
+    now为None时各组件使用当前时间，模拟时传入消息的时间戳；rng可替换为固定种子的随机数生成器。
+    """
+
+    def __init__(self, rng=random.random):
+        self._rng = rng
+        self.adaptive_probability = AdaptiveProbability()
+        self.rate_limiter = None
+        self.duplicate_filter = None
+
+    def use_backend(self, backend):
+        """限流和去重改用新的状态后端"""
+        self.rate_limiter = TokenBucketLimiter(backend)
+        self.duplicate_filter = DuplicateFilter(backend)
+
+    def decide(self, snapshot, policy, group_id, user_id, cleaned_content, keyword_triggered,
+               allow_random=None, now=None):
+        """allow_random为熔断检查，返回是否允许随机触发，为None时不检查"""
+        if keyword_triggered:
+            return "keyword", policy.probability
+
+        # 抑制窗口期内重复出现的消息（刷屏、转发接龙），避免同一内容反复触发
+        if snapshot.dedup and self.duplicate_filter.check(snapshot.dedup, group_id, cleaned_content, now):
+            return "duplicate", policy.probability
+
+        # 随机触发前先检查限流预算，预算耗尽时不再进行随机判断
+        rate_limit = snapshot.rate_limit
+        if rate_limit and not self.rate_limiter.would_allow(rate_limit, group_id, user_id, now):
+            return "rate_limit", policy.probability
+
+        # 随机回复概率（0-1000），启用自适应概率时按群组消息速率计算，可能带小数
+        probability = policy.probability
+        if policy.adaptive:
+            probability = self.adaptive_probability.probability(policy.adaptive, group_id, now)
+
+        if not (probability >= 1000 or (probability > 0 and self._rng() * 1000 < probability)):
+            return "probability", probability
+        # 后端熔断期间暂停随机触发，半开状态只放行少量探测请求
+        if allow_random is not None and not allow_random():
+            return "circuit_open", probability
+        if rate_limit and not self.rate_limiter.try_acquire(rate_limit, group_id, user_id, now):
+            return "rate_limit", probability
+        return "random", probability
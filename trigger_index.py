@@ -0,0 +1,154 @@
+import re
+
+# 关键词匹配方式
+MATCH_EXACT = "exact"            # 完全匹配
+MATCH_FIRST_WORD = "first_word"  # 首词匹配
+MATCH_PREFIX = "prefix"          # 前缀匹配
+MATCH_CONTAINS = "contains"      # 包含匹配
+
+# 默认匹配方式，与旧版本行为保持一致
+DEFAULT_MATCH_MODES = (MATCH_EXACT, MATCH_FIRST_WORD)
+
+MATCH_MODE_NAMES = {
+    MATCH_EXACT: "完全匹配",
+    MATCH_FIRST_WORD: "首词匹配",
+    MATCH_PREFIX: "前缀匹配",
+    MATCH_CONTAINS: "包含匹配",
+}
+
+# 首词分隔符：半角/全角空格、制表换行以及中文标点。英文标点常出现在版本号、网址、
+# 文件名中（"v1.2"、"http://..."），不作为分隔符，否则会按这些内容的前缀误触发
+_FIRST_WORD_DELIMITER = re.compile(r"[\s　，。！？、；：]")
+
+
+class TriggerIndex:
+    """不可变的触发关键词索引
+
+    构建时一次性生成哈希集合、前缀树和Aho-Corasick自动机，
+    查询耗时只与消息长度有关，与关键词数量无关。
+    替换时直接整体赋值新实例即可，读取方无需加锁。
+    """
+
+    __slots__ = ("keywords", "modes", "_trie", "_ac_goto", "_ac_fail", "_ac_out")
+
+    def __init__(self, keywords=(), modes=DEFAULT_MATCH_MODES):
+        self.keywords = frozenset(
+            k.strip() for k in keywords if isinstance(k, str) and k.strip()
+        )
+        self.modes = tuple(m for m in MATCH_MODE_NAMES if m in modes)
+        self._trie = self._build_trie(self.keywords) if MATCH_PREFIX in self.modes else None
+        if MATCH_CONTAINS in self.modes:
+            self._ac_goto, self._ac_fail, self._ac_out = self._build_automaton(self.keywords)
+        else:
+            self._ac_goto = self._ac_fail = self._ac_out = None
+
+    def __len__(self):
+        return len(self.keywords)
+
+    def __bool__(self):
+        return bool(self.keywords)
+
+    @staticmethod
+    def _build_trie(keywords):
+        """构建前缀树，节点为dict，键None存放以该节点结尾的关键词"""
+        root = {}
+        for keyword in keywords:
+            node = root
+            for ch in keyword:
+                node = node.setdefault(ch, {})
+            node[None] = keyword
+        return root
+
+    @staticmethod
+    def _build_automaton(keywords):
+        """构建Aho-Corasick自动机，返回(goto表, fail表, 输出表)"""
+        goto = [{}]
+        out = [None]
+        for keyword in keywords:
+            state = 0
+            for ch in keyword:
+                nxt = goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[state][ch] = nxt
+                    goto.append({})
+                    out.append(None)
+                state = nxt
+            # 同一节点只保留一个关键词即可判定命中
+            out[state] = keyword
+
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())
+        head = 0
+        while head < len(queue):
+            state = queue[head]
+            head += 1
+            for ch, nxt in goto[state].items():
+                queue.append(nxt)
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                # 沿失败链继承输出，保证较短关键词也能被发现
+                if out[nxt] is None:
+                    out[nxt] = out[fail[nxt]]
+        return goto, fail, out
+
+    def match(self, content):
+        """按配置的匹配方式依次查找，返回(匹配方式, 关键词)，未命中返回None"""
+        if not content or not self.keywords:
+            return None
+
+        for mode in self.modes:
+            if mode == MATCH_EXACT:
+                if content in self.keywords:
+                    return MATCH_EXACT, content
+            elif mode == MATCH_FIRST_WORD:
+                m = _FIRST_WORD_DELIMITER.search(content)
+                if m and m.start() > 0:
+                    first_word = content[:m.start()]
+                    if first_word in self.keywords:
+                        return MATCH_FIRST_WORD, first_word
+            elif mode == MATCH_PREFIX:
+                keyword = self._match_prefix(content)
+                if keyword:
+                    return MATCH_PREFIX, keyword
+            elif mode == MATCH_CONTAINS:
+                keyword = self._match_contains(content)
+                if keyword:
+                    return MATCH_CONTAINS, keyword
+        return None
+
+    def _match_prefix(self, content):
+        """返回作为消息前缀的最长关键词"""
+        node = self._trie
+        found = None
+        for ch in content:
+            node = node.get(ch)
+            if node is None:
+                break
+            if None in node:
+                found = node[None]
+        return found
+
+    def _match_contains(self, content):
+        """返回消息中出现的第一个关键词"""
+        goto, fail, out = self._ac_goto, self._ac_fail, self._ac_out
+        state = 0
+        for ch in content:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if out[state] is not None:
+                return out[state]
+        return None
+
+
+def parse_match_modes(value):
+    """解析配置中的keyword_match_modes，忽略未知的匹配方式"""
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, (list, tuple)):
+        return DEFAULT_MATCH_MODES
+    modes = tuple(m for m in value if m in MATCH_MODE_NAMES)
+    return modes or DEFAULT_MATCH_MODES